@@ -0,0 +1,284 @@
+import numpy as np
+import threading
+import time
+
+from scoring import EMBEDDING_DIM, normalize_rows
+
+
+class _InvertedList:
+    """Growable block of vectors / ids / prices for one IVF cell."""
+
+    def __init__(self, dim, capacity=16):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.prices = np.zeros(capacity, dtype=np.float32)
+        self.size = 0
+
+    def append(self, nft_id, vector, price):
+        if self.size == len(self.ids):
+            capacity = len(self.ids) * 2
+            self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+            self.ids = np.resize(self.ids, capacity)
+            self.prices = np.resize(self.prices, capacity)
+
+        self.vectors[self.size] = vector
+        self.ids[self.size] = nft_id
+        self.prices[self.size] = price
+        self.size += 1
+        return self.size - 1
+
+    def pop(self, pos):
+        """Swap remove the entry at pos, returns the id that moved into pos (or None)."""
+        last = self.size - 1
+        moved = None
+        if pos != last:
+            self.vectors[pos] = self.vectors[last]
+            self.ids[pos] = self.ids[last]
+            self.prices[pos] = self.prices[last]
+            moved = int(self.ids[pos])
+        self.size -= 1
+        return moved
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Spherical k-means on normalized vectors, returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                # re seed empty cells with a random point
+                centroids[c] = vectors[rng.integers(len(vectors))]
+        centroids = normalize_rows(centroids)
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted file index over the nft image embeddings.
+
+    Vectors are bucketed by their nearest k-means centroid. A query only scans
+    the `nprobe` closest buckets, so nprobe is the recall/latency knob: higher
+    nprobe means better recall and slower queries, nprobe == n_lists is exact.
+    Until there are `min_train` vectors everything lives in a single bucket,
+    which is just a brute force scan.
+
+    Safe to share between threads: searches and updates take a lock, and a
+    retrain runs k-means on a copy outside of it, only re-bucketing under it.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, nprobe=8, n_lists=None, min_train=1024, seed=0):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.n_lists = n_lists
+        self.min_train = min_train
+        self.seed = seed
+
+        self.centroids = np.zeros((1, dim), dtype=np.float32)
+        self.lists = [_InvertedList(dim)]
+        self.positions = {}  # nft id -> (list, position)
+        self.trained_size = 0
+        self._lock = threading.RLock()
+        self._training = False
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, nft_id):
+        return nft_id in self.positions
+
+    @classmethod
+    def build(cls, ids, vectors, prices, **kwargs):
+        index = cls(**kwargs)
+        index.add_many(ids, vectors, prices)
+        return index
+
+    def _prepare(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        return normalize_rows(vectors)
+
+    def add(self, nft_id, vector, price):
+        self.add_many([nft_id], [vector], [price])
+
+    def add_many(self, ids, vectors, prices):
+        if len(ids) == 0:
+            return
+        vectors = self._prepare(vectors)
+
+        with self._lock:
+            # re-assign every existing entry so an id can be re-added with new data
+            for nft_id in ids:
+                self.remove(nft_id)
+
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+            for nft_id, vector, price, cell in zip(ids, vectors, prices, assignment):
+                pos = self.lists[cell].append(nft_id, vector, price)
+                self.positions[int(nft_id)] = (int(cell), pos)
+
+            # retrain once the index has grown a lot since the last training
+            retrain = len(self) >= self.min_train and len(self) >= 4 * self.trained_size and not self._training
+
+        if retrain:
+            self.retrain()
+
+    def remove(self, nft_id):
+        with self._lock:
+            location = self.positions.pop(int(nft_id), None)
+            if location is None:
+                return False
+
+            cell, pos = location
+            moved = self.lists[cell].pop(pos)
+            if moved is not None:
+                self.positions[moved] = (cell, pos)
+            return True
+
+    def update_price(self, nft_id, price):
+        with self._lock:
+            location = self.positions.get(int(nft_id))
+            if location is None:
+                return False
+            cell, pos = location
+            self.lists[cell].prices[pos] = price
+            return True
+
+    def _all_entries(self):
+        vectors = np.concatenate([l.vectors[:l.size] for l in self.lists])
+        ids = np.concatenate([l.ids[:l.size] for l in self.lists])
+        prices = np.concatenate([l.prices[:l.size] for l in self.lists])
+        return ids, vectors, prices
+
+    def retrain(self):
+        """Recompute the centroids from everything stored and re-bucket all entries."""
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+            _, vectors, _ = self._all_entries()
+        try:
+            n_lists = self.n_lists or max(1, int(np.sqrt(len(vectors))))
+            n_lists = min(n_lists, len(vectors))
+            print(f"training ivf index on {len(vectors)} vectors with {n_lists} lists")
+            centroids = kmeans(vectors, n_lists, seed=self.seed)
+
+            # entries may have changed while training, bucket what is there now
+            with self._lock:
+                ids, vectors, prices = self._all_entries()
+                lists = [_InvertedList(self.dim) for _ in range(n_lists)]
+                positions = {}
+                assignment = np.argmax(vectors @ centroids.T, axis=1)
+                for nft_id, vector, price, cell in zip(ids, vectors, prices, assignment):
+                    pos = lists[cell].append(nft_id, vector, price)
+                    positions[int(nft_id)] = (int(cell), pos)
+                self.centroids, self.lists, self.positions = centroids, lists, positions
+                self.trained_size = len(ids)
+        finally:
+            self._training = False
+
+    def search(self, query, price_cap=None, k=10, nprobe=None):
+        """
+        Return (ids, scores) of the k best entries with price <= price_cap, best first.
+        If the probed buckets don't hold k affordable entries, nprobe is widened.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            return self._search(query, price_cap, k, nprobe)
+
+    def _search(self, query, price_cap, k, nprobe):
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        cell_order = np.argsort(-(self.centroids @ query))
+
+        while True:
+            ids, scores = [], []
+            for cell in cell_order[:nprobe]:
+                l = self.lists[cell]
+                if l.size == 0:
+                    continue
+                s = l.vectors[:l.size] @ query
+                if price_cap is not None:
+                    s = np.where(l.prices[:l.size] <= price_cap, s, -np.inf)
+                ids.append(l.ids[:l.size])
+                scores.append(s)
+
+            if ids:
+                ids = np.concatenate(ids)
+                scores = np.concatenate(scores)
+                keep = np.isfinite(scores)
+                ids, scores = ids[keep], scores[keep]
+            else:
+                ids, scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+            if len(ids) >= k or nprobe >= len(self.lists):
+                break
+            nprobe = min(nprobe * 2, len(self.lists))
+
+        if len(ids) == 0:
+            return [], []
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return ids[top].tolist(), scores[top].tolist()
+
+
+def recall_at_k(index, ids, vectors, prices, queries, k=10, price_cap=None, nprobe=None):
+    """Fraction of the exact top-k (brute force) that the index also returns, averaged over queries."""
+    ids = np.asarray(ids)
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    prices = np.asarray(prices, dtype=np.float32)
+
+    hits = 0
+    total = 0
+    for query in queries:
+        exact = vectors @ np.asarray(query, dtype=np.float32)
+        if price_cap is not None:
+            exact = np.where(prices <= price_cap, exact, -np.inf)
+        exact_top = set(ids[np.argsort(-exact)[:k]].tolist())
+
+        found, _ = index.search(query, price_cap=price_cap, k=k, nprobe=nprobe)
+        hits += len(exact_top.intersection(found))
+        total += len(exact_top)
+
+    return hits / total if total else 1.0
+
+
+def benchmark(n=100_000, n_queries=100, k=10, dim=EMBEDDING_DIM, seed=0):
+    rng = np.random.default_rng(seed)
+
+    # nfts in a collection look alike, so fake the catalog as clusters
+    n_collections = max(1, n // 200)
+    centers = normalize_rows(rng.standard_normal((n_collections, dim), dtype=np.float32))
+    members = rng.integers(n_collections, size=n)
+    vectors = normalize_rows(centers[members] + 2 * rng.standard_normal((n, dim), dtype=np.float32) / np.sqrt(dim))
+    prices = rng.uniform(0, 20, n).astype(np.float32)
+    ids = np.arange(n)
+    queries = normalize_rows(centers[rng.integers(n_collections, size=n_queries)] + rng.standard_normal((n_queries, dim), dtype=np.float32) / np.sqrt(dim))
+
+    start = time.perf_counter()
+    index = IVFIndex.build(ids, vectors, prices, dim=dim)
+    print(f"built index over {n} vectors in {time.perf_counter() - start:.2f}s ({len(index.lists)} lists)")
+
+    start = time.perf_counter()
+    for q in queries:
+        exact = np.where(prices <= 10, vectors @ q, -np.inf)
+        np.argpartition(-exact, k)[:k]
+    brute = (time.perf_counter() - start) / n_queries
+    print(f"brute force: {brute * 1000:.2f} ms/query")
+
+    for nprobe in (1, 4, 8, 16, 32, 64):
+        start = time.perf_counter()
+        for q in queries:
+            index.search(q, price_cap=10, k=k, nprobe=nprobe)
+        latency = (time.perf_counter() - start) / n_queries
+        recall = recall_at_k(index, ids, vectors, prices, queries, k=k, price_cap=10, nprobe=nprobe)
+        print(f"nprobe {nprobe:>3}: recall@{k} {recall:.3f} | {latency * 1000:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    benchmark()
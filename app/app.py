@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, url_for
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 import os
@@ -10,75 +10,52 @@ import torch
 import torch.nn.functional as F
 from transformers import AutoImageProcessor, AutoModel
 from PIL import Image, UnidentifiedImageError
+from contextlib import contextmanager
 import threading
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import http_client
 from io import BytesIO
 from bs4 import BeautifulSoup
-from web3 import Web3
 import time
-from multipipline_api import getNftWithPriceCeling, getBestListingNFT, getNFT
-from buy_transfer import buy_nft
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from multipipline_api import getBestListingNFT
+from async_crawler import iterNftWithPriceCelingAsync
+from buy_transfer import buy_nft, buy_batch, share_nonces
 from email_app import send_template_email
+from scoring import EMBEDDING_DIM, NFTCatalog, CatalogCache, assign_orders, claim_picks
+from ann_index import IVFIndex
+from collection_index import CollectionIndex, search as collection_search
+import pgvector_store
+import compact
+from snapshot import SnapshotReader, write_snapshot
+from preference_cache import EmbeddingCache, PreferenceEmbedder
+import image_pipeline
+from ingest_worker import IngestWorker, advisory_lock, stale_ids, upsert_chunks, INGEST_LOCK_KEY
+import event_stream
+import asyncio
+from image_cache import ImageEmbeddingCache
+from payment_confirmer import PaymentConfirmer, to_wei
+from payment_indexer import PaymentIndexer
+import re
 
 # load model for image embeddings
 vision_processor = AutoImageProcessor.from_pretrained("nomic-ai/nomic-embed-vision-v1.5")
 vision_model = AutoModel.from_pretrained("nomic-ai/nomic-embed-vision-v1.5", trust_remote_code=True)
 vision_model.eval()
+IMAGE_EMBED_BATCH_SIZE = int(os.getenv("IMAGE_EMBED_BATCH_SIZE", 16))
 
-# web3 provide for buy and payment verification
-w3 = Web3(Web3.HTTPProvider(os.getenv('ALCHEM_APIKEY')))
+# image download / decode pool feeding the model
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", 16))
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", 4))
+image_session = http_client.session("images", IMAGE_FETCH_WORKERS)
 
-def verify_eth_payment(tx_hash: str, required_recipient: str, required_amount_eth: float, timeout = 180):
-    # Try to fetch the transaction (may not exist immediately on some RPCs)
-    try:
-        tx = w3.eth.get_transaction(tx_hash)
-    except Exception:
-        raise ValueError("Transaction hash not found")
-
-    # Wait for mining
-    start = time.time()
-    receipt = None
-
-    while time.time() - start < timeout:
-        try:
-            receipt = w3.eth.get_transaction_receipt(tx_hash)
-        except:
-            receipt = None
-
-        if receipt is not None:
-            break
-
-        time.sleep(2)  # wait 2 seconds before retrying
-
-
-    # Must be mined
-    receipt = w3.eth.get_transaction_receipt(tx_hash)
-    if receipt is None:
-        raise ValueError("Transaction is not mined yet")
-
-    # Must be successful
-    if receipt.status != 1:
-        raise ValueError("Transaction failed on-chain")
-
-    # Verify recipient
-    if tx["to"].lower() != required_recipient.lower():
-        raise ValueError("Transaction recipient mismatch")
-
-    # Verify amount in ETH
-    value_eth = w3.from_wei(tx["value"], "ether")
-    if float(value_eth) < float(required_amount_eth):
-        raise ValueError("Transaction amount is too low")
-
-    # Optional: verify sender
-    # if tx["from"].lower() != expected_sender.lower():
-    #     raise ValueError("Sender address mismatch")
-
-    return {
-        "from": tx["from"],
-        "to": tx["to"],
-        "amount_eth": float(value_eth),
-        "block": receipt.blockNumber
-    }
+# image embedding cache keyed by url and image bytes (3 KB per entry)
+image_cache = ImageEmbeddingCache(
+    os.getenv("IMAGE_CACHE_PATH", "image_embedding_cache.sqlite3"),
+    model="nomic-ai/nomic-embed-vision-v1.5",
+    max_entries=int(os.getenv("IMAGE_CACHE_MAX_MB", 512)) * 1024 * 1024 // (768 * 4),
+)
 
 # helper funtions
 def interval_to_days(interval: str) -> int:
@@ -125,7 +102,7 @@ def rasterize_svg_simple(svg_bytes):
         img_tag = soup.find("image")
         if img_tag and img_tag.get("href"):
             img_url = img_tag["href"]
-            r = requests.get(img_url, timeout=10)
+            r = http_client.get("images", img_url)
             inner = Image.open(BytesIO(r.content)).convert("RGB")
             return inner
     except:
@@ -134,76 +111,80 @@ def rasterize_svg_simple(svg_bytes):
     return None  # fallback handled by caller
 
 
-def embed_image_local(image_path: str) -> torch.Tensor:
-    print("embedding image")
+def decode_image(data: bytes, image_path: str):
+    """Decode fetched image bytes to RGB, None if it can't be used."""
+    # -------- Handle SVG without Cairo --------
+    if image_path.lower().endswith(".svg"):
+        print("SVG detected → attempting lightweight rasterization")
 
-    # ---- HTTP remote images ----
-    if image_path.startswith("http"):
-        try:
-            r = requests.get(image_path, timeout=10)
-            r.raise_for_status()
-            data = r.content
-
-            # -------- Handle SVG without Cairo --------
-            if image_path.lower().endswith(".svg"):
-                print("SVG detected → attempting lightweight rasterization")
-
-                # Try simple rasterization of <image> tags
-                fallback = rasterize_svg_simple(data)
-                if fallback:
-                    img = fallback
-                else:
-                    print("SVG cannot be rasterized → using blank vector")
-                    return torch.zeros(768)
+        # Try simple rasterization of <image> tags
+        fallback = rasterize_svg_simple(data)
+        if fallback:
+            return fallback
+        print("SVG cannot be rasterized → using blank vector")
+        return None
 
-            else:
-                # -------- Normal raster image --------
-                try:
-                    img = Image.open(BytesIO(data)).convert("RGB")
-                except UnidentifiedImageError:
-                    print(f"Unrecognized image format: {image_path}")
-                    return torch.zeros(768)
+    # -------- Normal raster image --------
+    try:
+        return Image.open(BytesIO(data)).convert("RGB")
+    except UnidentifiedImageError:
+        print(f"Unrecognized image format: {image_path}")
+        return None
+
+def _embed_batch(images):
+    inputs = vision_processor(images=images, return_tensors="pt")
+    with torch.inference_mode():
+        output = vision_model(**inputs)
+        emb = output.last_hidden_state[:, 0]
+        emb_norm = F.normalize(emb, p=2, dim=1)
+    return list(emb_norm.cpu())
 
-        except Exception as e:
-            print(f"Failed to load remote image {image_path}: {e}")
-            return torch.zeros(768)
+def embed_image_batch(images):
+    """Embed one batch of decoded images, falling back to one by one if the batch fails."""
+    try:
+        return _embed_batch(images)
+    except Exception as e:
+        # one bad image shouldn't cost the whole batch
+        print(f"batch embedding failed ({e}) → embedding one by one")
 
-    # ---- Local file images ----
-    else:
+    embeddings = []
+    for i, img in enumerate(images):
         try:
-            if image_path.lower().endswith(".svg"):
-                print("Local SVG detected → attempting lightweight rasterization")
-
-                with open(image_path, "rb") as f:
-                    data = f.read()
-
-                fallback = rasterize_svg_simple(data)
-                if fallback:
-                    img = fallback
-                else:
-                    print("SVG cannot be rasterized → using blank vector")
-                    return torch.zeros(768)
-            else:
-                img = Image.open(image_path).convert("RGB")
-
+            embeddings.extend(_embed_batch([img]))
         except Exception as e:
-            print(f"Failed to load local image {image_path}: {e}")
-            return torch.zeros(768)
-
-    # ---- Embed ----
-    inputs = vision_processor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        output = vision_model(**inputs)
-        emb = output.last_hidden_state[:, 0]
-        emb_norm = F.normalize(emb, p=2, dim=1)
+            print(f"Failed to embed image {i}: {e}")
+            embeddings.append(torch.zeros(768))
+    return embeddings
 
-    return emb_norm.squeeze(0).cpu()
+def embed_images_local(image_paths, batch_size: int = None):
+    """
+    Download, decode and embed many images. Returns (embeddings, content hashes),
+    one of each per path in the same order, the hash is None if the image couldn't be used.
+    Downloads and decodes run concurrently and feed the model through bounded queues,
+    images already in the embedding cache skip the download and / or the model.
+    """
+    print(f"embedding {len(image_paths)} images")
+    return image_pipeline.run_pipeline(
+        image_paths,
+        decode_fn=decode_image,
+        embed_fn=embed_image_batch,
+        blank=torch.zeros(768),
+        fetch_workers=IMAGE_FETCH_WORKERS,
+        decode_workers=IMAGE_DECODE_WORKERS,
+        batch_size=batch_size or IMAGE_EMBED_BATCH_SIZE,
+        session=image_session,
+        cache=image_cache,
+    )
 
 def cosine_similarity(v1, v2):
     v1, v2 = np.array(v1), np.array(v2)
     return np.dot(v1, v2) 
 
-def collect_nft_data():
+def collect_nft_data(limit=None):
+    """
+    Crawl until limit new nfts are stored (the whole crawl if None), returns
+    how many were. Only the ingest worker should call this.
+    """
     # collections = getcollections()
     # collection_slugs = getslugsfromcollections(collections)
 
@@ -213,96 +194,262 @@ def collect_nft_data():
 
     print("collectiong data from openseas api")
 
-    nfts = getNftWithPriceCeling(10)
+    nfts = iterNftWithPriceCelingAsync(NFT_PRICE_CEILING, max_listings=MAX_LISTINGS_PER_COLLECTION)
 
     # collection_id, nft_id, price, currency, image_url, description
-    with app.app_context():
-        update_database(nfts)
-
-    return 
+    try:
+        with app.app_context():
+            return update_database(nfts, limit)
+    finally:
+        nfts.close() # stops the crawl if we hit the limit first
 
-def update_database(data):
+def update_database(data, limit=None):
+    """
+    Upsert crawled nfts keyed on (collection_id, nft_id) in chunks until limit
+    new rows were inserted, returns how many were.
+
+    Existing rows only get their listing refreshed and don't count toward the
+    limit, new rows are embedded and bulk inserted. Only when the crawl ran to
+    the end (not cut off at limit) are the rows it didn't see, and that nobody
+    wrote since it started, deleted. data can be any iterable, so a streaming
+    crawl is written to the database while it is still running.
+    """
     print("recived data and am updating databsase")
-    # load data from database
-    nfts = NFTS.query.all()
-
-    duplicate_map = {}
-    # clear database and read exising values into a map
-    for nft in nfts:
-        duplicate_map[(nft.collection_id, nft.nft_id)] = nft
-        db.session.delete(nft)
-    db.session.commit()
 
-    added = set()
-    # add new values (json) into database
-    for nft in data:
-        print(nft)
-        print(" ")
-        collection_id = nft.get("collection_id")
-        # check if its a string
-        if not isinstance(collection_id, str):
-            print("no collection ID")
-            continue
+    crawl_started = time.time()
+    added_images = set()
+    seen, inserted, complete = upsert_chunks(data, lambda chunk: upsert_nfts(chunk, added_images), UPSERT_CHUNK_SIZE, limit)
+
+    # an empty crawl is almost certainly an api failure, a cut off one didn't look at everything
+    if not complete:
+        print(f"crawl stopped after inserting {inserted} nfts, keeping the rows it didn't reach")
+    delete_stale_nfts(seen, crawl_started, complete)
+
+    if NFT_SEARCH == "snapshot":
+        write_catalog_snapshot()
 
-        nft_id = nft.get("nft_id")
-        image_url = nft.get("image_url")
+    return inserted
 
-        # make sure there are no duplicates
-        if (collection_id, nft_id) in added:
+def upsert_nfts(chunk, added_images):
+    """
+    Refresh prices of known nfts and insert the new ones from one chunk of
+    crawl results, one commit. Returns how many rows were inserted.
+    """
+    keys = [(nft.get("collection_id"), str(nft.get("nft_id"))) for nft in chunk]
+    existing = dict(
+        ((row.collection_id, row.nft_id), row.id)
+        for row in db.session.query(NFTS.id, NFTS.collection_id, NFTS.nft_id).filter(db.tuple_(NFTS.collection_id, NFTS.nft_id).in_(keys))
+    )
+
+    # ---- known nfts: only the listing can have changed ----
+    updates = [
+        {"id": existing[key], **listing_columns(nft)}
+        for key, nft in zip(keys, chunk) if key in existing
+    ]
+    if updates:
+        db.session.execute(db.update(NFTS), updates)
+
+    # ---- new nfts: embed in batches, then insert in one statement ----
+    pending = [nft for key, nft in zip(keys, chunk) if key not in existing and nft.get("image_url", "")]
+    vectors, digests = embed_images_local([nft.get("image_url") for nft in pending])
+
+    rows = []
+    vectors_by_key = {}
+    for nft, vector, digest in zip(pending, vectors, digests):
+        # filter out empty vectors and the same artwork listed twice
+        if digest is None:
             continue
-        else:
-            added.add((collection_id, nft_id))
-
-        if (collection_id, nft_id) in duplicate_map:
-            db.session.add(duplicate_map[(collection_id, nft_id)])
-        else:
-            image_url = nft.get("image_url", "")
-            description = nft.get("description", "")
-
-            # filter out duplicates and empty vectors
-            if image_url:
-                vector = embed_image_local(image_url).numpy().astype(float).tolist()
-                if str(vector) in added:
-                    print("vector already added")
-                    continue
-                else:
-                    added.add(str(vector))
-            else:
-                continue
+        if digest in added_images:
+            print("image already added")
+            continue
+        added_images.add(digest)
+
+        vector = np.asarray(vector, dtype=float).tolist()
+
+        vectors_by_key[(nft.get("collection_id"), str(nft.get("nft_id")))] = vector
+        rows.append(dict(
+            collection_id = nft.get("collection_id"),
+            nft_id = str(nft.get("nft_id")),
+            image_url = nft.get("image_url"),
+            image_embedding_vector = vector,
+            text_embedding_vector = None, # honestly the data in the description filed is useless
+            **compact.compact_columns(vector),
+            **listing_columns(nft),
+        ))
+
+    inserted = []
+    if rows:
+        # another crawl may have inserted the same key meanwhile, keep theirs
+        statement = postgresql.insert(NFTS).values(rows).on_conflict_do_nothing(index_elements=["collection_id", "nft_id"])
+        inserted = db.session.execute(statement.returning(NFTS.id, NFTS.collection_id, NFTS.nft_id, NFTS.price)).all()
 
-            new_nft = NFTS(
-                collection_id = collection_id,
-                nft_id = str(nft_id),
-                image_url = image_url,
-                price = nft.get("price"),
-                currency = nft.get("currency"),
+    db.session.commit()
+    print(f"upserted chunk: {len(updates)} updated, {len(inserted)} inserted")
+    if updates or inserted:
+        catalog_cache.invalidate()
+
+    # the vectors are still in memory, no need to read them back
+    inserted_vectors = [vectors_by_key[(r.collection_id, r.nft_id)] for r in inserted]
+    update_collection_stats(
+        added=[(r.collection_id, vector, r.price) for r, vector in zip(inserted, inserted_vectors)],
+        touched=[key[0] for key in keys if key in existing],
+    )
 
-                image_embedding_vector = (
-                    vector
-                ),
+    # keep the ann index in sync with the table
+    if nft_index is not None:
+        for update in updates:
+            nft_index.update_price(update["id"], update["price"])
+        nft_index.add_many([r.id for r in inserted], inserted_vectors, [r.price for r in inserted])
 
-                text_embedding_vector = (
-                    None # honestly the data in the description filed is useless
-          
-                ),
-            )
+    return len(inserted)
 
-            db.session.add(new_nft)
+def image_columns():
+    """
+    Embedding columns to read: the float16 copy, plus the full array only for rows
+    that don't have one yet (as image_embedding_vector, see compact.row_vector).
+    """
+    return (
+        NFTS.image_embedding_f16,
+        db.case((NFTS.image_embedding_f16.is_(None), NFTS.image_embedding_vector)).label("image_embedding_vector"),
+    )
 
+def listing_columns(nft):
+    """NFTS columns describing the listing a crawled nft was found through."""
+    return {
+        "price": nft.get("price"),
+        "currency": nft.get("currency"),
+        "contract_address": nft.get("contract_address"),
+        "order_hash": nft.get("order_hash"),
+        "protocol_address": nft.get("protocol_address"),
+        "listing_end_time": nft.get("listing_end_time"),
+        "remaining_quantity": nft.get("remaining_quantity"),
+        "listed_at": int(time.time()),
+    }
 
-    db.session.commit()
-    
-    global cache_lock
-    cache_lock = False
+def listing_live():
+    """Filter for rows whose stored listing hasn't expired (rows without an end time are kept)."""
+    cutoff = time.time() + LISTING_EXPIRY_MARGIN
+    return db.or_(NFTS.listing_end_time.is_(None), NFTS.listing_end_time > cutoff)
+
+def listing_expired(nft):
+    return nft.listing_end_time is not None and nft.listing_end_time <= time.time() + LISTING_EXPIRY_MARGIN
+
+def delete_nfts(ids):
+    """Delete nfts by id in chunks, keeping the ann index and collection centroids in sync."""
+    for start in range(0, len(ids), UPSERT_CHUNK_SIZE):
+        statement = db.delete(NFTS).where(NFTS.id.in_(ids[start:start + UPSERT_CHUNK_SIZE]))
+        removed = db.session.execute(statement.returning(NFTS.collection_id, *image_columns(), NFTS.price)).all()
+        db.session.commit()
+        update_collection_stats(removed=[(r.collection_id, compact.row_vector(r), r.price) for r in removed])
+
+    catalog_cache.remove(ids)
+    if nft_index is not None:
+        for nft_id in ids:
+            nft_index.remove(nft_id)
+
+def sweep_expired_nfts():
+    """Delete the nfts whose stored listing has expired, returns how many."""
+    expired = [row.id for row in db.session.query(NFTS.id).filter(db.not_(listing_live()))]
+    delete_nfts(expired)
+
+    if expired:
+        print(f"swept {len(expired)} expired listings")
+        if NFT_SEARCH == "snapshot":
+            write_catalog_snapshot()
+    return len(expired)
+
+def delete_stale_nfts(seen, crawl_started, complete):
+    """Delete the nfts a complete crawl didn't return and nothing relisted since it started, in chunks by id."""
+    if not complete or not seen:
+        return
+    rows = db.session.query(NFTS.id, NFTS.collection_id, NFTS.nft_id, NFTS.listed_at)
+    stale = stale_ids(rows, seen, crawl_started, complete)
+    delete_nfts(stale)
+
+    print(f"deleted {len(stale)} stale nfts")
+
+def update_collection_stats(added=(), removed=(), touched=()):
+    """
+    Add / subtract inserted and deleted nfts, given as (collection_id, vector, price),
+    to the stored collection centroids, then recount the items and price range
+    of every collection involved (touched: collections whose prices changed).
+    """
+    delta = CollectionIndex()
+    for rows, sign in ((added, 1), (removed, -1)):
+        rows = [r for r in rows if r[1] is not None and len(r[1])]
+        if rows:
+            delta.add_many([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], sign=sign)
+    touched = set(touched) | set(delta.collection_ids) | {r[0] for r in removed}
+    if not touched:
+        return
+
+    # every process writes here, so make sure the rows exist and lock them (in key order, so two
+    # writers can't deadlock) before adding to vector_sum, or concurrent updates would be lost
+    touched = sorted(touched)
+    db.session.execute(
+        postgresql.insert(NFTCollections)
+        .values([{"collection_id": c, "vector_sum": [0.0] * EMBEDDING_DIM, "item_count": 0} for c in touched])
+        .on_conflict_do_nothing(index_elements=["collection_id"])
+    )
+    stored = {
+        row.collection_id: row
+        for row in NFTCollections.query.filter(NFTCollections.collection_id.in_(touched)).order_by(NFTCollections.collection_id).with_for_update().populate_existing()
+    }
+    counts = {
+        row.collection_id: row
+        for row in db.session.query(NFTS.collection_id, db.func.count(NFTS.id).label("item_count"), db.func.min(NFTS.price).label("min_price"), db.func.max(NFTS.price).label("max_price"))
+        .filter(NFTS.collection_id.in_(touched)).group_by(NFTS.collection_id)
+    }
 
-    return
+    for collection_id in touched:
+        row = stored.get(collection_id)
+        stats = counts.get(collection_id)
+        if stats is None:
+            # nothing left in it
+            if row is not None:
+                db.session.delete(row)
+            continue
+        if row is None:
+            # another process emptied and deleted it after the insert above
+            row = NFTCollections(collection_id=collection_id, vector_sum=[0.0] * EMBEDDING_DIM)
+            db.session.add(row)
+        row.vector_sum = (np.asarray(row.vector_sum, dtype=float) + delta.sum(collection_id)).tolist()
+        row.item_count, row.min_price, row.max_price = stats.item_count, stats.min_price, stats.max_price
+    db.session.commit()
 
-def fill_nft_cache():
-    print("async fill called")
-    thread = threading.Thread(target=collect_nft_data) # call collect_nft_data on separate thread
-    thread.daemon = True   # ensures thread exits when main process exits
-    thread.start()
-    return
+def rebuild_collection_stats():
+    """Recompute every collection centroid from the nfts table."""
+    index = CollectionIndex()
+    batch = []
+    for row in db.session.query(NFTS.collection_id, *image_columns(), NFTS.price).filter(NFTS.image_embedding_vector.isnot(None)).yield_per(UPSERT_CHUNK_SIZE):
+        batch.append((row.collection_id, compact.row_vector(row), row.price))
+        if len(batch) >= UPSERT_CHUNK_SIZE:
+            index.add_many(*zip(*batch))
+            batch = []
+    if batch:
+        index.add_many(*zip(*batch))
+
+    NFTCollections.query.delete()
+    for collection_id in index.collection_ids:
+        slot = index.slots[collection_id]
+        db.session.add(NFTCollections(
+            collection_id=collection_id,
+            vector_sum=index.sums[slot].tolist(),
+            item_count=int(index.counts[slot]),
+            min_price=float(index.min_prices[slot]),
+            max_price=float(index.max_prices[slot]),
+        ))
+    db.session.commit()
+    print(f"rebuilt centroids for {len(index)} collections")
+
+def ensure_nft_unique_index():
+    """Unique (collection_id, nft_id) for the upserts, dropping duplicate rows left by older versions first."""
+    db.session.execute(db.text("""
+        DELETE FROM nfts a USING nfts b
+        WHERE a.collection_id = b.collection_id AND a.nft_id = b.nft_id AND a.id > b.id
+    """))
+    db.session.execute(db.text("CREATE UNIQUE INDEX IF NOT EXISTS nfts_collection_nft ON nfts (collection_id, nft_id)"))
+    db.session.commit()
 
 # setup app
 app = Flask(__name__)
@@ -321,9 +468,56 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 BOT_WALLET_ADDRESS = os.getenv("BOT_WALLET")
 BOT_PRIVATE_KEY = os.getenv("BOT_PRIVATE_KEY")
 
-# cache stuff
-nft_cache_size = 100
-cache_lock = False
+# cache stuff (the ingest worker refills the store up to the high watermark once it drops below the low one)
+NFT_LOW_WATERMARK = int(os.getenv("NFT_LOW_WATERMARK", 100))
+NFT_HIGH_WATERMARK = int(os.getenv("NFT_HIGH_WATERMARK", 2000))
+INGEST_INTERVAL = int(os.getenv("INGEST_INTERVAL", 300))
+INGEST_WORKER = os.getenv("INGEST_WORKER", "1") == "1" # set to 0 on processes that shouldn't crawl
+NFT_PRICE_CEILING = float(os.getenv("NFT_PRICE_CEILING", 10)) # most a listing can cost to be stored
+LISTING_EXPIRY_MARGIN = int(os.getenv("LISTING_EXPIRY_MARGIN", 300)) # listings ending sooner than this count as expired
+MAX_LISTINGS_PER_COLLECTION = int(os.getenv("MAX_LISTINGS_PER_COLLECTION", 200))
+UPSERT_CHUNK_SIZE = int(os.getenv("UPSERT_CHUNK_SIZE", 500))
+
+# search stuff ("exact" scans the whole table, "ivf" uses the ann index, "pgvector" searches in postgres,
+# "compact" scans int8 codes, "snapshot" scans a memory mapped copy shared by all workers,
+# "collections" picks the closest collection centroids and only scores their items)
+NFT_SEARCH = os.getenv("NFT_SEARCH", "exact")
+INDEX_SEARCH_MODES = ("compact", "ivf", "pgvector") # modes that never read the whole table per request
+NFT_SEARCH_COLLECTIONS = int(os.getenv("NFT_SEARCH_COLLECTIONS", 20))
+COLLECTION_INDEX_REFRESH = int(os.getenv("COLLECTION_INDEX_REFRESH", 60)) # seconds before re-reading the centroids
+NFT_IVF_NPROBE = int(os.getenv("NFT_IVF_NPROBE", 8))
+NFT_IVF_REFRESH = int(os.getenv("NFT_IVF_REFRESH", 600)) # seconds before the ann index is rebuilt from the table
+NFT_PGVECTOR_EF_SEARCH = int(os.getenv("NFT_PGVECTOR_EF_SEARCH", 40))
+NFT_SNAPSHOT_DIR = os.getenv("NFT_SNAPSHOT_DIR", "nft_snapshot")
+NFT_CATALOG_TTL = int(os.getenv("NFT_CATALOG_TTL", 30)) # exact / compact mode: seconds the cached catalog is used before re-reading the table
+snapshot_reader = SnapshotReader(NFT_SNAPSHOT_DIR)
+
+# buy stuff (how many ranked candidates to check per order and how many listing lookups run at once)
+NFT_BUY_CANDIDATES = int(os.getenv("NFT_BUY_CANDIDATES", 10))
+BATCH_PURCHASES = os.getenv("BATCH_PURCHASES", "1") == "1" # buy all of a check_orders run in one transaction
+
+# payment confirmation for submitted forms
+PAYMENT_CONFIRMER = os.getenv("PAYMENT_CONFIRMER", "1") == "1"
+PAYMENT_SOURCE = os.getenv("PAYMENT_SOURCE", "indexer") # indexer: scan blocks into the payments table, rpc: look up each pending hash
+PAYMENT_CONFIRMATIONS = int(os.getenv("PAYMENT_CONFIRMATIONS", 2)) # blocks deep before an order is made
+PAYMENT_CHECK_INTERVAL = int(os.getenv("PAYMENT_CHECK_INTERVAL", 10))
+PAYMENT_TIMEOUT = int(os.getenv("PAYMENT_TIMEOUT", 1800)) # seconds a payment that can't be found stays pending
+PAYMENT_INDEX_START = os.getenv("PAYMENT_INDEX_START") # first block of a fresh index, default the current one
+TX_HASH = re.compile(r"0x[0-9a-f]{64}")
+listing_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LISTING_VERIFY_WORKERS", 8)))
+
+# preference embedding cache (style / theme vocabulary is embedded once, free text is cached by string)
+preference_embedder = PreferenceEmbedder(
+    embed_text_chunk_local,
+    EmbeddingCache(os.getenv("PREFERENCE_CACHE_PATH", "preference_cache.sqlite3"), max_entries=int(os.getenv("PREFERENCE_CACHE_SIZE", 10000))),
+)
+nft_index = None
+nft_index_loaded = 0
+nft_index_rebuild = threading.Lock()
+# the whole table scored in memory: float copy in exact mode, int8 codes in compact mode
+catalog_cache = CatalogCache(lambda: load_quantized_catalog() if NFT_SEARCH == "compact" else load_table_catalog(), ttl=NFT_CATALOG_TTL)
+collection_index = None
+collection_index_loaded = 0
 
 # create database
 db = SQLAlchemy(app)
@@ -346,14 +540,27 @@ class Orders(db.Model):
 
 class NFTS(db.Model):
     __tablename__ = "nfts"
+    __table_args__ = (db.UniqueConstraint("collection_id", "nft_id", name="nfts_collection_nft"),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     collection_id = db.Column(db.Text, nullable=False)
     nft_id = db.Column(db.Text, nullable=False)
     image_url = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     currency = db.Column(db.Text, nullable=False)
-    image_embedding_vector = db.Column(db.ARRAY(db.Float)) 
-    text_embedding_vector = db.Column(db.ARRAY(db.Float))
+    # only loaded when accessed, everything that scores reads the float16 copy (compact.row_vector)
+    image_embedding_vector = db.deferred(db.Column(db.ARRAY(db.Float)))
+    text_embedding_vector = db.deferred(db.Column(db.ARRAY(db.Float)))
+    # compact copies of image_embedding_vector (see compact.py)
+    image_embedding_f16 = db.Column(db.LargeBinary)
+    image_embedding_int8 = db.Column(db.LargeBinary)
+    image_embedding_scale = db.Column(db.Float)
+    # listing the nft was crawled through, so it can be bought without looking it up again
+    contract_address = db.Column(db.Text)
+    order_hash = db.Column(db.Text)
+    protocol_address = db.Column(db.Text)
+    listing_end_time = db.Column(db.BigInteger) # unix seconds
+    remaining_quantity = db.Column(db.Integer)
+    listed_at = db.Column(db.BigInteger) # unix seconds the listing was last written (crawl or stream)
 
     def __repr__(self):
         img_len = len(self.image_embedding_vector) if self.image_embedding_vector else 0
@@ -364,9 +571,104 @@ class NFTS(db.Model):
             f"image_len={img_len}, text_len={txt_len})"
         )
 
+class PendingOrders(db.Model):
+    """Form submissions waiting on their payment, keyed by the payment's tx hash (one order per payment)."""
+    __tablename__ = "pending_orders"
+    tx_hash = db.Column(db.Text, primary_key=True)
+    status = db.Column(db.Text, nullable=False, default="pending") # pending / confirmed / failed
+    error = db.Column(db.Text)
+    order_id = db.Column(db.Integer) # the order made once confirmed
+    submitted_at = db.Column(db.BigInteger, nullable=False) # unix seconds
+    name = db.Column(db.String(120), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    wallet = db.Column(db.String(120), nullable=False)
+    funds = db.Column(db.Float, nullable=False)
+    price_cap = db.Column(db.Float)
+    time_interval = db.Column(db.Integer)
+    preferences_vector = db.Column(db.ARRAY(db.Float))
+
+class Payments(db.Model):
+    """Confirmed eth transfers to the bot wallet, filled by the payment indexer."""
+    __tablename__ = "payments"
+    tx_hash = db.Column(db.Text, primary_key=True)
+    block_number = db.Column(db.BigInteger, nullable=False, index=True)
+    sender = db.Column(db.Text, nullable=False)
+    amount_wei = db.Column(db.Numeric(78, 0), nullable=False)
+
+class IngestCheckpoint(db.Model):
+    """Where a long running ingester (the event stream, the payment indexer) got to, so it can resume after a restart."""
+    __tablename__ = "ingest_checkpoints"
+    name = db.Column(db.Text, primary_key=True)
+    position = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime)
+
+class NFTCollections(db.Model):
+    """Per collection centroid (sum of normalized image embeddings), item count and price range."""
+    __tablename__ = "nft_collections"
+    collection_id = db.Column(db.Text, primary_key=True)
+    vector_sum = db.Column(db.ARRAY(db.Float))
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    min_price = db.Column(db.Float)
+    max_price = db.Column(db.Float)
+
+def add_missing_columns():
+    """create_all doesn't touch existing tables, so add any model columns the table is missing."""
+    inspector = db.inspect(db.engine)
+    for model in (Orders, NFTS, PendingOrders):
+        table = model.__table__
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                print(f"adding column {table.name}.{column.name}")
+                db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
+
+def backfill_compact_embeddings(batch_size=1000):
+    """Fill the compact embedding columns for rows written before they existed."""
+    while True:
+        rows = db.session.query(NFTS.id, NFTS.image_embedding_vector).filter(NFTS.image_embedding_int8.is_(None), NFTS.image_embedding_vector.isnot(None)).limit(batch_size).all()
+        if rows:
+            db.session.execute(db.update(NFTS), [{"id": row.id, **compact.compact_columns(row.image_embedding_vector)} for row in rows])
+        db.session.commit()
+        if len(rows) < batch_size:
+            return
+
 # create table (does nothing if already there)
 with app.app_context():
     db.create_all()
+    add_missing_columns()
+    ensure_nft_unique_index()
+    # every search mode reads the float16 copy
+    backfill_compact_embeddings()
+    if NFTCollections.query.first() is None and NFTS.query.first() is not None:
+        rebuild_collection_stats()
+    preference_embedder.warm()
+    if NFT_SEARCH == "pgvector":
+        pgvector_store.install(db.session)
+
+# keeps the store stocked in the background, requests only ever wake it
+ingest_worker = IngestWorker(
+    count_fn=lambda: NFTS.query.filter(listing_live()).count(),
+    sweep_fn=sweep_expired_nfts,
+    refill_fn=collect_nft_data,
+    lock_fn=lambda: advisory_lock(db.engine),
+    low=NFT_LOW_WATERMARK,
+    high=NFT_HIGH_WATERMARK,
+    interval=INGEST_INTERVAL,
+    context=app.app_context,
+)
+if INGEST_WORKER:
+    ingest_worker.start()
+
+# event stream: apply listings / cancels / sales as they happen (one consumer across all processes)
+EVENT_STREAM = os.getenv("EVENT_STREAM", "0") == "1"
+EVENT_STREAM_URL = os.getenv("EVENT_STREAM_URL", event_stream.STREAM_URL)
+EVENT_STREAM_LOCK_KEY = INGEST_LOCK_KEY + 1
+PAYMENT_INDEX_LOCK_KEY = INGEST_LOCK_KEY + 2
+NONCE_LOCK_KEY = INGEST_LOCK_KEY + 3 # held while a process allocates a nonce and sends from the bot wallet
+EVENT_SNAPSHOT_INTERVAL = int(os.getenv("EVENT_SNAPSHOT_INTERVAL", 30)) # snapshot mode: most often events rewrite the snapshot
+last_event_snapshot = 0
 
 
 # route for wake pings
@@ -381,11 +683,15 @@ def wake():
 def index():
     data = request.json
 
-    # verify paymant
-    try:
-        verify_eth_payment(data.get("txHash"), BOT_WALLET_ADDRESS, data.get("budget", {}).get("totalBudget"))
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+    # the payment is checked in the background, the hash only has to look right for now
+    tx_hash = (data.get("txHash") or "").lower()
+    if not TX_HASH.fullmatch(tx_hash):
+        return jsonify({"error": "Invalid transaction hash"}), 400
+
+    # same payment submitted again, don't make a second order
+    existing = db.session.get(PendingOrders, tx_hash)
+    if existing is not None:
+        return payment_response(existing)
 
     # Extract fields
     wallet = data.get("walletInfo", {}).get("walletAddress")
@@ -406,28 +712,116 @@ def index():
     styles_weight = 2
     themes_weight = 2
 
-    # create embedded string
-    preferences_string = " ".join(styles * styles_weight) + " " + " ".join(themes * themes_weight) + " " + additional
-
-    # create preferences vector
-    preferences_vector = embed_text_chunk_local(preferences_string).astype(float).tolist()
+    # create preferences vector from the cached vocabulary and free text embeddings
+    preferences_vector = preference_embedder.embed(styles, themes, additional, styles_weight, themes_weight).astype(float).tolist()
 
-    # create new order
-    new_order = Orders(
+    # store it until the payment confirms, the order is made then
+    pending = PendingOrders(
+        tx_hash=tx_hash,
+        submitted_at=int(time.time()),
         name=name,
         email=email,
-        time=datetime.now(timezone.utc) + timedelta(days=time_interval), # add interval to this
         wallet=wallet,
-        funds=funds, 
+        funds=funds,
         price_cap=price_cap,
         time_interval=time_interval, # days for now
         preferences_vector=preferences_vector
     )
 
-    db.session.add(new_order)
+    db.session.add(pending)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # submitted twice at once
+        db.session.rollback()
+        pending = db.session.get(PendingOrders, tx_hash)
+
+    if PAYMENT_SOURCE == "indexer":
+        # the payment is usually indexed by the time the form comes in
+        activate_paid_orders([tx_hash])
+        db.session.refresh(pending)
+    else:
+        payment_confirmer.wake()
+    return payment_response(pending)
+
+# payment / order status for a submitted form
+@app.route('/api/form/<tx_hash>', methods=['GET'])
+def form_status(tx_hash):
+    pending = db.session.get(PendingOrders, tx_hash.lower())
+    if pending is None:
+        return jsonify({"error": "Unknown transaction hash"}), 404
+    return payment_response(pending)
+
+def payment_response(pending):
+    """202 while the payment is unconfirmed, 200 once the order is made, 400 if the payment failed."""
+    body = {"status": pending.status, "status_url": url_for("form_status", tx_hash=pending.tx_hash)}
+    if pending.status == "pending":
+        return jsonify({"message": "payment pending", **body}), 202
+    if pending.status == "failed":
+        return jsonify({"error": pending.error, **body}), 400
+    return jsonify({"message": "success", "order_id": pending.order_id, **body}), 200
+
+def load_pending_payments():
+    rows = db.session.query(PendingOrders.tx_hash, PendingOrders.funds, PendingOrders.submitted_at).filter(PendingOrders.status == "pending").all()
+    return [(row.tx_hash, row.funds, row.submitted_at) for row in rows]
+
+def load_payment_position():
+    checkpoint = db.session.get(IngestCheckpoint, "payments")
+    return int(checkpoint.position) if checkpoint else None
+
+def store_payments(payments, block):
+    """Save indexed payments and the block they were read up to in one transaction."""
+    if payments:
+        stmt = postgresql.insert(Payments).values(payments).on_conflict_do_nothing(index_elements=["tx_hash"])
+        db.session.execute(stmt)
+    db.session.merge(IngestCheckpoint(name="payments", position=str(block), updated_at=datetime.now(timezone.utc)))
     db.session.commit()
 
-    return jsonify({"message": "success"}), 200
+def activate_paid_orders(tx_hashes=None):
+    """Settle pending orders against the payments table (all of them, or just tx_hashes), no rpc involved."""
+    query = db.session.query(
+        PendingOrders.tx_hash, PendingOrders.funds, PendingOrders.submitted_at, Payments.amount_wei, Payments.block_number
+    ).outerjoin(Payments, Payments.tx_hash == PendingOrders.tx_hash).filter(PendingOrders.status == "pending")
+    if tx_hashes is not None:
+        query = query.filter(PendingOrders.tx_hash.in_(tx_hashes))
+
+    for row in query.all():
+        if row.amount_wei is not None:
+            if row.amount_wei >= to_wei(row.funds):
+                settle_payment(row.tx_hash, "confirmed", {"block": row.block_number})
+            else:
+                settle_payment(row.tx_hash, "failed", "Transaction amount is too low")
+        elif time.time() - row.submitted_at > PAYMENT_TIMEOUT:
+            # reverted, sent elsewhere or never mined all look the same from here
+            settle_payment(row.tx_hash, "failed", "No confirmed payment to the bot wallet found")
+
+def settle_payment(tx_hash, status, detail):
+    """Make the order for a confirmed payment or record why it failed. The row lock keeps two processes from both making it."""
+    pending = PendingOrders.query.filter_by(tx_hash=tx_hash, status="pending").with_for_update(skip_locked=True).first()
+    if pending is None:
+        return
+
+    if status == "confirmed":
+        order = Orders(
+            name=pending.name,
+            email=pending.email,
+            time=datetime.now(timezone.utc) + timedelta(days=pending.time_interval), # add interval to this
+            wallet=pending.wallet,
+            funds=pending.funds,
+            price_cap=pending.price_cap,
+            time_interval=pending.time_interval,
+            preferences_vector=pending.preferences_vector
+        )
+        db.session.add(order)
+        db.session.flush()
+        pending.order_id = order.order_id
+        print(f"payment {tx_hash} confirmed in block {detail['block']}, order {order.order_id} active")
+    else:
+        pending.error = detail
+        print(f"payment {tx_hash} failed: {detail}")
+
+    pending.status = status
+    db.session.commit()
 
 # this is the function to check if there are any valid orders when pinged
 @app.route('/api/check_orders', methods=['GET'])
@@ -436,147 +830,447 @@ def check_orders():
     now = datetime.now(timezone.utc)
 
     # find all orders that need to be fulfilled 
-    orders = Orders.query.filter(Orders.time < now).all()
+    # used up orders wait for their last purchase to confirm (settle_purchase deletes them)
+    orders = Orders.query.filter(Orders.time < now, Orders.funds > 0).all()
     # get all orders for testing
     #orders = Orders.query.all()
 
     print("got order")
 
-    for i in orders:   
-        nfts = db.session.query(NFTS).count()
-        print(f"nfts length: {nfts}")
-        # call buy function
-        value = buy(i, nfts+1)
+    # match every due order against the store in one pass so no two orders chase the same nft
+    catalog = load_catalog([i.preferences_vector for i in orders], [order_budget(i) for i in orders])
+    # only a catalog of the whole store says anything about its size
+    if NFT_SEARCH not in INDEX_SEARCH_MODES + ("collections",) and len(catalog) < NFT_LOW_WATERMARK:
+        print("store running low... waking ingest worker")
+        ingest_worker.wake()
 
-        print(f"got value from buy: {value}")
+    ranked = assign_orders(catalog, [i.preferences_vector for i in orders], [order_budget(i) for i in orders])
 
-        if value == "Store Empty":
+    def pick_candidate(o, candidates):
+        nfts = []
+        for c in candidates:
+            nft = db.session.get(NFTS, int(catalog.ids[c]))
+            if nft is None:
+                continue
+            if listing_expired(nft):
+                remove_from_store(nft)
+                continue
+            nfts.append((c, nft))
+
+        pick = pick_first_valid([nft for _, nft in nfts], order_budget(orders[o])) if nfts else None
+        if pick is None:
+            return None
+        return next(c for c, nft in nfts if nft is pick[0]), pick
+
+    picks = []
+    for i, pick in zip(orders, claim_picks(ranked, pick_candidate)):
+        # ran out of candidates, fall back to searching the store for this order alone
+        if pick is None:
+            pick = pick_nft(i)
+
+        if pick == "Store Empty":
             continue
+        picks.append((i, *pick))
 
-        # add back if there are funds left
-        if i.funds - value > 0:
-            i.funds -= value
-            i.time = now + timedelta(days=i.time_interval) # new time for next buy
-        else:
-            db.session.delete(i)
+    # buy everything at once, orders whose listing didn't fill stay due and retry on the next check
+    sent = buy_picks(picks)
+    for i, nft, value, result in sent:
+        print(f"got value from buy: {value}")
+
+        # held back while the purchase is in flight, settle_purchase gives it back if it fails
+        # and deletes the order once it confirms with nothing left
+        i.funds -= value
+        i.time = now + timedelta(days=i.time_interval) # new time for next buy
 
+    # only watch once the deduction is stored, settle_purchase builds on it
     db.session.commit()
+    for i, nft, value, result in sent:
+        watch_purchase(i, nft, value, result)
 
 
     return jsonify({"message": f"ordered {len(orders)}"}), 200
 
-def buy(order, max_depth, recursion_level=0):
-    print(f"Finding NFT for {order}")
-    recursion_level += 1
+def get_nft_index():
+    """
+    The ann index over the nfts table, rebuilt every NFT_IVF_REFRESH seconds to
+    pick up rows written by other processes (ingest worker, other web workers).
+    One thread rebuilds while the rest keep searching the old index, which is
+    swapped out once the new one is complete.
+    """
+    global nft_index, nft_index_loaded
+    stale = time.time() - nft_index_loaded > NFT_IVF_REFRESH
+    if nft_index is not None and not stale:
+        return nft_index
+    # only the first build makes everyone wait
+    if not nft_index_rebuild.acquire(blocking=nft_index is None):
+        return nft_index
+    try:
+        if nft_index is None or time.time() - nft_index_loaded > NFT_IVF_REFRESH:
+            rows = db.session.query(NFTS.id, *image_columns(), NFTS.price).filter(NFTS.image_embedding_vector.isnot(None)).all()
+            print(f"building ann index from {len(rows)} nfts")
+            nft_index = IVFIndex.build([r.id for r in rows], [compact.row_vector(r) for r in rows], [r.price for r in rows], nprobe=NFT_IVF_NPROBE)
+            nft_index_loaded = time.time()
+    finally:
+        nft_index_rebuild.release()
+    return nft_index
+
+@contextmanager
+def nonce_lock(address):
+    with app.app_context(), advisory_lock(db.engine, NONCE_LOCK_KEY, wait=True):
+        yield
+
+def load_nonce(address):
+    with app.app_context():
+        checkpoint = db.session.get(IngestCheckpoint, f"nonce:{address.lower()}")
+        return int(checkpoint.position) if checkpoint and checkpoint.position is not None else None
 
-    if recursion_level > max_depth:
-        return "Store Empty"
-    
-    global cache_lock
-    print(f"cache lock: {cache_lock}")
+def save_nonce(address, nonce):
+    with app.app_context():
+        db.session.merge(IngestCheckpoint(
+            name=f"nonce:{address.lower()}", position=None if nonce is None else str(nonce), updated_at=datetime.now(timezone.utc)
+        ))
+        db.session.commit()
 
-    # get amounts to spend
-    if order.funds < order.price_cap:
-        funds = order.funds
+def load_stream_position():
+    with app.app_context():
+        checkpoint = db.session.get(IngestCheckpoint, "event_stream")
+        return checkpoint.position if checkpoint else None
+
+def save_stream_position(position):
+    with app.app_context():
+        db.session.merge(IngestCheckpoint(name="event_stream", position=position, updated_at=datetime.now(timezone.utc)))
+        db.session.commit()
+
+def apply_listing_events(events):
+    """
+    Apply a batch of stream events to nfts in order: new listings are upserted
+    like crawled nfts, sold nfts and cancelled listings are deleted.
+    """
+    latest = event_stream.collapse(events)
+
+    with app.app_context():
+        listed = event_stream.listings(latest, NFT_PRICE_CEILING)
+        for start in range(0, len(listed), UPSERT_CHUNK_SIZE):
+            upsert_nfts(listed[start:start + UPSERT_CHUNK_SIZE], set())
+
+        gone = [key for key, e in latest.items() if e["type"] != "listed"]
+        ids = []
+        if gone:
+            rows = db.session.query(NFTS.id, NFTS.collection_id, NFTS.nft_id, NFTS.order_hash).filter(db.tuple_(NFTS.collection_id, NFTS.nft_id).in_(gone))
+            ids = event_stream.removals(latest, rows)
+            delete_nfts(ids)
+
+        print(f"applied {len(events)} stream events: {len(listed)} listed, {len(ids)} removed")
+        global last_event_snapshot
+        if NFT_SEARCH == "snapshot" and (listed or ids) and time.time() - last_event_snapshot > EVENT_SNAPSHOT_INTERVAL:
+            write_catalog_snapshot()
+            last_event_snapshot = time.time()
+
+def run_event_stream():
+    """Follow the event stream while holding its advisory lock, other processes wait their turn."""
+    while True:
+        try:
+            with app.app_context(), advisory_lock(db.engine, EVENT_STREAM_LOCK_KEY) as acquired:
+                if acquired:
+                    asyncio.run(event_stream.consume(
+                        EVENT_STREAM_URL, os.getenv("OPNSEA_APIKEY"), apply_listing_events,
+                        load_stream_position, save_stream_position,
+                    ))
+        except Exception as e:
+            print(f"event stream failed: {e}")
+        time.sleep(60)
+
+def write_catalog_snapshot():
+    """Dump the nfts table to a new on disk snapshot for every worker to map."""
+    rows = db.session.query(NFTS.id, NFTS.collection_id, NFTS.nft_id, NFTS.price, *image_columns()).filter(NFTS.image_embedding_vector.isnot(None)).all()
+    write_snapshot(
+        NFT_SNAPSHOT_DIR,
+        ids=[r.id for r in rows],
+        prices=[r.price for r in rows],
+        collection_ids=[r.collection_id for r in rows],
+        nft_ids=[r.nft_id for r in rows],
+        image_matrix=[compact.row_vector(r) for r in rows],
+    )
+
+def get_collection_index():
+    """Collection centroids, re-read from the table every COLLECTION_INDEX_REFRESH seconds to pick up the ingest worker's changes."""
+    global collection_index, collection_index_loaded
+    if collection_index is None or time.time() - collection_index_loaded > COLLECTION_INDEX_REFRESH:
+        collection_index = CollectionIndex.from_stats(NFTCollections.query.all())
+        collection_index_loaded = time.time()
+    return collection_index
+
+def catalog_rows():
+    """Just the columns NFTCatalog.from_rows reads, no ORM objects."""
+    return db.session.query(NFTS.id, NFTS.collection_id, NFTS.nft_id, NFTS.price, *image_columns(), NFTS.text_embedding_vector).filter(listing_live())
+
+def load_table_catalog():
+    """Catalog of every live nft in the table (what catalog_cache holds)."""
+    return NFTCatalog.from_rows(catalog_rows().all())
+
+def load_collection_catalog(collection_ids):
+    """Catalog of the live nfts in the given collections only."""
+    return NFTCatalog.from_rows(catalog_rows().filter(NFTS.collection_id.in_(collection_ids)).all())
+
+def load_quantized_catalog():
+    """int8 codes of every live nft (what catalog_cache holds in compact mode)."""
+    rows = db.session.query(NFTS.id, NFTS.price, NFTS.image_embedding_int8, NFTS.image_embedding_scale).filter(NFTS.image_embedding_int8.isnot(None), listing_live()).all()
+    return compact.QuantizedCatalog.from_rows(rows)
+
+def load_id_catalog(ids):
+    """Catalog of just the given live nfts."""
+    return NFTCatalog.from_rows(catalog_rows().filter(NFTS.id.in_(ids)).all())
+
+def load_catalog(preferences_vectors=None, budgets=None):
+    """
+    Catalog to score against: the shared snapshot in snapshot mode, in collections
+    mode only the closest collections to any of the given orders, in the index
+    modes only the nfts the index returns for them, otherwise the cached copy
+    of the table (rebuilt after writes, see CatalogCache).
+    """
+    if NFT_SEARCH in INDEX_SEARCH_MODES and preferences_vectors is not None:
+        # enough per order that assign_orders can still hand out fallbacks after the other orders took theirs
+        k = NFT_BUY_CANDIDATES + len(preferences_vectors)
+        ids = set()
+        for preferences_vector, budget in zip(preferences_vectors, budgets):
+            ids.update(search_ids(preferences_vector, budget, k)[0])
+        return load_id_catalog(list(ids))
+    if NFT_SEARCH == "collections" and preferences_vectors is not None:
+        index = get_collection_index()
+        top = set()
+        for preferences_vector, budget in zip(preferences_vectors, budgets):
+            top.update(index.top_collections(preferences_vector, budget, n=NFT_SEARCH_COLLECTIONS)[0])
+        return load_collection_catalog(list(top))
+    if NFT_SEARCH == "snapshot":
+        catalog = snapshot_reader.catalog()
+        if catalog is None:
+            write_catalog_snapshot()
+            catalog = snapshot_reader.catalog()
+        return catalog
+    return catalog_cache.get()
+
+def search_ids(preferences_vector, funds, k):
+    """(ids, similarities) of the k best nfts within funds from the configured search, best first."""
+    if NFT_SEARCH == "compact":
+        # coarse scan over the int8 codes only, then exact re-rank of the best few
+        catalog = catalog_cache.get()
+        fetch = lambda ids: db.session.query(NFTS.id, NFTS.image_embedding_f16).filter(NFTS.id.in_(ids)).all()
+        ids, scores = compact.search(catalog, fetch, preferences_vector, price_cap=funds, k=k)
+    elif NFT_SEARCH == "collections":
+        ids, scores = collection_search(get_collection_index(), load_collection_catalog, preferences_vector, price_cap=funds, k=k, n_collections=NFT_SEARCH_COLLECTIONS)
+    elif NFT_SEARCH == "ivf":
+        ids, scores = get_nft_index().search(preferences_vector, price_cap=funds, k=k)
+    elif NFT_SEARCH == "pgvector":
+        ids, scores = pgvector_store.search(db.session, preferences_vector, price_cap=funds, k=k, ef_search=NFT_PGVECTOR_EF_SEARCH, live_after=time.time() + LISTING_EXPIRY_MARGIN)
     else:
-        funds = order.price_cap
+        catalog = load_catalog()
+        indices, scores = catalog.top_k(preferences_vector, funds, k=k)
+        ids = [int(catalog.ids[i]) for i in indices]
+    return ids, scores
+
+def find_candidates(preferences_vector, funds, k):
+    """Return up to k (nft, similarity) pairs within funds, best first."""
+    ids, scores = search_ids(preferences_vector, funds, k)
+
+    candidates = []
+    for nft_id, score in zip(ids, scores):
+        if score <= 0:
+            break
+        nft = db.session.get(NFTS, nft_id)
+        if nft is None:
+            # row was removed by another process
+            if nft_index is not None:
+                nft_index.remove(nft_id)
+            continue
+        if listing_expired(nft):
+            # the ann index / snapshot can be older than the last sweep
+            remove_from_store(nft)
+            continue
+        candidates.append((nft, score))
+    return candidates
+
+def pick_nft(order):
+    """Search the store for one order, (nft, value) of the best listing it can buy or "Store Empty"."""
+    print(f"Finding NFT for {order}")
+
+    # get amounts to spend
+    funds = order_budget(order)
     
     # TODO: some sort of currency conversion?
-    
-    # load data from database
-    nfts = NFTS.query.all()
-    print(f"got nfts of len: {len(nfts)}")
-
-    # if there is no data, call the collect data funtion synchronously
-    if len(nfts) < 10:
-        if not cache_lock:
-            print("empty database... collecting data")
-            collect_nft_data()
-        else:
-            return "Store Empty"
-
-    # make sure there are more than cache size
-    # if len(nfts) < nft_cache_size and not cache_lock:
-    #     print("below cache size... collecting data")
-    #     cache_lock = True
-    #     fill_nft_cache() # call collect_nft_data on separate thread
-
-    # iterate and find the closes to data
-    max_similarity = 0
-    best_nft = None
-    
-    print("starting buy loop")
 
-    for nft in nfts:
-        # make sure there are enough funds
-        if nft.price <= funds:
+    # rank the closest nfts to the preferences once
+    print("scoring nfts")
+    candidates = find_candidates(order.preferences_vector, funds, NFT_BUY_CANDIDATES)
 
-            # get similarity of image and text embeddings vectors
-            if nft.image_embedding_vector:
-                similarity_image = cosine_similarity(order.preferences_vector, nft.image_embedding_vector)
-            else:
-                similarity_image = None
+    # if there is no nft to buy, get more options in the background and retry on the next check
+    if not candidates:
+        print("no nft to buy... waking ingest worker")
+        ingest_worker.wake()
+        return "Store Empty"
 
-            if nft.text_embedding_vector:
-                similarity_text = cosine_similarity(order.preferences_vector, nft.text_embedding_vector)
-            else:
-                similarity_text = None
-
-            # take average similarity score
-            if similarity_image is not None and similarity_text is not None:
-                similarity = (similarity_image + similarity_text) / 2
-            elif similarity_image is not None:
-                similarity = similarity_image
-            elif similarity_text is not None:
-                similarity = similarity_text
-            else:
-                similarity = 0
-            
-            # replace if better
-            if similarity > max_similarity:
-                max_similarity = similarity
-                best_nft = nft
-    
-    print(f"found poternial nft: {best_nft}")
-    # if there is no nft to buy, get more options
-    if best_nft is None:
-        print("no nft to buy... collecting data")
-        if not cache_lock:
-            collect_nft_data()  # get nfts syncronously
-        return buy(order, db.session.query(NFTS).count(), recursion_level=recursion_level)
-
-    # delete nft
-    db.session.delete(best_nft)
-    db.session.commit()
+    print(f"found {len(candidates)} poternial nfts")
+    pick = pick_first_valid([nft for nft, _ in candidates], funds)
 
-    # vefify that there is a nft to buy and there are enough funds
-    currency, value = getBestListingNFT(best_nft.collection_id, int(best_nft.nft_id))
-    print(f"currency: {currency}, value: {value}")
+    if pick is None:
+        return "Store Empty"
 
-    if (currency == "Error" or value == 0) or value > funds:
-        print("no valid listing for nft")
-        return buy(order, db.session.query(NFTS).count(), recursion_level=recursion_level) # if not recursivly call buy function again
-        
-    print(f"Buying {best_nft.collection_id} {best_nft.nft_id} for {value} {currency}")
-    print("max similarity: ", max_similarity)
-    print("image_url ", best_nft.image_url)
-    data = getNFT(best_nft.collection_id, int(best_nft.nft_id))
-    print(data.get("image_url"))
+    return pick
 
+def order_budget(order):
+    """Most that can be spent on a single nft for this order."""
+    if order.price_cap is None or order.funds < order.price_cap:
+        return order.funds
+    return order.price_cap
 
-    try:
-        buy_nft(nft.collection_id, nft.nft_id, BOT_WALLET_ADDRESS, BOT_PRIVATE_KEY, order.wallet)
-    except:
-        print("error buying nft")
-        return buy(order, db.session.query(NFTS).count(), recursion_level=recursion_level)
+def remove_from_store(nft):
+    removed = (nft.collection_id, compact.row_vector(nft), nft.price)
+    db.session.delete(nft)
+    db.session.commit()
+    update_collection_stats(removed=[removed])
+    catalog_cache.remove([nft.id])
+    if nft_index is not None:
+        nft_index.remove(nft.id)
+
+def verify_listings(nfts):
+    """
+    Listing (currency, value) of every nft in the same order. Nfts crawled with
+    their order hash use the stored listing (fulfillment fails if the order is
+    gone), the rest get their best listing looked up, all at once.
+    """
+    # read the attributes here, the session can't be used from the pool threads
+    lookup = [(i, (nft.collection_id, int(nft.nft_id))) for i, nft in enumerate(nfts) if not nft.order_hash]
+    listings = [(nft.currency, nft.price) for nft in nfts]
+    for (i, _), listing in zip(lookup, listing_pool.map(lambda item: getBestListingNFT(*item[1]), lookup)):
+        listings[i] = listing
+    return listings
+
+def settle_purchase(order_id, value, error):
+    """
+    Finish an order once its purchase is mined (runs on the confirmer thread):
+    a failed one gets value back and is due again right away, a confirmed one
+    that spent the last of the funds is deleted.
+    """
+    with app.app_context():
+        order = db.session.get(Orders, order_id)
+        if order is None:
+            print(f"order {order_id} is gone, purchase result {error or 'confirmed'} not applied")
+            return
+        if error is not None:
+            order.funds += value
+            order.time = datetime.now(timezone.utc) # retried on the next check
+            print(f"purchase for order {order_id} failed ({error}), credited {value} back")
+        elif order.funds <= 0:
+            db.session.delete(order)
+            print(f"order {order_id} is used up")
+        db.session.commit()
+
+def pick_first_valid(nfts, funds):
+    """
+    Verify the listings of the ranked candidates concurrently and return
+    (nft, value) for the best one still listed within funds, or None.
+    Candidates that were checked are taken out of the store.
+    """
+    listings = verify_listings(nfts)
 
-    send_template_email(order.email, best_nft.image_url)
+    for nft, (currency, value) in zip(nfts, listings):
+        remove_from_store(nft)
+        print(f"{nft.collection_id} {nft.nft_id} currency: {currency}, value: {value}")
 
-    return value
+        # vefify that there is a nft to buy and there are enough funds
+        if (currency == "Error" or value == 0) or value > funds:
+            print("no valid listing for nft")
+            continue
 
+        return nft, value
 
+    return None
 
+def watch_purchase(order, nft, value, result):
+    """The transactions are only sent, refund or email once the confirmer reports back."""
+    email, image_url, order_id = order.email, nft.image_url, order.order_id
+    result["purchase"].add_done_callback(lambda f: settle_purchase(order_id, value, f.exception()))
+    result["transfer"].add_done_callback(lambda f: f.exception() is None and send_template_email(email, image_url))
 
+def buy_picks(picks):
+    """
+    Buy the (order, nft, value) picks of a check_orders run, all in one seaport
+    transaction when BATCH_PURCHASES is on. Returns [(order, nft, value, result)]
+    for the purchases that were sent (result as from buy_nft, see watch_purchase),
+    the rest are reported and left for the next run. value is the price of the
+    order that was actually filled, not the one the listing was picked at.
+    """
+    purchases = []
+    for n, (order, nft, value) in enumerate(picks):
+        print(f"Buying {nft.collection_id} {nft.nft_id} for {value} for order {order.order_id}")
+        print("image_url ", nft.image_url)
+        purchases.append({
+            "key": n, "slug": nft.collection_id, "token_id": nft.nft_id, "recipient": order.wallet,
+            "order_hash": nft.order_hash, "contract_address": nft.contract_address,
+            "protocol_address": nft.protocol_address, "max_price": order_budget(order),
+        })
+
+    if BATCH_PURCHASES and len(purchases) > 1:
+        bought, unfilled = buy_batch(purchases, BOT_WALLET_ADDRESS, BOT_PRIVATE_KEY)
+    else:
+        bought, unfilled = {}, {}
+        for purchase in purchases:
+            try:
+                bought[purchase["key"]] = buy_nft(
+                    purchase["slug"], purchase["token_id"], BOT_WALLET_ADDRESS, BOT_PRIVATE_KEY, purchase["recipient"],
+                    order_hash=purchase["order_hash"], contract_address=purchase["contract_address"],
+                    protocol_address=purchase["protocol_address"], max_price=purchase["max_price"],
+                )
+            except Exception as e:
+                unfilled[purchase["key"]] = str(e)
+
+    sent = []
+    for n, (order, nft, value) in enumerate(picks):
+        if n in unfilled:
+            print(f"error buying nft for order {order.order_id}: {unfilled[n]}, retrying next check")
+            continue
+        result = bought[n]
+        if result["price"] != value:
+            # the stored order was gone and a newer listing (within budget) was bought
+            print(f"order {order.order_id} paid {result['price']} for {nft.collection_id} {nft.nft_id}, listed at {value}")
+        sent.append((order, nft, result["price"], result))
+    return sent
+
+
+
+if EVENT_STREAM:
+    threading.Thread(target=run_event_stream, daemon=True).start()
+
+# every gunicorn worker may buy, so nonces for the bot wallet are handed out through the database
+share_nonces(nonce_lock, load_nonce, save_nonce)
+
+# confirms form payments in the background: indexer follows the blocks once (one process at a time)
+# and activates orders from the payments table, rpc looks up the pending hashes in one batched request per round
+if PAYMENT_SOURCE == "indexer":
+    payment_confirmer = PaymentIndexer(
+        url=os.getenv('ALCHEM_APIKEY'),
+        recipient=BOT_WALLET_ADDRESS,
+        load_position=load_payment_position,
+        store_fn=store_payments,
+        confirmations=PAYMENT_CONFIRMATIONS,
+        interval=PAYMENT_CHECK_INTERVAL,
+        start_block=int(PAYMENT_INDEX_START) if PAYMENT_INDEX_START else None,
+        lock_fn=lambda: advisory_lock(db.engine, PAYMENT_INDEX_LOCK_KEY),
+        after_fn=activate_paid_orders,
+        context=app.app_context,
+    )
+else:
+    payment_confirmer = PaymentConfirmer(
+        url=os.getenv('ALCHEM_APIKEY'),
+        recipient=BOT_WALLET_ADDRESS,
+        load_fn=load_pending_payments,
+        settle_fn=settle_payment,
+        confirmations=PAYMENT_CONFIRMATIONS,
+        interval=PAYMENT_CHECK_INTERVAL,
+        timeout=PAYMENT_TIMEOUT,
+        context=app.app_context,
+    )
+if PAYMENT_CONFIRMER:
+    payment_confirmer.start()
 
 if __name__ == '__main__':
     app.run(debug=True)
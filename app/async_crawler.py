@@ -0,0 +1,345 @@
+import asyncio
+import queue
+import threading
+import time
+import aiohttp
+
+import http_client
+import multipipline_api as api
+from response_cache import ResponseCache
+
+# asyncio version of multipipline_api.getNftWithPriceCeling.
+#
+# The serial crawl does one CoinGecko call, then one Alchemy call per
+# contract, one OpenSea listings call per slug and one OpenSea getNFT call per
+# listing, all back to back. Here every contract is followed on its own task,
+# each API stage has its own concurrency limit, and nfts are yielded as soon
+# as their getNFT call returns. Parsing is shared with the serial functions.
+
+# max requests in flight per stage
+STAGE_LIMITS = {"alchemy": 8, "listings": 4, "nft": 16}
+
+_DONE = object()
+
+
+class StageTimer:
+    """Total request time and call count per stage."""
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+
+    def add(self, stage, seconds):
+        self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def report(self):
+        return ", ".join(f"{stage} {self.counts[stage]} calls / {self.totals[stage]:.2f}s" for stage in self.totals)
+
+
+async def _get_json(session, timer, stage, url, **kwargs):
+    """GET with the same retry policy as http_client: backoff on errors, 429 and 5xx, honouring Retry-After."""
+    for attempt in range(http_client.RETRIES + 1):
+        last = attempt == http_client.RETRIES
+        start = time.perf_counter()
+        try:
+            async with session.get(url, **kwargs) as r:
+                if r.status in http_client.RETRY_STATUSES and not last:
+                    delay = http_client.retry_delay(attempt, r.headers.get("Retry-After"))
+                else:
+                    return await r.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if last:
+                raise
+            delay = http_client.retry_delay(attempt)
+        finally:
+            timer.add(stage, time.perf_counter() - start)
+        await asyncio.sleep(delay)
+
+
+async def _cached_json(session, timer, stage, endpoint, key, url, valid=None, **kwargs):
+    """_get_json through the api response cache, shared with the serial crawl."""
+    return await api.responseCache.get_async(
+        endpoint, key, lambda: _get_json(session, timer, stage, url, **kwargs), valid=valid
+    )
+
+
+async def _crawl(session, price_celing, out, limits, timer, max_listings=None, num=250, blockchain="ethereum"):
+    alchemy = asyncio.Semaphore(limits["alchemy"])
+    listings_sem = asyncio.Semaphore(limits["listings"])
+    nft_sem = asyncio.Semaphore(limits["nft"])
+    opensea_headers = {"accept": "*/*", "x-api-key": f"{api.OPNSEA_KEY}"}
+
+    response = await _cached_json(
+        session, timer, "coingecko", "collections", f"{num}:floor_price_native_asc", f"{api.CGECKO_URL}/api/v3/nfts/list",
+        valid=lambda r: isinstance(r, list),
+        headers={"x-cg-demo-api-key": f"{api.CGECKO_KEY}", "per_page": f"{num}"},
+        params={"order": "floor_price_native_asc"},
+    )
+    contracts = api.parseCollections(response, blockchain)
+
+    async def handle_listing(ls):
+        # the slot is held until the nft is queued, so a full queue stops new getNFT calls
+        async with nft_sem:
+            try:
+                response = await _cached_json(
+                    session, timer, "nft", "nft", f"{ls.get('token')}/{ls.get('identifierOrCriteria')}",
+                    f"{api.OPNSEA_URL}/api/v2/chain/ethereum/contract/{ls.get('token')}/nfts/{ls.get('identifierOrCriteria')}",
+                    valid=api.isValidNFT, headers=opensea_headers,
+                )
+            except Exception as e:
+                print(f"getNFT failed for {ls.get('token')} {ls.get('identifierOrCriteria')}: {e}")
+                return
+            nft = api.parseNFT(response)
+            nft.update(api.listingFields(ls))
+            await out.put(nft)
+
+    async def handle_contract(contract):
+        try:
+            async with alchemy:
+                response = await _cached_json(
+                    session, timer, "alchemy", "slug", contract.lower(), f"{api.ALCHEM_URL}/nft/v3/{api.ALCCHEM_KEY}/getFloorPrice",
+                    valid=api.isValidSlug, params={"contractAddress": contract},
+                )
+            slug = api.parseMarketplaceCollectionAddress(response)
+            if not slug:
+                return
+        except Exception as e:
+            print(f"crawl failed for contract {contract}: {e}")
+            return
+
+        # follow the listings cursor, starting the getNFT calls for each page
+        # while the next page is still downloading
+        tasks = []
+        params = {"limit": api.LISTINGS_PAGE_SIZE}
+        try:
+            while True:
+                try:
+                    async with listings_sem:
+                        response = await _cached_json(
+                            session, timer, "listings", "listings", f"{slug}:{params['limit']}:{params.get('next', '')}",
+                            f"{api.OPNSEA_URL}/api/v2/listings/collection/{slug}/all",
+                            valid=api.isValidListings, headers=opensea_headers, params=params,
+                        )
+                    listings = api.parseListings(response, price_celing)
+                except Exception as e:
+                    print(f"listings failed for {slug}: {e}")
+                    break
+
+                if max_listings is not None:
+                    listings = listings[:max_listings - len(tasks)]
+                tasks.extend(asyncio.create_task(handle_listing(ls)) for ls in listings)
+
+                cursor = response.get("next")
+                if not cursor or (max_listings is not None and len(tasks) >= max_listings):
+                    break
+                params = {**params, "next": cursor}
+
+            await asyncio.gather(*tasks)
+        finally:
+            # cancelled mid crawl (the consumer went away), don't leave getNFT tasks behind
+            for task in tasks:
+                task.cancel()
+
+    try:
+        await asyncio.gather(*(handle_contract(c) for c in contracts))
+    finally:
+        # when cancelled nobody is reading anymore, don't wait on a full queue
+        if not asyncio.current_task().cancelling():
+            await out.put(_DONE)
+
+
+async def streamNftWithPriceCeling(price_celing, limits=None, timer=None, timeout=30, max_listings=None, buffer_size=256):
+    """
+    Async generator yielding nft dicts (same shape as getNftWithPriceCeling) as
+    they arrive. At most buffer_size crawled nfts wait for the consumer, past
+    that the getNFT calls block until it catches up.
+    """
+    limits = {**STAGE_LIMITS, **(limits or {})}
+    timer = timer or StageTimer()
+    connector = aiohttp.TCPConnector(limit=sum(limits.values()))
+    client_timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=http_client.CONNECT_TIMEOUT, sock_read=http_client.READ_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        out = asyncio.Queue(maxsize=buffer_size)
+        task = asyncio.create_task(_crawl(session, price_celing, out, limits, timer, max_listings))
+        try:
+            while True:
+                item = await out.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            if not task.done():
+                task.cancel()
+        await task
+
+
+def getNftWithPriceCelingAsync(price_celing, limits=None, max_listings=None):
+    """Drop in for getNftWithPriceCeling that runs the crawl concurrently and returns the full list."""
+    async def collect():
+        timer = StageTimer()
+        start = time.perf_counter()
+        nfts = [nft async for nft in streamNftWithPriceCeling(price_celing, limits, timer, max_listings=max_listings)]
+        print(f"async crawl: {len(nfts)} nfts in {time.perf_counter() - start:.2f}s | {timer.report()}")
+        print(f"api cache: {api.responseCache.stats()}")
+        return nfts
+
+    return asyncio.run(collect())
+
+
+def iterNftWithPriceCelingAsync(price_celing, limits=None, max_listings=None, buffer_size=256):
+    """
+    Plain generator over the async crawl for sync callers: the crawl runs on
+    its own thread and hands nfts over through a bounded queue, so the caller
+    can process them while the crawl continues without buffering all of it.
+    Closing the generator early stops the crawl.
+    """
+    items = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(item):
+        # blocking put is what bounds memory, but give up once the consumer is gone
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        async def produce():
+            timer = StageTimer()
+            start = time.perf_counter()
+            count = 0
+            async for nft in streamNftWithPriceCeling(price_celing, limits, timer, max_listings=max_listings, buffer_size=buffer_size):
+                # keep the blocking put off the event loop
+                if not await asyncio.to_thread(put, nft):
+                    print("async crawl stopped by consumer")
+                    break
+                count += 1
+            print(f"async crawl: {count} nfts in {time.perf_counter() - start:.2f}s | {timer.report()}")
+            print(f"api cache: {api.responseCache.stats()}")
+
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            print(f"async crawl failed: {e}")
+        finally:
+            put(_DONE)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+# ---- benchmark against the serial crawl on a local mock server ----
+
+def _mock_app(n_collections, listings_per_collection, latency):
+    from aiohttp import web
+
+    async def collections(request):
+        await asyncio.sleep(latency)
+        return web.json_response([{"asset_platform_id": "ethereum", "contract_address": f"0x{c:040x}"} for c in range(n_collections)])
+
+    async def floor_price(request):
+        await asyncio.sleep(latency)
+        contract = request.query["contractAddress"]
+        return web.json_response({"openSea": {"collectionUrl": f"https://opensea.io/collection/slug-{int(contract, 16)}"}})
+
+    async def listings(request):
+        await asyncio.sleep(latency)
+        slug = request.match_info["slug"]
+        # paginated like opensea, the cursor is just the next offset here
+        limit = int(request.query.get("limit", 100))
+        offset = int(request.query.get("next", 0))
+        page = range(offset, min(offset + limit, listings_per_collection))
+        body = {"listings": [{
+            "status": "ACTIVE",
+            "order_hash": f"0x{int(slug.split('-')[-1]):032x}{i:032x}",
+            "protocol_address": "0x0000000000000068f116a894984e2db1123eb395",
+            "remaining_quantity": 1,
+            "price": {"current": {"currency": "ETH", "decimals": 18, "value": str(10 ** 17 * (i % 20))}},
+            "protocol_data": {"parameters": {
+                "offer": [{"token": slug, "identifierOrCriteria": str(i)}],
+                "endTime": str(int(time.time()) + 86400),
+            }},
+        } for i in page]}
+        if page.stop < listings_per_collection:
+            body["next"] = str(page.stop)
+        return web.json_response(body)
+
+    async def nft(request):
+        await asyncio.sleep(latency)
+        return web.json_response({"nft": {
+            "collection": request.match_info["contract"],
+            "identifier": request.match_info["identifier"],
+            "description": "",
+            "image_url": f"https://example.com/{request.match_info['contract']}/{request.match_info['identifier']}.png",
+        }})
+
+    app = web.Application()
+    app.router.add_get("/api/v3/nfts/list", collections)
+    app.router.add_get("/nft/v3/{key}/getFloorPrice", floor_price)
+    app.router.add_get("/api/v2/listings/collection/{slug}/all", listings)
+    app.router.add_get("/api/v2/chain/ethereum/contract/{contract}/nfts/{identifier}", nft)
+    return app
+
+
+def benchmark(n_collections=20, listings_per_collection=10, latency=0.05, price_celing=1, max_listings=None):
+    from aiohttp import web
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(_mock_app(n_collections, listings_per_collection, latency))
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = runner.addresses[0][1]
+    server = threading.Thread(target=loop.run_forever, daemon=True)
+    server.start()
+
+    base = f"http://127.0.0.1:{port}"
+    api.CGECKO_URL = api.ALCHEM_URL = api.OPNSEA_URL = base
+    print(f"mock server on {base}: {n_collections} collections x {listings_per_collection} listings, {latency * 1000:.0f} ms per call")
+
+    # compare the crawls themselves with the response cache off
+    api.responseCache = ResponseCache(None, api.API_CACHE_TTLS)
+
+    start = time.perf_counter()
+    serial = api.getNftWithPriceCeling(price_celing, max_listings)
+    serial_time = time.perf_counter() - start
+    print(f"serial crawl: {len(serial)} nfts in {serial_time:.2f}s")
+
+    start = time.perf_counter()
+    concurrent = getNftWithPriceCelingAsync(price_celing, max_listings=max_listings)
+    async_time = time.perf_counter() - start
+
+    key = lambda n: (n["collection_id"], n["nft_id"])
+    assert sorted(map(key, serial)) == sorted(map(key, concurrent))
+    print(f"speedup {serial_time / async_time:.1f}x")
+
+    # then a cold and a warm crawl through a fresh cache
+    api.responseCache = ResponseCache(":memory:", api.API_CACHE_TTLS)
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        cached = getNftWithPriceCelingAsync(price_celing, max_listings=max_listings)
+        assert sorted(map(key, cached)) == sorted(map(key, serial))
+        print(f"{run} cache crawl: {time.perf_counter() - start:.2f}s")
+
+    # shut the mock server down cleanly so no task is left pending
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    server.join()
+    loop.close()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,10 +1,24 @@
-import requests
+import http_client
 from web3 import Web3
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tx_pipeline import TxPipeline
+import seaport
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# web3 provider and one transaction pipeline per sending wallet
+w3 = Web3(Web3.HTTPProvider(os.getenv('ALCHEM_APIKEY')))
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+_nonce_sharing = {}  # TxPipeline lock_fn / load_nonce / save_nonce, see share_nonces
+
+# fill listings with the gift recipient as seaport's recipient, one transaction instead of buy + transfer
+DIRECT_FULFILLMENT = os.getenv("DIRECT_FULFILLMENT", "1") == "1"
+BATCH_LOOKUP_WORKERS = int(os.getenv("BATCH_LOOKUP_WORKERS", 8)) # concurrent fulfillment lookups for a batch
+
 OPENSEA_API_KEY = OPNSEA_KEY = os.getenv('OPNSEA_APIKEY')
 SEAPORT_ADDRESS = Web3.to_checksum_address("0x00000000000001ad428e4906ae43d8f9852d0dd6")
 
@@ -22,36 +36,53 @@ ERC721_ABI = [{
 }]
 
 
-def buy_nft(slug, token_id, buyer_public, buyer_private_key, recipient_public):
+def share_nonces(lock_fn, load_fn, save_fn):
     """
-    1. Find listing on OpenSea
-    2. Get fulfillment data
-    3. Buy NFT
-    4. After purchase, send the NFT to `recipient_public`
+    Allocate nonces across processes: lock_fn(address) -> context manager
+    held while sending, load_fn(address) / save_fn(address, nonce) the shared
+    next nonce. Call before the first buy.
     """
+    _nonce_sharing.update(lock_fn=lock_fn, load_fn=load_fn, save_fn=save_fn)
+
 
-    # ---------- 1. Get listing ----------
+def get_pipeline(address, private_key):
+    """The shared TxPipeline for a wallet, so concurrent buys don't fight over nonces."""
+    with _pipelines_lock:
+        pipeline = _pipelines.get(address)
+        if pipeline is None:
+            shared = {}
+            if _nonce_sharing:
+                shared = dict(
+                    lock_fn=lambda: _nonce_sharing["lock_fn"](address),
+                    load_nonce=lambda: _nonce_sharing["load_fn"](address),
+                    save_nonce=lambda nonce: _nonce_sharing["save_fn"](address, nonce),
+                )
+            pipeline = _pipelines[address] = TxPipeline(w3, address, private_key, **shared)
+        return pipeline
+
+
+def get_listing(slug, token_id):
+    """Current listing of the NFT: (order_hash, contract_address, token_id, protocol_address)."""
     listing_url = f"https://api.opensea.io/api/v2/listings/collection/{slug}/nfts/{token_id}"
     listing_headers = {"x-api-key": OPENSEA_API_KEY}
 
-    listing_resp = requests.get(listing_url, headers=listing_headers).json()
+    listing_resp = http_client.get("opensea", listing_url, headers=listing_headers).json()
 
     if "listings" not in listing_resp or len(listing_resp["listings"]) == 0:
         raise Exception("No active listing found for this NFT")
 
     listing = listing_resp["listings"][0]
-    order_hash = listing["order_hash"]
+    offer = listing["protocol_data"]["parameters"]["offer"][0]
+    return listing["order_hash"], offer["token"], int(offer["identifierOrCriteria"]), listing.get("protocol_address")
 
-    # Get contract + id so we can transfer later
-    contract_address = listing["protocol_data"]["parameters"]["offer"][0]["token"]
-    token_id = int(listing["protocol_data"]["parameters"]["offer"][0]["identifierOrCriteria"])
 
-    # ---------- 2. Get fulfillment data ----------
+def get_fulfillment(order_hash, protocol_address, buyer_public):
+    """Transaction OpenSea wants sent to fill the order, raises if the order can't be filled."""
     fulfill_url = "https://api.opensea.io/api/v2/listings/fulfillment_data"
     fulfill_payload = {
         "order_hash": order_hash,
         "chain": "ethereum",
-        "protocol_address": SEAPORT_ADDRESS,
+        "protocol_address": protocol_address or SEAPORT_ADDRESS,
         "side": "buy",
         "fulfiller": buyer_public
     }
@@ -61,7 +92,8 @@ def buy_nft(slug, token_id, buyer_public, buyer_private_key, recipient_public):
         "Content-Type": "application/json"
     }
 
-    fulfill_resp = requests.post(
+    fulfill_resp = http_client.post(
+        "opensea",
         fulfill_url,
         json=fulfill_payload,
         headers=fulfill_headers
@@ -70,31 +102,79 @@ def buy_nft(slug, token_id, buyer_public, buyer_private_key, recipient_public):
     if "fulfillment_data" not in fulfill_resp:
         raise Exception("Fulfillment data not returned.")
 
-    tx_data = fulfill_resp["fulfillment_data"]["transaction"]
+    return fulfill_resp["fulfillment_data"]["transaction"]
 
-    # ---------- 3. Build buy transaction ----------
-    tx = {
-        "from": buyer_public,
+
+def find_fulfillment(slug, token_id, buyer_public, order_hash=None, contract_address=None, protocol_address=None, max_price=None):
+    """
+    1. Find listing on OpenSea (skipped when the crawl stored its order hash)
+    2. Get fulfillment data
+    Returns (fulfillment transaction, contract_address, token_id), refuses
+    listings over max_price ETH when given.
+    """
+    tx_data = None
+    if order_hash and contract_address:
+        try:
+            tx_data = get_fulfillment(order_hash, protocol_address, buyer_public)
+            token_id = int(token_id)
+        except Exception as e:
+            # stored order was filled / cancelled, see if there is a newer listing
+            print(f"stored order {order_hash} not fillable ({e}), looking up the listing")
+
+    if tx_data is None:
+        order_hash, contract_address, token_id, protocol_address = get_listing(slug, token_id)
+        tx_data = get_fulfillment(order_hash, protocol_address, buyer_public)
+
+    if max_price is not None and int(tx_data["value"]) > Web3.to_wei(max_price, "ether"):
+        raise Exception(f"Listing costs more than {max_price} ETH")
+
+    return tx_data, contract_address, token_id
+
+
+def send_purchase(tx_data, slug, token_id, contract_address, buyer_public, buyer_private_key, recipient_public):
+    """
+    3. Buy NFT, delivered straight to `recipient_public` when the order allows it
+    4. Otherwise send the NFT to `recipient_public` after the buy
+    The result's price is what the fulfilled order costs in ETH, which can
+    differ from the crawled price when the stored order was gone.
+    """
+    price = float(Web3.from_wei(int(tx_data["value"]), "ether"))
+
+    # ---------- 3. Send buy transaction ----------
+    # straight to the recipient when the order can be filled as an advanced order
+    direct = None
+    if DIRECT_FULFILLMENT:
+        try:
+            direct = seaport.direct_calldata(tx_data, recipient_public)
+        except Exception as e:
+            print(f"can't fill {slug} {token_id} to the recipient directly: {e}")
+    data = direct or tx_data.get("data")
+    if data is None:
+        raise Exception(f"Unsupported fulfillment call {tx_data.get('function')}")
+
+    pipeline = get_pipeline(buyer_public, buyer_private_key)
+    purchase = pipeline.submit({
         "to": tx_data["to"],
         "value": int(tx_data["value"]),
-        "data": tx_data["data"],
-        "nonce": w3.eth.get_transaction_count(buyer_public),
+        "data": data,
         "gas": int(tx_data.get("gas", 350000)),
-        "gasPrice": w3.eth.gas_price,
-        "chainId": 1,
-    }
-
-    # Sign + send buy tx
-    signed_tx = w3.eth.account.sign_transaction(tx, private_key=buyer_private_key)
-    buy_tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-    print("Buy TX Hash:", buy_tx_hash.hex())
+    }, label=f"buy {slug} {token_id}" + (" for recipient" if direct else ""))
+    print("Buy TX Hash:", purchase.hash)
 
-    # ---------- 4. Wait for the NFT to arrive ----------
-    receipt = w3.eth.wait_for_transaction_receipt(buy_tx_hash)
-    print("NFT purchase confirmed.")
+    if direct:
+        # one transaction delivers it, nothing to transfer
+        return {
+            "purchase_tx": purchase.hash,
+            "transfer_tx": None,
+            "purchase": purchase.future,
+            "transfer": purchase.future,
+            "price": price,
+        }
 
-    # ---------- 5. Transfer NFT to recipient ----------
-    contract = w3.eth.contract(address=contract_address, abi=ERC721_ABI)
+    # ---------- 4. Transfer NFT to recipient (fallback, ERC-721 only) ----------
+    # no need to wait for the buy: the next nonce only executes after it, and
+    # if the buy reverts the transfer reverts with it
+    contract = w3.eth.contract(address=Web3.to_checksum_address(contract_address), abi=ERC721_ABI)
 
     transfer_tx = contract.functions.safeTransferFrom(
         buyer_public,
@@ -102,18 +182,158 @@ def buy_nft(slug, token_id, buyer_public, buyer_private_key, recipient_public):
         token_id
     ).build_transaction({
         "from": buyer_public,
-        "nonce": w3.eth.get_transaction_count(buyer_public),
-        "gas": 120000,
-        "gasPrice": w3.eth.gas_price,
+        "gas": 120000, # fixed, estimating now would fail since the bot doesn't own it yet
+        "nonce": 0, # placeholder so web3 doesn't look it up, the pipeline sets the real one
         "chainId": 1,
+        **pipeline.fees.fees(),
     })
+    transfer = pipeline.submit(transfer_tx, label=f"transfer {slug} {token_id}")
 
-    signed_transfer_tx = w3.eth.account.sign_transaction(transfer_tx, private_key=buyer_private_key)
-    transfer_tx_hash = w3.eth.send_raw_transaction(signed_transfer_tx.raw_transaction)
-
-    print("Transfer TX Hash:", transfer_tx_hash.hex())
+    print("Transfer TX Hash:", transfer.hash)
 
     return {
-        "purchase_tx": buy_tx_hash.hex(),
-        "transfer_tx": transfer_tx_hash.hex()
+        "purchase_tx": purchase.hash,
+        "transfer_tx": transfer.hash,
+        "purchase": purchase.future,
+        "transfer": transfer.future,
+        "price": price,
     }
+
+
+def buy_nft(slug, token_id, buyer_public, buyer_private_key, recipient_public,
+            order_hash=None, contract_address=None, protocol_address=None, max_price=None):
+    """
+    Buy one NFT for `recipient_public` (see find_fulfillment and send_purchase).
+    Refuses to buy for more than max_price ETH when given. Transactions are
+    only sent, the returned futures resolve to their receipts once mined.
+    """
+    tx_data, contract_address, token_id = find_fulfillment(
+        slug, token_id, buyer_public, order_hash, contract_address, protocol_address, max_price
+    )
+    return send_purchase(tx_data, slug, token_id, contract_address, buyer_public, buyer_private_key, recipient_public)
+
+
+def _fillable(to, value, data, buyer_public):
+    """Dry run a call against the current chain state, gas estimate or None if it reverts."""
+    try:
+        return w3.eth.estimate_gas({"from": buyer_public, "to": to, "value": value, "data": data})
+    except Exception:
+        return None
+
+
+def buy_batch(purchases, buyer_public, buyer_private_key):
+    """
+    Buy many NFTs in as few transactions as possible. purchases are dicts with
+    key, slug, token_id, recipient, order_hash, contract_address,
+    protocol_address and max_price (same meaning as for buy_nft).
+
+    Listings that can be matched are bought in one matchAdvancedOrders call
+    per seaport contract, each nft going straight to its recipient; the rest
+    go through send_purchase one by one. Returns (bought, unfilled): key ->
+    buy_nft style result for what was sent, key -> reason for what wasn't.
+    """
+    bought, unfilled = {}, {}
+
+    # ---------- 1 + 2. Fulfillment data for every purchase at once ----------
+    def lookup(purchase):
+        try:
+            return find_fulfillment(
+                purchase["slug"], purchase["token_id"], buyer_public, purchase.get("order_hash"),
+                purchase.get("contract_address"), purchase.get("protocol_address"), purchase.get("max_price"),
+            )
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=BATCH_LOOKUP_WORKERS) as pool:
+        found = list(pool.map(lookup, purchases))
+
+    groups = {}  # seaport contract -> [(purchase, tx_data, order)]
+    for purchase, result in zip(purchases, found):
+        if isinstance(result, Exception):
+            unfilled[purchase["key"]] = str(result)
+            continue
+        tx_data, contract_address, token_id = result
+        purchase.update(tx_data=tx_data, contract_address=contract_address, token_id=token_id)
+
+        order = None
+        try:
+            fulfillment = seaport.fulfillment_order(tx_data)
+            if fulfillment is not None and seaport.batchable(fulfillment[0], fulfillment[1]):
+                order = fulfillment[0]
+        except Exception as e:
+            print(f"can't batch {purchase['slug']} {token_id}: {e}")
+
+        if order is None:
+            groups.setdefault(None, []).append((purchase, tx_data, None))
+        else:
+            groups.setdefault(tx_data["to"], []).append((purchase, tx_data, order))
+
+    # ---------- 3. One match per seaport contract ----------
+    pipeline = get_pipeline(buyer_public, buyer_private_key)
+    for to, group in groups.items():
+        if to is not None and len(group) > 1:
+            group = _send_match(pipeline, to, group, buyer_public, bought, unfilled)
+
+        # unbatchable listings and lone ones go the single transaction way
+        for purchase, tx_data, _ in group:
+            try:
+                bought[purchase["key"]] = send_purchase(
+                    tx_data, purchase["slug"], purchase["token_id"], purchase["contract_address"],
+                    buyer_public, buyer_private_key, purchase["recipient"],
+                )
+            except Exception as e:
+                unfilled[purchase["key"]] = str(e)
+
+    return bought, unfilled
+
+
+def _send_match(pipeline, to, group, buyer_public, bought, unfilled):
+    """
+    Send group as one match transaction. A listing that makes the dry run
+    revert is found by trying each one alone and left out. If the listings
+    that pass alone still don't pass together (a zone that refuses matches,
+    say) they are all handed back. Returns what is left to send singly.
+
+    matchAdvancedOrders is all or nothing on chain: the per listing unfilled
+    reasons only come from this dry run, once sent every order in the match
+    fills or reverts together.
+    """
+    data, value = seaport.match_calldata([(order, purchase["recipient"]) for purchase, _, order in group], buyer_public)
+    gas = _fillable(to, value, data, buyer_public)
+
+    if gas is None:
+        # someone bought / cancelled one of them since the lookup
+        live = []
+        for purchase, tx_data, order in group:
+            single = seaport.direct_calldata(tx_data, purchase["recipient"])
+            if _fillable(to, int(tx_data["value"]), single, buyer_public) is None:
+                unfilled[purchase["key"]] = "listing no longer fillable"
+            else:
+                live.append((purchase, tx_data, order))
+        if len(live) < 2:
+            return live
+        group = live
+        data, value = seaport.match_calldata([(order, purchase["recipient"]) for purchase, _, order in group], buyer_public)
+        gas = _fillable(to, value, data, buyer_public)
+        if gas is None:
+            print(f"{len(group)} listings fill alone but not as a match, sending them one by one")
+            return group
+
+    purchase_tx = pipeline.submit({
+        "to": to,
+        "value": value,
+        "data": data,
+        "gas": int(gas * 1.2),
+    }, label=f"buy {len(group)} nfts")
+    print("Batch Buy TX Hash:", purchase_tx.hash)
+
+    # a match is all or nothing, every order in it shares the receipt
+    for purchase, tx_data, _ in group:
+        bought[purchase["key"]] = {
+            "purchase_tx": purchase_tx.hash,
+            "transfer_tx": None,
+            "purchase": purchase_tx.future,
+            "transfer": purchase_tx.future,
+            "price": float(Web3.from_wei(int(tx_data["value"]), "ether")),
+        }
+    return []
@@ -0,0 +1,171 @@
+import numpy as np
+import time
+
+from scoring import EMBEDDING_DIM, NFTCatalog, normalize_rows
+
+
+class CollectionIndex:
+    """
+    One summary row per collection: the sum of its items' normalized image
+    embeddings (whose direction is the centroid), item count and price range.
+
+    nfts in a collection tend to look alike, so ranking the centroids first
+    and then scoring only the items of the best few collections touches a
+    small slice of the catalog. Sums make add / remove O(1) per item; the
+    price range is only widened by add() and is set exactly by set_stats().
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, capacity=64):
+        self.dim = dim
+        self.collection_ids = []
+        self.slots = {}  # collection id -> row
+        self.sums = np.zeros((capacity, dim), dtype=np.float64)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.min_prices = np.full(capacity, np.inf, dtype=np.float32)
+        self.max_prices = np.full(capacity, -np.inf, dtype=np.float32)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.counts[:len(self.collection_ids)] > 0))
+
+    @classmethod
+    def build(cls, collection_ids, vectors, prices, dim=EMBEDDING_DIM):
+        index = cls(dim=dim)
+        index.add_many(collection_ids, vectors, prices)
+        return index
+
+    @classmethod
+    def from_stats(cls, rows, dim=EMBEDDING_DIM):
+        """From stored summaries (collection_id, vector_sum, item_count, min_price, max_price)."""
+        index = cls(dim=dim, capacity=max(len(rows), 1))
+        for row in rows:
+            slot = index._slot(row.collection_id)
+            if row.vector_sum is not None:
+                index.sums[slot] = row.vector_sum
+            index.set_stats(row.collection_id, row.item_count, row.min_price, row.max_price)
+        return index
+
+    def _slot(self, collection_id):
+        slot = self.slots.get(collection_id)
+        if slot is None:
+            slot = len(self.collection_ids)
+            if slot == len(self.counts):
+                capacity = slot * 2
+                self.sums = np.resize(self.sums, (capacity, self.dim))
+                self.sums[slot:] = 0
+                self.counts = np.resize(self.counts, capacity)
+                self.counts[slot:] = 0
+                self.min_prices = np.resize(self.min_prices, capacity)
+                self.min_prices[slot:] = np.inf
+                self.max_prices = np.resize(self.max_prices, capacity)
+                self.max_prices[slot:] = -np.inf
+            self.slots[collection_id] = slot
+            self.collection_ids.append(collection_id)
+        return slot
+
+    def add_many(self, collection_ids, vectors, prices, sign=1):
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float64).reshape(-1, self.dim))
+        for collection_id, vector, price in zip(collection_ids, vectors, prices):
+            slot = self._slot(collection_id)
+            self.sums[slot] += sign * vector
+            self.counts[slot] += sign
+            if sign > 0:
+                self.min_prices[slot] = min(self.min_prices[slot], price)
+                self.max_prices[slot] = max(self.max_prices[slot], price)
+
+    def add(self, collection_id, vector, price):
+        self.add_many([collection_id], [vector], [price])
+
+    def remove(self, collection_id, vector, price):
+        self.add_many([collection_id], [vector], [price], sign=-1)
+
+    def set_stats(self, collection_id, count, min_price, max_price):
+        slot = self._slot(collection_id)
+        self.counts[slot] = count or 0
+        self.min_prices[slot] = np.inf if min_price is None else min_price
+        self.max_prices[slot] = -np.inf if max_price is None else max_price
+
+    def sum(self, collection_id):
+        slot = self.slots.get(collection_id)
+        return np.zeros(self.dim) if slot is None else self.sums[slot].copy()
+
+    def centroids(self):
+        return normalize_rows(self.sums[:len(self.collection_ids)]).astype(np.float32)
+
+    def top_collections(self, preferences_vector, price_cap=None, n=20):
+        """Ids and centroid similarity of the n best collections with at least one item within price_cap."""
+        size = len(self.collection_ids)
+        if size == 0:
+            return [], []
+
+        scores = self.centroids() @ np.asarray(preferences_vector, dtype=np.float32)
+        usable = self.counts[:size] > 0
+        if price_cap is not None:
+            usable &= self.min_prices[:size] <= price_cap
+        scores = np.where(usable, scores, -np.inf)
+
+        n = min(n, int(usable.sum()))
+        if n == 0:
+            return [], []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.collection_ids[i] for i in top], scores[top].tolist()
+
+
+def search(index, fetch_catalog, preferences_vector, price_cap=None, k=10, n_collections=20):
+    """
+    Two stage search: rank collections by centroid, then score the items of
+    the best n_collections exactly. fetch_catalog(collection_ids) -> NFTCatalog.
+    Returns (nft ids, scores) best first like the other backends.
+    """
+    top, _ = index.top_collections(preferences_vector, price_cap, n=n_collections)
+    if not top:
+        return [], []
+
+    catalog = fetch_catalog(top)
+    indices, scores = catalog.top_k(preferences_vector, price_cap, k=k)
+    return [int(catalog.ids[i]) for i in indices], scores
+
+
+# ---- benchmark against scoring the whole catalog ----
+
+def benchmark(n=200_000, n_queries=50, k=10, dim=EMBEDDING_DIM, seed=0):
+    rng = np.random.default_rng(seed)
+
+    # same clustered fake catalog as the ann benchmark, one cluster per collection
+    n_collections = max(1, n // 200)
+    centers = normalize_rows(rng.standard_normal((n_collections, dim), dtype=np.float32))
+    members = rng.integers(n_collections, size=n)
+    vectors = normalize_rows(centers[members] + 2 * rng.standard_normal((n, dim), dtype=np.float32) / np.sqrt(dim))
+    prices = rng.uniform(0, 20, n).astype(np.float32)
+    collection_ids = [f"collection-{m}" for m in members]
+    queries = normalize_rows(centers[rng.integers(n_collections, size=n_queries)] + rng.standard_normal((n_queries, dim), dtype=np.float32) / np.sqrt(dim))
+
+    full = NFTCatalog(ids=np.arange(n), collection_ids=collection_ids, nft_ids=[""] * n, prices=prices, image_matrix=vectors)
+
+    start = time.perf_counter()
+    index = CollectionIndex.build(collection_ids, vectors, prices, dim=dim)
+    print(f"built collection index over {n} nfts in {time.perf_counter() - start:.2f}s ({len(index)} collections)")
+
+    rows_by_collection = {}
+    for i, collection_id in enumerate(collection_ids):
+        rows_by_collection.setdefault(collection_id, []).append(i)
+
+    def fetch(top):
+        rows = np.concatenate([rows_by_collection[c] for c in top])
+        return NFTCatalog(ids=rows, collection_ids=[collection_ids[i] for i in rows], nft_ids=[""] * len(rows), prices=prices[rows], image_matrix=vectors[rows])
+
+    start = time.perf_counter()
+    exact = [set(full.ids[full.top_k(q, price_cap=10, k=k)[0]].tolist()) for q in queries]
+    brute = (time.perf_counter() - start) / n_queries
+    print(f"full scan: {brute * 1000:.2f} ms/query")
+
+    for n_top in (1, 5, 10, 20, 50):
+        start = time.perf_counter()
+        found = [search(index, fetch, q, price_cap=10, k=k, n_collections=n_top)[0] for q in queries]
+        latency = (time.perf_counter() - start) / n_queries
+        recall = sum(len(e.intersection(f)) for e, f in zip(exact, found)) / sum(len(e) for e in exact)
+        print(f"top {n_top:>3} collections: recall@{k} {recall:.3f} | {latency * 1000:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    benchmark()
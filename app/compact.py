@@ -0,0 +1,178 @@
+import numpy as np
+import sys
+import time
+
+from scoring import EMBEDDING_DIM, normalize_rows
+
+# Compact embedding storage (NFT_SEARCH=compact).
+#
+# Each image embedding is kept twice next to the ARRAY(Float) column:
+#   - float16 bytes (1.5 KB) used for the exact re-rank
+#   - int8 codes (768 bytes) + one float scale per row used for the coarse scan
+# The coarse scan only loads the int8 codes for the whole catalog, then the
+# float16 vectors are fetched for the best few candidates and scored exactly.
+#
+# The float16 copy is also what every other search mode loads (row_vector),
+# the ARRAY column is only written: it is the lossless original the compact
+# columns are derived from, and the pgvector trigger fills its column from it.
+
+
+def to_float16_bytes(vector):
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def from_float16_bytes(blob):
+    return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+
+
+def row_vector(row):
+    """A row's image embedding: the float16 copy, or the full array for rows written before the compact columns."""
+    if row.image_embedding_f16 is not None:
+        return from_float16_bytes(row.image_embedding_f16)
+    return row.image_embedding_vector
+
+
+def quantize_int8(vector):
+    """Symmetric per vector quantization, returns (int8 bytes, scale) with vector ~= codes * scale."""
+    vector = np.asarray(vector, dtype=np.float32)
+    peak = float(np.abs(vector).max()) if len(vector) else 0.0
+    scale = peak / 127 if peak > 0 else 1.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return codes.tobytes(), scale
+
+
+def compact_columns(vector):
+    """Values for the compact NFTS columns from a float embedding."""
+    vector = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+    codes, scale = quantize_int8(vector)
+    return {
+        "image_embedding_f16": to_float16_bytes(vector),
+        "image_embedding_int8": codes,
+        "image_embedding_scale": scale,
+    }
+
+
+class QuantizedCatalog:
+    """int8 copy of the catalog used for the coarse scan."""
+
+    def __init__(self, ids, prices, codes, scales):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.prices = np.asarray(prices, dtype=np.float32)
+        self.codes = np.ascontiguousarray(codes, dtype=np.int8)
+        self.scales = np.asarray(scales, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows, dim=EMBEDDING_DIM):
+        """rows need id, price, image_embedding_int8 and image_embedding_scale."""
+        codes = np.zeros((len(rows), dim), dtype=np.int8)
+        for i, row in enumerate(rows):
+            codes[i] = np.frombuffer(row.image_embedding_int8, dtype=np.int8)
+        return cls(
+            ids=[row.id for row in rows],
+            prices=[row.price for row in rows],
+            codes=codes,
+            scales=[row.image_embedding_scale for row in rows],
+        )
+
+    def drop(self, ids):
+        """Take rows out of the scan in place by pricing them out of every budget (see NFTCatalog.drop)."""
+        self.prices[np.isin(self.ids, list(ids))] = np.inf
+
+    def coarse_scores(self, preferences_vector, price_cap=None, chunk=65536):
+        query = np.asarray(preferences_vector, dtype=np.float32)
+        scores = np.empty(len(self), dtype=np.float32)
+        # convert in chunks so the scan never holds a float copy of the whole catalog
+        for start in range(0, len(self), chunk):
+            block = self.codes[start:start + chunk].astype(np.float32)
+            scores[start:start + chunk] = (block @ query) * self.scales[start:start + chunk]
+        if price_cap is not None:
+            scores = np.where(self.prices <= price_cap, scores, -np.inf)
+        return scores
+
+    def coarse_top(self, preferences_vector, price_cap=None, n=100):
+        """ids of the n best rows by int8 score (unordered)."""
+        scores = self.coarse_scores(preferences_vector, price_cap)
+        valid = np.flatnonzero(np.isfinite(scores))
+        if len(valid) == 0:
+            return []
+        n = min(n, len(valid))
+        top = valid[np.argpartition(-scores[valid], n - 1)[:n]]
+        return self.ids[top].tolist()
+
+
+def rerank(preferences_vector, candidates, k=1):
+    """
+    Exact re-rank of (id, float16 bytes) candidates.
+    Returns (ids, scores) best first, only positive scores like NFTCatalog.top_k.
+    """
+    if not candidates:
+        return [], []
+    query = np.asarray(preferences_vector, dtype=np.float32)
+    ids = np.array([c[0] for c in candidates])
+    vectors = np.stack([from_float16_bytes(c[1]) for c in candidates])
+    scores = vectors @ query
+
+    order = np.argsort(-scores, kind="stable")
+    order = order[scores[order] > 0][:k]
+    return ids[order].tolist(), scores[order].tolist()
+
+
+def search(catalog, fetch_float16, preferences_vector, price_cap=None, k=1, rerank_size=100):
+    """
+    Two stage search: int8 scan for rerank_size candidates, then exact re-rank.
+    fetch_float16(ids) must return [(id, float16 bytes)] for those ids.
+    """
+    candidate_ids = catalog.coarse_top(preferences_vector, price_cap, max(rerank_size, k))
+    if not candidate_ids:
+        return [], []
+    return rerank(preferences_vector, fetch_float16(candidate_ids), k)
+
+
+# ---- memory / ranking benchmark ----
+
+def benchmark(n=100_000, n_queries=50, k=10, rerank_size=100, dim=EMBEDDING_DIM, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((max(1, n // 200), dim), dtype=np.float32))
+    vectors = normalize_rows(centers[rng.integers(len(centers), size=n)] + 2 * rng.standard_normal((n, dim), dtype=np.float32) / np.sqrt(dim))
+    prices = rng.uniform(0, 20, n).astype(np.float32)
+    queries = normalize_rows(centers[rng.integers(len(centers), size=n_queries)] + rng.standard_normal((n_queries, dim), dtype=np.float32) / np.sqrt(dim))
+
+    # a python list of floats per row is what ARRAY(Float) comes back as
+    sample = vectors[0].astype(float).tolist()
+    list_bytes = sys.getsizeof(sample) + sum(sys.getsizeof(v) for v in sample)
+    print(f"per nft: python list {list_bytes} B | float64 on the wire {dim * 8} B | float32 {dim * 4} B | float16 {dim * 2} B | int8 {dim + 4} B")
+
+    start = time.perf_counter()
+    columns = [compact_columns(v) for v in vectors]
+    print(f"encoded {n} vectors in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    codes = np.stack([np.frombuffer(c["image_embedding_int8"], dtype=np.int8) for c in columns])
+    catalog = QuantizedCatalog(np.arange(n), prices, codes, [c["image_embedding_scale"] for c in columns])
+    print(f"loaded int8 catalog in {time.perf_counter() - start:.2f}s ({catalog.codes.nbytes / 2 ** 20:.0f} MB vs {n * list_bytes / 2 ** 20:.0f} MB as lists)")
+
+    fetch = lambda ids: [(i, columns[i]["image_embedding_f16"]) for i in ids]
+
+    hits = 0
+    exact_time = 0
+    compact_time = 0
+    for q in queries:
+        start = time.perf_counter()
+        exact = np.where(prices <= 10, vectors @ q, -np.inf)
+        exact_top = set(np.argsort(-exact)[:k].tolist())
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found, _ = search(catalog, fetch, q, price_cap=10, k=k, rerank_size=rerank_size)
+        compact_time += time.perf_counter() - start
+        hits += len(exact_top.intersection(found))
+
+    print(f"recall@{k} vs exact float32: {hits / (k * n_queries):.3f}")
+    print(f"exact {exact_time / n_queries * 1000:.2f} ms/query | int8 + re-rank {compact_time / n_queries * 1000:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    benchmark()
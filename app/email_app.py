@@ -1,5 +1,5 @@
-import requests
 import base64
+import http_client
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition, ContentId
 import os
@@ -15,7 +15,7 @@ def send_template_email(to_email: str, image_url: str):
 
     # Fetch the image
     try:
-        img_request = requests.get(image_url, timeout=5)
+        img_request = http_client.get("images", image_url)
         if img_request.status_code != 200:
             print("⚠️ Image URL is not reachable. Status:", img_request.status_code)
             return False
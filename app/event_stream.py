@@ -0,0 +1,201 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+import aiohttp
+
+import http_client
+
+# Incremental catalog updates from the OpenSea stream api.
+#
+# The stream is a phoenix channels websocket: join a topic (collection:* for
+# every collection), then item_listed / item_cancelled / item_sold events
+# arrive as they happen. consume() parses them into the same nft dicts the
+# crawl produces plus a "type", hands them to a handler in small batches and
+# saves the sent_at of the last applied event as its position. On reconnect
+# the position is sent as ?since= and anything older is skipped, applying an
+# event twice is harmless (upsert / delete).
+#
+# The real stream doesn't replay missed events (the replay server in
+# tests/test_event_stream.py does), so the periodic watermark crawl stays the
+# backstop for gaps.
+
+STREAM_URL = "wss://stream.openseabeta.com/socket/websocket"
+
+EVENT_TYPES = {"item_listed": "listed", "item_cancelled": "cancelled", "item_sold": "sold"}
+
+
+def _unix(iso):
+    if not iso:
+        return None
+    return int(datetime.fromisoformat(iso).timestamp())
+
+
+def parse_event(message):
+    """Stream message -> event dict, or None for anything that isn't a listing / cancel / sale."""
+    event_type = EVENT_TYPES.get(message.get("event"))
+    if event_type is None:
+        return None
+
+    outer = message.get("payload", {})
+    payload = outer.get("payload", {})
+    item = payload.get("item", {})
+
+    # nft_id is "<chain>/<contract>/<token id>"
+    parts = (item.get("nft_id") or "").split("/")
+    if len(parts) != 3 or parts[0] != "ethereum":
+        return None
+    _, contract, identifier = parts
+
+    token = payload.get("payment_token") or {}
+    decimals = int(token.get("decimals", 18))
+    base_price = payload.get("base_price") or payload.get("sale_price")
+    price = int(base_price) / (10 ** decimals) if base_price is not None else None
+
+    return {
+        "type": event_type,
+        "position": outer.get("sent_at"),
+        "collection_id": (payload.get("collection") or {}).get("slug"),
+        "nft_id": identifier,
+        "image_url": (item.get("metadata") or {}).get("image_url"),
+        "currency": token.get("symbol"),
+        "price": price,
+        "contract_address": contract,
+        "order_hash": payload.get("order_hash"),
+        "listing_end_time": _unix(payload.get("expiration_date")),
+        "remaining_quantity": payload.get("quantity"),
+        "protocol_address": payload.get("protocol_address"),
+    }
+
+
+def collapse(events):
+    """
+    Last event per (collection_id, nft_id) from a batch in stream order. A cancel
+    of another order than the listing before it in the batch doesn't undo that
+    listing, and a cancel never undoes a sale.
+    """
+    latest = {}
+    for event in events:
+        key = (event["collection_id"], event["nft_id"])
+        previous = latest.get(key)
+        if event["type"] == "cancelled" and previous is not None:
+            if previous["type"] == "sold" or (previous["type"] == "listed" and previous["order_hash"] != event["order_hash"]):
+                continue
+        latest[key] = event
+    return latest
+
+
+def listings(latest, price_ceiling):
+    """The collapsed listing events worth storing (known collection, priced at most price_ceiling)."""
+    return [
+        e for e in latest.values()
+        if e["type"] == "listed" and e["collection_id"] and e["price"] is not None and e["price"] <= price_ceiling
+    ]
+
+
+def removals(latest, rows):
+    """
+    ids of the stored rows (id, collection_id, nft_id, order_hash) the collapsed
+    events take out: every sale, and cancels of the listing we have stored
+    (or of rows that don't know their listing).
+    """
+    ids = []
+    for row in rows:
+        event = latest.get((row.collection_id, row.nft_id))
+        if event is None or event["type"] == "listed":
+            continue
+        if event["type"] == "sold" or row.order_hash is None or row.order_hash == event["order_hash"]:
+            ids.append(row.id)
+    return ids
+
+
+def _message(topic, event, payload=None, ref=None):
+    return json.dumps({"topic": topic, "event": event, "payload": payload or {}, "ref": ref})
+
+
+async def _heartbeat(ws, interval):
+    ref = 0
+    while True:
+        await asyncio.sleep(interval)
+        ref += 1
+        await ws.send_str(_message("phoenix", "heartbeat", ref=str(ref)))
+
+
+async def consume(url, api_key, handle, load_position, save_position, topics=("collection:*",),
+                  batch_size=100, flush_interval=1.0, heartbeat=30, stop=None):
+    """
+    Follow the stream until stop (an asyncio.Event) is set, reconnecting with backoff.
+
+    handle(events) applies a batch (runs on a worker thread), load_position() /
+    save_position(position) read and store the resume point.
+    """
+    position = load_position()
+    attempt = 0
+
+    while stop is None or not stop.is_set():
+        query = {"token": api_key or ""}
+        if position:
+            query["since"] = position
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(f"{url}?{urlencode(query)}", timeout=http_client.CONNECT_TIMEOUT) as ws:
+                    for ref, topic in enumerate(topics):
+                        await ws.send_str(_message(topic, "phx_join", ref=str(ref)))
+                    print(f"event stream connected, resuming from {position}")
+                    attempt = 0
+                    beat = asyncio.create_task(_heartbeat(ws, heartbeat))
+                    try:
+                        position = await _read(ws, handle, save_position, position, batch_size, flush_interval, stop)
+                    finally:
+                        beat.cancel()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+            print(f"event stream disconnected: {e}")
+
+        if stop is not None and stop.is_set():
+            break
+        delay = http_client.retry_delay(min(attempt, 6))
+        attempt += 1
+        print(f"event stream reconnecting in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def _read(ws, handle, save_position, position, batch_size, flush_interval, stop):
+    """Read until the socket closes, applying batches as they fill. Returns the new position."""
+    batch = []
+    deadline = time.monotonic() + flush_interval
+
+    async def flush():
+        nonlocal batch, position
+        if batch:
+            await asyncio.to_thread(handle, batch)
+            position = batch[-1]["position"] or position
+            save_position(position)
+            batch = []
+
+    try:
+        while stop is None or not stop.is_set():
+            try:
+                msg = await ws.receive(timeout=max(deadline - time.monotonic(), 0.01))
+            except asyncio.TimeoutError:
+                await flush()
+                deadline = time.monotonic() + flush_interval
+                continue
+
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+
+            event = parse_event(json.loads(msg.data))
+            # resumed streams start at the saved position, older events were already applied
+            if event is None or (position and event["position"] and event["position"] < position):
+                continue
+            batch.append(event)
+            if len(batch) >= batch_size:
+                await flush()
+                deadline = time.monotonic() + flush_interval
+    finally:
+        # whatever arrived before the disconnect still gets applied
+        await flush()
+
+    return position
+
@@ -0,0 +1,82 @@
+import os
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One pooled keep-alive session per api for every outbound http call.
+#
+# Each api (host) gets its own connection pool, sized by HTTP_POOL_<API>
+# (e.g. HTTP_POOL_OPENSEA=32). Every request gets the same (connect, read)
+# timeout unless the caller passes one, and connection errors, timeouts,
+# 429 and 5xx are retried with exponential backoff, waiting for Retry-After
+# instead when the server sends it.
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 20))
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# default pool size per api, HTTP_POOL_<API> overrides
+POOL_SIZES = {"opensea": 16, "alchemy": 8, "coingecko": 2, "images": 16, "default": 4}
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def pool_size(api):
+    return int(os.getenv(f"HTTP_POOL_{api.upper()}", POOL_SIZES.get(api, POOL_SIZES["default"])))
+
+
+def make_retry():
+    return Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        # the POSTs we make (fulfillment data, json-rpc reads) are safe to repeat
+        allowed_methods=frozenset(["GET", "HEAD", "POST"]),
+        respect_retry_after_header=True,
+        # hand the last response back instead of raising, callers check the body
+        raise_on_status=False,
+    )
+
+
+def session(api="default", size=None):
+    """The shared session for an api, created on first use."""
+    with _lock:
+        s = _sessions.get(api)
+        if s is None:
+            size = size or pool_size(api)
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=make_retry())
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _sessions[api] = s
+        return s
+
+
+def get(api, url, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    return session(api).get(url, **kwargs)
+
+
+def post(api, url, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    return session(api).post(url, **kwargs)
+
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt (0 based), for callers not going through requests."""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return BACKOFF * (2 ** attempt) * (0.5 + random.random() / 2)
@@ -0,0 +1,115 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# Content addressed cache of image embeddings in sqlite.
+#
+# embeddings: sha256(image bytes) -> vector, keyed per model so a model change
+#             never serves stale vectors
+# urls:       sha256(url) -> content hash, so a url seen before skips the download
+#
+# Entries are evicted least recently used once there are more than
+# max_entries embeddings (768 float32 = 3 KB each). The count is kept in
+# memory so a put only runs the eviction when the limit is passed, and each
+# eviction frees EVICT_FRACTION of the cache so the next one is a while off.
+# Other processes sharing the file are picked up when it recounts after one.
+
+EVICT_FRACTION = 0.1
+
+
+def url_hash(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageEmbeddingCache:
+
+    def __init__(self, path, model, max_entries=100000):
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (content_hash, model)
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+            CREATE TABLE IF NOT EXISTS urls (
+                url_hash TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _get(self, digest):
+        row = self._conn.execute(
+            "SELECT vector FROM embeddings WHERE content_hash = ? AND model = ?", (digest, self.model)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE embeddings SET last_used = ? WHERE content_hash = ? AND model = ?", (time.time(), digest, self.model)
+        )
+        self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def get_by_url(self, url):
+        """(content hash, vector) for a url embedded before, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM urls WHERE url_hash = ?", (url_hash(url),)).fetchone()
+            vector = self._get(row[0]) if row else None
+            if vector is None:
+                return None
+            self.hits += 1
+            return row[0], vector
+
+    def get_by_content(self, digest):
+        with self._lock:
+            vector = self._get(digest)
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vector
+
+    def remember_url(self, url, digest):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO urls (url_hash, content_hash) VALUES (?, ?)", (url_hash(url), digest))
+            self._conn.commit()
+
+    def put(self, url, digest, vector):
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (content_hash, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                (digest, self.model, blob, time.time()),
+            )
+            self._conn.execute("INSERT OR REPLACE INTO urls (url_hash, content_hash) VALUES (?, ?)", (url_hash(url), digest))
+            # a replaced row counts too, at worst that runs the eviction a little early
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        keep = self.max_entries - int(self.max_entries * EVICT_FRACTION)
+        evicted = self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (keep,),
+        ).rowcount
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        # urls pointing at evicted embeddings would only cost a wasted lookup, but they'd grow forever
+        if evicted > 0:
+            self._conn.execute("DELETE FROM urls WHERE content_hash NOT IN (SELECT content_hash FROM embeddings)")
@@ -0,0 +1,169 @@
+import queue
+import threading
+import time
+import numpy as np
+
+import http_client
+from image_cache import content_hash
+
+# Producer / consumer pipeline for image ingestion:
+#
+#   urls -> [fetch pool] -> raw queue -> [decode pool] -> image queue -> embed (caller thread)
+#
+# Both queues are bounded, so when the model falls behind the decoders and
+# fetchers block instead of piling images up in memory, and while the model
+# is busy the next batches are already downloading.
+#
+# With an ImageEmbeddingCache, a url seen before skips the download and
+# bytes seen before (same artwork under another url) skip the model.
+
+_DONE = object()
+
+
+def fetch_bytes(session, path, timeout=http_client.TIMEOUT):
+    if path.startswith("http"):
+        r = session.get(path, timeout=timeout)
+        r.raise_for_status()
+        return r.content
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def run_pipeline(paths, decode_fn, embed_fn, blank, fetch_workers=16, decode_workers=4, batch_size=16, queue_size=64, session=None, cache=None):
+    """
+    Fetch, decode and embed every path.
+
+    Returns (embeddings, digests), one of each per path in order. digests are
+    sha256 of the image bytes, None where the image couldn't be fetched or
+    decoded (those get the blank embedding).
+
+    decode_fn(data, path) -> image or None
+    embed_fn(list of images) -> list of embeddings
+    """
+    results = [blank] * len(paths)
+    digests = [None] * len(paths)
+    if not paths:
+        return results, digests
+
+    session = session or http_client.session("images", fetch_workers)
+    todo = queue.Queue()
+    raw = queue.Queue(maxsize=queue_size)
+    images = queue.Queue(maxsize=queue_size)
+    timings = {"fetch": 0.0, "decode": 0.0, "embed": 0.0}
+    timing_lock = threading.Lock()
+
+    for item in enumerate(paths):
+        todo.put(item)
+
+    cached = [0]
+
+    def fetcher():
+        while True:
+            try:
+                i, path = todo.get_nowait()
+            except queue.Empty:
+                break
+
+            if cache is not None:
+                hit = cache.get_by_url(path)
+                if hit is not None:
+                    digests[i], results[i] = hit
+                    with timing_lock:
+                        cached[0] += 1
+                    continue
+
+            start = time.perf_counter()
+            try:
+                data = fetch_bytes(session, path)
+            except Exception as e:
+                print(f"Failed to load image {path}: {e}")
+                data = None
+            with timing_lock:
+                timings["fetch"] += time.perf_counter() - start
+
+            digest = content_hash(data) if data is not None else None
+            if cache is not None and digest is not None:
+                vector = cache.get_by_content(digest)
+                if vector is not None:
+                    cache.remember_url(path, digest)
+                    digests[i], results[i] = digest, vector
+                    with timing_lock:
+                        cached[0] += 1
+                    continue
+
+            raw.put((i, path, data, digest))
+
+    def decoder():
+        while True:
+            item = raw.get()
+            if item is _DONE:
+                break
+            i, path, data, digest = item
+            start = time.perf_counter()
+            try:
+                img = decode_fn(data, path) if data is not None else None
+            except Exception as e:
+                print(f"Failed to decode image {path}: {e}")
+                img = None
+            with timing_lock:
+                timings["decode"] += time.perf_counter() - start
+            images.put((i, path, digest, img))
+        images.put(_DONE)
+
+    fetchers = [threading.Thread(target=fetcher, daemon=True) for _ in range(fetch_workers)]
+    for t in fetchers:
+        t.start()
+
+    decoders = [threading.Thread(target=decoder, daemon=True) for _ in range(decode_workers)]
+    for t in decoders:
+        t.start()
+
+    def closer():
+        # once every fetch is done, tell each decoder to stop
+        for t in fetchers:
+            t.join()
+        for _ in decoders:
+            raw.put(_DONE)
+    threading.Thread(target=closer, daemon=True).start()
+
+    def flush(batch):
+        start = time.perf_counter()
+        embeddings = embed_fn([img for _, _, _, img in batch])
+        timings["embed"] += time.perf_counter() - start
+        for (i, path, digest, _), emb in zip(batch, embeddings):
+            results[i] = emb
+            # the embedder returns a blank vector when the model fails on an image
+            if not np.any(np.asarray(emb)):
+                continue
+            digests[i] = digest
+            if cache is not None:
+                cache.put(path, digest, emb)
+
+    # embedding stage runs here so the model stays on the caller's thread
+    start = time.perf_counter()
+    batch = []
+    finished = 0
+    embedded = 0
+    while finished < decode_workers:
+        item = images.get()
+        if item is _DONE:
+            finished += 1
+            continue
+        i, path, digest, img = item
+        if img is None:
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush(batch)
+            embedded += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        embedded += len(batch)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"image pipeline: {embedded}/{len(paths)} images embedded, {cached[0]} from cache, in {elapsed:.1f}s ({embedded / max(elapsed, 1e-9):.1f} images/s) | "
+        f"fetch {timings['fetch']:.1f}s, decode {timings['decode']:.1f}s (summed over workers), embed {timings['embed']:.1f}s"
+    )
+    return results, digests
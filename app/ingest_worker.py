@@ -0,0 +1,166 @@
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import text
+
+# Background catalog refill.
+#
+# Every interval (or as soon as wake() is called) the worker sweeps out
+# expired listings, counts the catalog and, if it is under the low watermark,
+# crawls until it holds up to the high watermark. The crawl runs under a
+# postgres advisory lock so only one process (gunicorn worker, cron, ...)
+# crawls at a time, the others skip the round. Request handlers only ever call wake(), they never crawl.
+#
+# A refill only asks for what is missing (high - count) and crawls until that
+# many new rows were inserted (listings already stored only get refreshed), so
+# the crawl is usually cut off before the end and says nothing about the rows
+# it didn't reach. Rows are only treated as stale after a complete crawl, and never if
+# they were written (by the event stream, say) after the crawl started.
+
+# arbitrary key shared by everything that refills the nfts table
+INGEST_LOCK_KEY = 0x4E4654
+
+
+def stale_ids(rows, seen, crawl_started, complete):
+    """
+    Ids of stored rows (id, collection_id, nft_id, listed_at) whose listing a
+    crawl that started at crawl_started (unix seconds) shows to be gone.
+    Nothing is stale unless the crawl was complete.
+    """
+    if not complete or not seen:
+        return []
+    return [
+        row.id for row in rows
+        if (row.collection_id, row.nft_id) not in seen
+        and (row.listed_at is None or row.listed_at < crawl_started)
+    ]
+
+
+def upsert_chunks(data, upsert_fn, chunk_size, limit=None):
+    """
+    Hand crawled nfts to upsert_fn(chunk) -> number of rows inserted, in
+    chunks of up to chunk_size, until limit new rows were inserted (all of
+    data if None). Repeated keys and nfts without a collection id are
+    skipped. Returns (seen keys, rows inserted, whether data ran out).
+    """
+    seen = set()
+    chunk = []
+    inserted = 0
+
+    def full():
+        # the last chunk only needs to be as big as what is still missing
+        return len(chunk) >= (chunk_size if limit is None else min(chunk_size, limit - inserted))
+
+    for nft in data:
+        collection_id = nft.get("collection_id")
+        if not isinstance(collection_id, str):
+            print("no collection ID")
+            continue
+
+        key = (collection_id, str(nft.get("nft_id")))
+        if key in seen:
+            continue
+        seen.add(key)
+
+        chunk.append(nft)
+        if full():
+            inserted += upsert_fn(chunk)
+            chunk = []
+            if limit is not None and inserted >= limit:
+                return seen, inserted, False
+
+    if chunk:
+        inserted += upsert_fn(chunk)
+    return seen, inserted, True
+
+
+@contextmanager
+def advisory_lock(engine, key=INGEST_LOCK_KEY, wait=False):
+    """Take a session level advisory lock on its own connection (try only unless wait), yields whether we got it."""
+    with engine.connect() as conn:
+        if wait:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+            acquired = True
+        else:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                conn.commit()
+
+
+class IngestWorker:
+
+    def __init__(self, count_fn, refill_fn, lock_fn, low, high, interval=300, context=None, sweep_fn=None):
+        """
+        count_fn() -> rows in the catalog
+        refill_fn(limit) crawls until limit new nfts are stored (or the crawl ends)
+        lock_fn() -> context manager yielding whether this process may crawl
+        context() -> context manager every round runs in (e.g. app.app_context)
+        sweep_fn() evicts dead rows before every count
+        """
+        self.count_fn = count_fn
+        self.refill_fn = refill_fn
+        self.lock_fn = lock_fn
+        self.low = low
+        self.high = high
+        self.interval = interval
+        self.context = context
+        self.sweep_fn = sweep_fn
+        self.refilling = False
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Ask for a check now instead of at the next interval, returns immediately."""
+        self._wake.set()
+
+    def run_once(self):
+        """One round: sweep, then refill if under the low watermark. Returns True if this process crawled."""
+        if self.sweep_fn is not None:
+            self.sweep_fn()
+
+        count = self.count_fn()
+        if count >= self.low:
+            return False
+
+        with self.lock_fn() as acquired:
+            if not acquired:
+                print("catalog refill already running in another process")
+                return False
+
+            # someone may have refilled between the count and the lock
+            count = self.count_fn()
+            if count >= self.low:
+                return False
+
+            print(f"catalog has {count} nfts (low watermark {self.low}), refilling up to {self.high}")
+            start = time.perf_counter()
+            self.refilling = True
+            try:
+                self.refill_fn(self.high - count)
+            finally:
+                self.refilling = False
+            print(f"catalog refill done in {time.perf_counter() - start:.0f}s, {self.count_fn()} nfts")
+            return True
+
+    def _run(self):
+        while True:
+            try:
+                if self.context is not None:
+                    with self.context():
+                        self.run_once()
+                else:
+                    self.run_once()
+            except Exception as e:
+                print(f"catalog refill failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
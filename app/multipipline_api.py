@@ -1,31 +1,75 @@
-import requests
 import os
+import time
 from dotenv import load_dotenv
 
+from response_cache import ResponseCache
+import http_client
+
 load_dotenv()
 CGECKO_KEY = os.getenv('CGECKO_APIKEY')
 ALCCHEM_KEY = os.getenv('ALCHEM_APIKEY')
 OPNSEA_KEY = os.getenv('OPNSEA_APIKEY')
 
+# listings per page when following the /listings/.../all cursor (opensea max is 100)
+LISTINGS_PAGE_SIZE = 100
+
+# base urls (overridable so the crawlers can be pointed at a mock server)
+CGECKO_URL = os.getenv('CGECKO_URL', "https://api.coingecko.com")
+ALCHEM_URL = os.getenv('ALCHEM_URL', "https://eth-mainnet.g.alchemy.com")
+OPNSEA_URL = os.getenv('OPNSEA_URL', "https://api.opensea.io")
+
+# seconds each kind of response stays fresh in the local cache, 0 = never cached
+API_CACHE_TTLS = {
+    "collections": 6 * 3600,        # coingecko collection list
+    "slug": 30 * 24 * 3600,         # contract -> opensea slug (only the slug is read from the floor price call)
+    "nft": 30 * 24 * 3600,          # token metadata
+    "listings": 120,                # listing pages
+    "best_listing": 0,              # buying needs the live price
+}
+# API_CACHE_PATH="" turns the cache off
+responseCache = ResponseCache(os.getenv('API_CACHE_PATH', "api_cache.sqlite3"), API_CACHE_TTLS)
+
+def isValidListings(response):
+    return isinstance(response, dict) and "listings" in response
+
+def isValidNFT(response):
+    return isinstance(response, dict) and "nft" in response
+
+def isValidSlug(response):
+    return isinstance(response, dict) and "error" not in response
+
 # ['0xd07dc4262bcdbf85190c01c996b4c06a461d2430', '0x90cA8a3eb2574F937F514749ce619fDCCa187d45', '0xa342f5d851e866e18ff98f351f2c6637f4478db5', '0x76BE3b62873462d2142405439777e971754E8E77', '0x57f1887a8bf19b14fc0df6fd9b2acc9af147ea85', '0x1eb7382976077f92cf25c27cc3b900a274fd0012', '0x8fb956ce2921954c45cb3bb41978c4c6c9736af2', '0x0baeccd651cf4692a8790bcc4f606e79bf7a3b1c']
 
 def getCollectionsAscPriceFloor(num=250, blockchain="ethereum"):
-    url = "https://api.coingecko.com/api/v3/nfts/list"
+    url = f"{CGECKO_URL}/api/v3/nfts/list"
     headers = {"x-cg-demo-api-key": f"{CGECKO_KEY}",
                "per_page": f"{num}"}
     
     querystring = {"order": "floor_price_native_asc"}
 
-    response = requests.get(url, headers=headers, params=querystring).json()
+    response = responseCache.get(
+        "collections", f"{num}:{querystring['order']}",
+        lambda: http_client.get("coingecko", url, headers=headers, params=querystring).json(),
+        valid=lambda r: isinstance(r, list),
+    )
+    return parseCollections(response, blockchain)
+
+def parseCollections(response, blockchain="ethereum"):
     results = [obj for obj in response if obj.get("asset_platform_id") == blockchain]
     return [r.get("contract_address") for r in results]
 
 def getMarketplaceCollectionAddress(contract_address, marketplace="openSea"):
-    url = f"https://eth-mainnet.g.alchemy.com/nft/v3/{ALCCHEM_KEY}/getFloorPrice"
+    url = f"{ALCHEM_URL}/nft/v3/{ALCCHEM_KEY}/getFloorPrice"
     querystring = {"contractAddress":contract_address}
 
-    response = requests.get(url, params=querystring).json()
+    response = responseCache.get(
+        "slug", contract_address.lower(),
+        lambda: http_client.get("alchemy", url, params=querystring).json(),
+        valid=isValidSlug,
+    )
+    return parseMarketplaceCollectionAddress(response, marketplace)
 
+def parseMarketplaceCollectionAddress(response, marketplace="openSea"):
     try:
         if marketplace in response:
             if marketplace == "openSea":
@@ -38,12 +82,39 @@ def getMarketplaceCollectionAddress(contract_address, marketplace="openSea"):
     except:
         print("Error: ",response)
 
-def getAllListings(collection_slug, price_celing):
-    url = f"https://api.opensea.io/api/v2/listings/collection/{collection_slug}/all"
+def getAllListings(collection_slug, price_celing, max_listings=None):
+    return list(iterAllListings(collection_slug, price_celing, max_listings))
+
+def iterAllListings(collection_slug, price_celing, max_listings=None):
+    """
+    Yield the collection's listings under price_celing page by page, following
+    the `next` cursor until the last page or max_listings have been yielded.
+    """
+    url = f"{OPNSEA_URL}/api/v2/listings/collection/{collection_slug}/all"
     headers = {"accept": "*/*",
                "x-api-key": f"{OPNSEA_KEY}", }
 
-    response = requests.get(url, headers=headers).json()
+    querystring = {"limit": LISTINGS_PAGE_SIZE}
+    count = 0
+    while True:
+        response = responseCache.get(
+            "listings", f"{collection_slug}:{querystring['limit']}:{querystring.get('next', '')}",
+            lambda: http_client.get("opensea", url, headers=headers, params=querystring).json(),
+            valid=isValidListings,
+        )
+
+        for listing in parseListings(response, price_celing):
+            yield listing
+            count += 1
+            if max_listings is not None and count >= max_listings:
+                return
+
+        cursor = response.get("next")
+        if not cursor:
+            return
+        querystring["next"] = cursor
+
+def parseListings(response, price_celing):
     orders = response.get("listings", [])
 
     results = []
@@ -70,23 +141,55 @@ def getAllListings(collection_slug, price_celing):
             token = offer.get("token")
             identifier = offer.get("identifierOrCriteria")
 
+        # --- keep what's needed to fulfill the order later without looking it up again ---
+        end_time = params.get("endTime")
+        remaining = order.get("remaining_quantity")
+
         # Build a minimal object with only what you want
         results.append({
             "currency": currency,
             "price": price,
             "token": token,
-            "identifierOrCriteria": identifier
+            "identifierOrCriteria": identifier,
+            "order_hash": order.get("order_hash"),
+            "end_time": int(end_time) if end_time is not None else None,
+            "remaining_quantity": int(remaining) if remaining is not None else None,
+            "protocol_address": order.get("protocol_address"),
         })
 
-    return [r for r in results if r.get("price") is not None and r["price"] <= price_celing]
+    now = time.time()
+    return [
+        r for r in results
+        if r.get("price") is not None and r["price"] <= price_celing
+        and (r["end_time"] is None or r["end_time"] > now)
+        and r["remaining_quantity"] != 0
+    ]
+
+def listingFields(listing):
+    """The listing fields stored on each crawled nft next to its metadata."""
+    return {
+        "currency": listing.get("currency"),
+        "price": listing.get("price"),
+        "contract_address": listing.get("token"),
+        "order_hash": listing.get("order_hash"),
+        "listing_end_time": listing.get("end_time"),
+        "remaining_quantity": listing.get("remaining_quantity"),
+        "protocol_address": listing.get("protocol_address"),
+    }
 
 def getNFT(address, identifier):
-    url = f"https://api.opensea.io/api/v2/chain/ethereum/contract/{address}/nfts/{identifier}"
+    url = f"{OPNSEA_URL}/api/v2/chain/ethereum/contract/{address}/nfts/{identifier}"
     headers = {"accept": "*/*",
                "x-api-key": f"{OPNSEA_KEY}", }
 
-    response = requests.get(url, headers=headers).json()
+    response = responseCache.get(
+        "nft", f"{address}/{identifier}",
+        lambda: http_client.get("opensea", url, headers=headers).json(),
+        valid=isValidNFT,
+    )
+    return parseNFT(response)
 
+def parseNFT(response):
     nft = response.get("nft", {})
 
     # TODO: figure out what id data is needed to get a individual nft listing and make a funtion to do so
@@ -125,9 +228,9 @@ def getNFT(address, identifier):
 
 def getBestListingNFT(collection_slug, identifier):
 
-    url = f"https://api.opensea.io/api/v2/listings/collection/{collection_slug}/nfts/{identifier}/best"
+    url = f"{OPNSEA_URL}/api/v2/listings/collection/{collection_slug}/nfts/{identifier}/best"
     headers = {"accept": "*/*", "x-api-key": f"{OPNSEA_KEY}"}
-    response = requests.get(url, headers=headers).json() # THIS SHOULD BE THE "BEST LISTING"
+    response = http_client.get("opensea", url, headers=headers).json() # THIS SHOULD BE THE "BEST LISTING"
 
     try:
         # --- Extract from price.current ---
@@ -142,20 +245,23 @@ def getBestListingNFT(collection_slug, identifier):
     
 
 
-def getNftWithPriceCeling(price_celing):
+def getNftWithPriceCeling(price_celing, max_listings=None):
+    return list(iterNftWithPriceCeling(price_celing, max_listings))
+
+def iterNftWithPriceCeling(price_celing, max_listings=None):
+    """Same crawl as getNftWithPriceCeling, yielding each nft as soon as its listing page comes in."""
     ascCollect = getCollectionsAscPriceFloor()
     collectSlugs = []
     for c in ascCollect:
         collectSlugs.append(getMarketplaceCollectionAddress(c))
-    listings = []
     for l in collectSlugs:
-        listings.extend(getAllListings(l, price_celing))
-    nfts = []
-    for ls in listings:
-        nft = getNFT(ls.get("token"), ls.get("identifierOrCriteria"))
-        nft.update({"currency":ls.get("currency"),"price":ls.get("price")})
-        nfts.append(nft)
-    return nfts
+        if not l:
+            continue
+        for ls in iterAllListings(l, price_celing, max_listings):
+            nft = getNFT(ls.get("token"), ls.get("identifierOrCriteria"))
+            nft.update(listingFields(ls))
+            yield nft
+    print(f"api cache: {responseCache.stats()}")
 
 if __name__ == '__main__':
     print(getNFT("mint-genesis-nft", 28744))
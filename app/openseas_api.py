@@ -1,5 +1,5 @@
-import requests
 import os
+import http_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,7 +25,7 @@ def getnftdata(nft):
 def getbestlisting(collection_slug, nft):
     url = f"https://api.opensea.io/api/v2/listings/collection/{collection_slug}/nfts/{nft}/best"
 
-    order_json = requests.get(url, headers=headers).json()
+    order_json = http_client.get("opensea", url, headers=headers).json()
 
     
     # TODO: this is jank
@@ -49,7 +49,7 @@ def getnftsfromcollection(collection_slug, limit=50):
     url += f"?limit={limit}"
 
     try:
-        nfts = requests.get(url, headers=headers).json()['nfts']
+        nfts = http_client.get("opensea", url, headers=headers).json()['nfts']
     except:
         return []
 
@@ -82,7 +82,7 @@ def getcollections(num=100, order_by="seven_day_volume", chain="ethereum"):
     if order_by: url += f"order_by={order_by}&"
     url += f"limit={num}&"
 
-    return requests.get(url, headers=headers).json()["collections"]
+    return http_client.get("opensea", url, headers=headers).json()["collections"]
 
 # extract collection ids
 def getslugsfromcollections(collections):
@@ -0,0 +1,145 @@
+import threading
+import time
+from decimal import Decimal
+
+import http_client
+
+# Background confirmation of the payments behind submitted forms.
+#
+# /api/form only stores the order as pending under its txHash. Every interval
+# (or as soon as wake() is called) the confirmer looks up all pending hashes
+# with one batched json-rpc request (eth_getTransactionByHash +
+# eth_getTransactionReceipt per hash, plus eth_blockNumber) and settles each
+# one: confirmed once the payment to the bot wallet is deep enough, failed if
+# it reverted, went elsewhere, paid too little or never showed up.
+
+RPC_BATCH_SIZE = 100  # hashes per request, two calls each
+
+
+class RPCError(Exception):
+    pass
+
+
+def rpc_batch(url, calls):
+    """Send [(method, params)] as one json-rpc batch, results in the same order."""
+    if not calls:
+        return []
+    payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+    response = http_client.post("alchemy", url, json=payload)
+    response.raise_for_status()
+    replies = response.json()
+    if not isinstance(replies, list):
+        # some nodes answer a whole rejected batch with a single error object
+        raise RPCError(replies.get("error") if isinstance(replies, dict) else replies)
+
+    by_id = {reply.get("id"): reply for reply in replies}
+    results = []
+    for i in range(len(calls)):
+        reply = by_id.get(i)
+        if reply is None or "error" in reply:
+            raise RPCError((reply or {}).get("error", f"no reply for {calls[i][0]}"))
+        results.append(reply.get("result"))
+    return results
+
+
+def fetch_payments(url, tx_hashes, batch_size=RPC_BATCH_SIZE):
+    """({hash: (transaction, receipt)}, head block number), either can be None while unknown / unmined."""
+    found = {}
+    head = None
+    for start in range(0, len(tx_hashes), batch_size):
+        chunk = tx_hashes[start:start + batch_size]
+        calls = [("eth_blockNumber", [])]
+        for tx_hash in chunk:
+            calls.append(("eth_getTransactionByHash", [tx_hash]))
+            calls.append(("eth_getTransactionReceipt", [tx_hash]))
+        results = rpc_batch(url, calls)
+        head = max(head or 0, int(results[0], 16))
+        for i, tx_hash in enumerate(chunk):
+            found[tx_hash] = (results[1 + 2 * i], results[2 + 2 * i])
+    return found, head
+
+
+def to_wei(amount_eth):
+    return int(Decimal(str(amount_eth)) * 10 ** 18)
+
+
+def check_payment(tx, receipt, head, recipient, amount_eth, confirmations):
+    """("confirmed" | "failed" | "pending", detail) for one looked up payment."""
+    if tx is None:
+        return "pending", "transaction not found"
+    if (tx.get("to") or "").lower() != recipient.lower():
+        return "failed", "Transaction recipient mismatch"
+    if int(tx["value"], 16) < to_wei(amount_eth):
+        return "failed", "Transaction amount is too low"
+    if receipt is None:
+        return "pending", "transaction not mined yet"
+    if int(receipt["status"], 16) != 1:
+        return "failed", "Transaction failed on-chain"
+
+    block = int(receipt["blockNumber"], 16)
+    if head - block + 1 < confirmations:
+        return "pending", f"{head - block + 1}/{confirmations} confirmations"
+    return "confirmed", {"from": tx["from"], "to": tx["to"], "amount_eth": int(tx["value"], 16) / 10 ** 18, "block": block}
+
+
+class PaymentConfirmer:
+
+    def __init__(self, url, recipient, load_fn, settle_fn, confirmations=2, interval=10, timeout=1800, context=None):
+        """
+        load_fn() -> [(tx_hash, amount_eth, submitted unix time)] still pending
+        settle_fn(tx_hash, status, detail) stores a confirmed / failed result
+        context() -> context manager every round runs in (e.g. app.app_context)
+        Hashes the node still doesn't know after timeout seconds fail.
+        """
+        self.url = url
+        self.recipient = recipient
+        self.load_fn = load_fn
+        self.settle_fn = settle_fn
+        self.confirmations = confirmations
+        self.interval = interval
+        self.timeout = timeout
+        self.context = context
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Check now instead of at the next interval, returns immediately."""
+        self._wake.set()
+
+    def run_once(self):
+        """One round over every pending payment. Returns how many were settled."""
+        pending = self.load_fn()
+        if not pending:
+            return 0
+
+        found, head = fetch_payments(self.url, [tx_hash for tx_hash, _, _ in pending])
+        settled = 0
+        for tx_hash, amount_eth, submitted in pending:
+            tx, receipt = found[tx_hash]
+            status, detail = check_payment(tx, receipt, head, self.recipient, amount_eth, self.confirmations)
+            if status == "pending" and tx is None and time.time() - submitted > self.timeout:
+                status, detail = "failed", "Transaction hash not found"
+            if status != "pending":
+                self.settle_fn(tx_hash, status, detail)
+                settled += 1
+        return settled
+
+    def _run(self):
+        while True:
+            try:
+                if self.context is not None:
+                    with self.context():
+                        self.run_once()
+                else:
+                    self.run_once()
+            except Exception as e:
+                print(f"payment confirmation failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
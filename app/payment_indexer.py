@@ -0,0 +1,130 @@
+import threading
+
+from payment_confirmer import rpc_batch
+
+# Payments to the bot wallet, read straight from the chain.
+#
+# Instead of looking up every submitted hash, the indexer walks the blocks
+# once: each round it reads everything from its checkpoint up to the block
+# that is `confirmations` deep (full blocks, batched json-rpc), keeps the
+# successful plain eth transfers to the bot wallet and hands them to
+# store_fn together with the last block read, which saves both in one
+# database transaction. RPC cost depends on the blocks produced, not on how
+# many payments are pending, and activating an order is a table lookup.
+#
+# Blocks are only read once they are past the confirmation depth, so a reorg
+# shallower than that never reaches the table. Eth sent from inside a
+# contract (smart wallets, internal transfers) isn't a transaction to the bot
+# wallet and isn't seen.
+
+BLOCK_BATCH_SIZE = 20  # full blocks per json-rpc request
+
+
+class PaymentIndexer:
+
+    def __init__(self, url, recipient, load_position, store_fn, confirmations=2, max_blocks=500,
+                 interval=12, start_block=None, lock_fn=None, after_fn=None, context=None):
+        """
+        load_position() -> last block already stored, None on the first run
+        store_fn(payments, block) saves the payments found up to block and the new position
+        start_block is where a fresh index starts (default: the current safe block)
+        lock_fn() -> context manager yielding whether this process may index
+        after_fn() runs after every round in every process (activating orders, timeouts)
+        max_blocks caps the blocks read per store_fn call while catching up
+        """
+        self.url = url
+        self.recipient = (recipient or "").lower()
+        self.load_position = load_position
+        self.store_fn = store_fn
+        self.confirmations = max(confirmations, 1)
+        self.max_blocks = max_blocks
+        self.interval = interval
+        self.start_block = start_block
+        self.lock_fn = lock_fn
+        self.after_fn = after_fn
+        self.context = context
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Index now instead of at the next interval, returns immediately."""
+        self._wake.set()
+
+    def safe_block(self):
+        head = int(rpc_batch(self.url, [("eth_blockNumber", [])])[0], 16)
+        return head - self.confirmations + 1
+
+    def scan(self, first, last):
+        """Successful eth transfers to the recipient in blocks first..last."""
+        candidates = []
+        for start in range(first, last + 1, BLOCK_BATCH_SIZE):
+            numbers = range(start, min(start + BLOCK_BATCH_SIZE, last + 1))
+            blocks = rpc_batch(self.url, [("eth_getBlockByNumber", [hex(n), True]) for n in numbers])
+            for number, block in zip(numbers, blocks):
+                if block is None:
+                    raise RuntimeError(f"node doesn't have block {number} yet")
+                for tx in block["transactions"]:
+                    if (tx.get("to") or "").lower() == self.recipient and int(tx["value"], 16) > 0:
+                        candidates.append(tx)
+
+        # a transfer to a plain wallet rarely reverts, but a reverted one moved nothing
+        receipts = rpc_batch(self.url, [("eth_getTransactionReceipt", [tx["hash"]]) for tx in candidates])
+        return [
+            {
+                "tx_hash": tx["hash"].lower(),
+                "block_number": int(tx["blockNumber"], 16),
+                "sender": tx["from"].lower(),
+                "amount_wei": int(tx["value"], 16),
+            }
+            for tx, receipt in zip(candidates, receipts)
+            if receipt is not None and int(receipt["status"], 16) == 1
+        ]
+
+    def index(self):
+        """Read every new confirmed block. Returns how many payments were stored."""
+        safe = self.safe_block()
+        position = self.load_position()
+        if position is None:
+            position = (self.start_block if self.start_block is not None else safe) - 1
+
+        found = 0
+        while position < safe:
+            last = min(position + self.max_blocks, safe)
+            payments = self.scan(position + 1, last)
+            self.store_fn(payments, last)
+            found += len(payments)
+            position = last
+        return found
+
+    def run_once(self):
+        """One round: index under the lock (if this process gets it), then after_fn."""
+        if self.lock_fn is None:
+            found = self.index()
+        else:
+            with self.lock_fn() as acquired:
+                found = self.index() if acquired else 0
+        if found:
+            print(f"indexed {found} payments to {self.recipient}")
+        if self.after_fn is not None:
+            self.after_fn()
+        return found
+
+    def _run(self):
+        while True:
+            try:
+                if self.context is not None:
+                    with self.context():
+                        self.run_once()
+                else:
+                    self.run_once()
+            except Exception as e:
+                print(f"payment indexing failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
@@ -0,0 +1,196 @@
+import os
+import time
+import numpy as np
+from sqlalchemy import text
+
+from scoring import EMBEDDING_DIM, NFTCatalog, normalize_rows
+
+# Optional Postgres backend for nft search (NFT_SEARCH=pgvector).
+#
+# The ARRAY(Float) columns stay the source of truth. install() adds a
+# `image_embedding vector(768)` column next to image_embedding_vector, backfills
+# it for existing rows, keeps it in sync with a trigger (so the ORM does not
+# need to know about the vector type) and builds an HNSW index for inner
+# product search. The image vectors are already normalized so inner product
+# ranks the same as cosine similarity.
+
+
+def install(session, table="nfts", dim=EMBEDDING_DIM, m=16, ef_construction=64):
+    """Create the extension, vector column, sync trigger and hnsw index. Safe to run repeatedly."""
+    statements = [
+        "CREATE EXTENSION IF NOT EXISTS vector",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS image_embedding vector({dim})",
+        f"""
+        CREATE OR REPLACE FUNCTION {table}_sync_image_embedding() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.image_embedding_vector IS NULL THEN
+                NEW.image_embedding := NULL;
+            ELSE
+                NEW.image_embedding := NEW.image_embedding_vector::vector({dim});
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        f"DROP TRIGGER IF EXISTS {table}_sync_image_embedding ON {table}",
+        f"""
+        CREATE TRIGGER {table}_sync_image_embedding
+        BEFORE INSERT OR UPDATE OF image_embedding_vector ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_sync_image_embedding()
+        """,
+    ]
+    for statement in statements:
+        session.execute(text(statement))
+
+    migrated = migrate(session, table, dim)
+
+    session.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {table}_image_embedding_hnsw ON {table} "
+        f"USING hnsw (image_embedding vector_ip_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+    ))
+    session.commit()
+    print(f"pgvector installed on {table}, migrated {migrated} rows")
+    return migrated
+
+
+def migrate(session, table="nfts", dim=EMBEDDING_DIM, batch_size=5000):
+    """Backfill the vector column for rows written before the trigger existed, in batches."""
+    total = 0
+    while True:
+        result = session.execute(text(f"""
+            UPDATE {table} SET image_embedding = image_embedding_vector::vector({dim})
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE image_embedding IS NULL AND image_embedding_vector IS NOT NULL
+                LIMIT :batch_size
+            )
+        """), {"batch_size": batch_size})
+        session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+
+def to_vector_literal(vector):
+    return "[" + ",".join(repr(float(v)) for v in vector) + "]"
+
+
+MAX_EF_SEARCH = 1000  # the most hnsw.ef_search accepts
+
+
+def search(session, preferences_vector, price_cap=None, k=10, ef_search=None, table="nfts", live_after=None):
+    """
+    Return (ids, similarities) of the k closest nfts with price <= price_cap, best first.
+    With live_after (unix seconds) listings ending before then are skipped.
+
+    The hnsw scan only hands back its ef_search nearest rows and the price /
+    expiry filters run on those, so a tight price cap can leave fewer than k.
+    When that happens the search is repeated with ef_search doubled (up to
+    MAX_EF_SEARCH) and then once as an exact scan without the index, so fewer
+    than k results always means fewer than k nfts qualify.
+    """
+    # ef_search has to be at least k or hnsw returns fewer rows
+    ef_search = min(max(int(ef_search or 40), k), MAX_EF_SEARCH)
+    while True:
+        rows = _search_rows(session, preferences_vector, price_cap, k, table, live_after, ef_search)
+        if len(rows) >= k:
+            break
+        if ef_search >= MAX_EF_SEARCH:
+            rows = _search_rows(session, preferences_vector, price_cap, k, table, live_after, None)
+            break
+        ef_search = min(ef_search * 2, MAX_EF_SEARCH)
+
+    return [r.id for r in rows], [float(r.similarity) for r in rows]
+
+
+def _search_rows(session, preferences_vector, price_cap, k, table, live_after, ef_search):
+    """One query, through the hnsw index with ef_search or an exact scan when it is None."""
+    exact = ef_search is None
+    if not exact:
+        session.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+
+    price_filter = "AND price <= :cap" if price_cap is not None else ""
+    live_filter = "AND (listing_end_time IS NULL OR listing_end_time > :live_after)" if live_after is not None else ""
+    # ordering by an expression the index doesn't match makes postgres scan the table instead
+    distance = "(image_embedding <#> CAST(:pref AS vector))" + (" + 0" if exact else "")
+    return session.execute(text(f"""
+        SELECT id, -(image_embedding <#> CAST(:pref AS vector)) AS similarity
+        FROM {table}
+        WHERE image_embedding IS NOT NULL {price_filter} {live_filter}
+        ORDER BY {distance}
+        LIMIT :k
+    """), {"pref": to_vector_literal(preferences_vector), "cap": price_cap, "k": k, "live_after": live_after}).all()
+
+
+# ---- benchmark against the python path on a local postgres ----
+
+def benchmark(database_url, sizes=(10_000, 100_000), n_queries=20, k=10, dim=EMBEDDING_DIM, seed=0):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_engine(database_url)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    rng = np.random.default_rng(seed)
+    table = "nfts_pgvector_bench"
+
+    class Row:
+        def __init__(self, id, price, image_embedding_vector):
+            self.id = id
+            self.collection_id = ""
+            self.nft_id = ""
+            self.price = price
+            self.image_embedding_vector = image_embedding_vector
+            self.text_embedding_vector = None
+
+    for n in sizes:
+        session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        session.execute(text(f"CREATE TABLE {table} (id serial PRIMARY KEY, price double precision NOT NULL, image_embedding_vector double precision[])"))
+        vectors = normalize_rows(rng.standard_normal((n, dim), dtype=np.float32))
+        prices = rng.uniform(0, 20, n)
+        for start in range(0, n, 2000):
+            session.execute(
+                text(f"INSERT INTO {table} (price, image_embedding_vector) VALUES (:price, :vector)"),
+                [{"price": float(p), "vector": v.astype(float).tolist()} for p, v in zip(prices[start:start + 2000], vectors[start:start + 2000])],
+            )
+        session.commit()
+
+        start = time.perf_counter()
+        install(session, table=table, dim=dim)
+        print(f"{n} rows: install + migrate + index {time.perf_counter() - start:.1f}s")
+
+        queries = normalize_rows(rng.standard_normal((n_queries, dim)))
+
+        start = time.perf_counter()
+        for q in queries:
+            rows = [Row(r.id, r.price, r.image_embedding_vector) for r in session.execute(text(f"SELECT id, price, image_embedding_vector FROM {table}"))]
+            NFTCatalog.from_rows(rows, dim=dim).top_k(q, price_cap=10, k=k)
+        python_time = (time.perf_counter() - start) / n_queries
+
+        start = time.perf_counter()
+        for q in queries:
+            search(session, q, price_cap=10, k=k, table=table)
+            session.commit()
+        pg_time = (time.perf_counter() - start) / n_queries
+
+        # a cap only ~2% of rows pass, where a single hnsw scan comes back short
+        start = time.perf_counter()
+        short = 0
+        for q in queries:
+            ids, _ = search(session, q, price_cap=0.4, k=k, table=table)
+            session.commit()
+            short += len(ids) < k
+        tight_time = (time.perf_counter() - start) / n_queries
+
+        print(f"{n} rows: python {python_time * 1000:.1f} ms/query | pgvector {pg_time * 1000:.1f} ms/query "
+              f"| pgvector with a 2% price cap {tight_time * 1000:.1f} ms/query, {short} queries short of {k}")
+
+    session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    session.execute(text(f"DROP FUNCTION IF EXISTS {table}_sync_image_embedding()"))
+    session.commit()
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    benchmark(os.getenv("BENCH_DATABASE_URL", "postgresql://localhost:5432/postgres"))
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+import time
+import numpy as np
+
+from scoring import normalize_rows
+
+# style / theme checkboxes offered by frontend/index.html
+STYLES = ["abstract", "pixel", "3d", "photography", "generative", "anime", "surreal", "minimalist"]
+THEMES = ["nature", "scifi", "fantasy", "urban", "space", "animals", "characters", "landscapes"]
+
+
+def normalize_text(text):
+    return " ".join((text or "").lower().split())
+
+
+class EmbeddingCache:
+    """Persistent text -> embedding cache in sqlite, evicting the least recently used entries."""
+
+    def __init__(self, path, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def put(self, key, vector):
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+            # drop the oldest entries once over the limit
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class PreferenceEmbedder:
+    """
+    Builds order preference vectors without re-running the text model for
+    every form submission.
+
+    Every style and theme term the frontend offers is embedded once and
+    cached, so a submission only needs the model for its free text (and that
+    is cached too, keyed on the normalized string). The preference vector is
+    the normalized weighted sum of the term and free text vectors, weighted
+    like the old repeated string (styles x2, themes x2, free text x1).
+    Terms outside the vocabulary fall back to embedding them on their own.
+    """
+
+    def __init__(self, embed_fn, cache, model="nomic-embed-text-v1.5"):
+        self.embed_fn = embed_fn
+        self.cache = cache
+        self.model = model
+
+    def embed_text(self, text):
+        key = f"{self.model}:{normalize_text(text)}"
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.embed_fn(normalize_text(text)), dtype=np.float32)
+            self.cache.put(key, vector)
+        return vector
+
+    def warm(self, terms=STYLES + THEMES):
+        """Precompute the vocabulary so the first submissions don't hit the model."""
+        for term in terms:
+            self.embed_text(term)
+
+    def embed(self, styles, themes, additional="", styles_weight=2, themes_weight=2, additional_weight=1):
+        parts = [(term, styles_weight) for term in styles]
+        parts += [(term, themes_weight) for term in themes]
+        if normalize_text(additional):
+            parts.append((additional, additional_weight))
+
+        if not parts:
+            # nothing selected, same as embedding the blank string before
+            return self.embed_text("")
+
+        total = sum(weight * self.embed_text(text) for text, weight in parts)
+        return normalize_rows(total.reshape(1, -1))[0]
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+# Persistent TTL cache for the marketplace api responses in sqlite.
+#
+# Rows are keyed on (endpoint, key) where key is the request url + params
+# (never the api keys), each endpoint has its own ttl. Only one caller
+# fetches a missing key at a time, everyone else asking for it meanwhile
+# waits for that fetch and reads its result (threads and asyncio tasks both).
+# If a refetch fails an expired row is served instead of nothing.
+
+
+class ResponseCache:
+
+    def __init__(self, path, ttls, max_entries=200000):
+        """path None disables caching, every call goes straight to fetch."""
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._inflight = {}
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "endpoint TEXT NOT NULL, key TEXT NOT NULL, body TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (endpoint, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self._conn.commit()
+            self.purge()
+
+    def _count(self, endpoint, what):
+        counts = self.counts.setdefault(endpoint, {"hit": 0, "miss": 0, "stale": 0})
+        counts[what] += 1
+
+    def stats(self):
+        if self._conn is None:
+            return "off"
+        return ", ".join(
+            f"{endpoint} {c['hit']} hit / {c['miss']} miss" + (f" / {c['stale']} stale" if c["stale"] else "")
+            for endpoint, c in self.counts.items()
+        )
+
+    def _read(self, endpoint, key):
+        """(body, fresh) or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM responses WHERE endpoint = ? AND key = ?", (endpoint, key)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1] > time.time()
+
+    def _write(self, endpoint, key, body):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (endpoint, key, body, expires_at) VALUES (?, ?, ?, ?)",
+                (endpoint, key, json.dumps(body), time.time() + self.ttls[endpoint]),
+            )
+            self._conn.commit()
+
+    def _lookup(self, endpoint, key):
+        """Fresh cached body (counted as a hit) or None, plus the stale row if there is one."""
+        row = self._read(endpoint, key)
+        if row is not None and row[1]:
+            self._count(endpoint, "hit")
+            return row[0], None
+        return None, row
+
+    def _fallback(self, endpoint, key, stale, error):
+        if stale is None:
+            raise error
+        print(f"{endpoint} fetch failed for {key}, serving expired response: {error}")
+        self._count(endpoint, "stale")
+        return stale[0]
+
+    def get(self, endpoint, key, fetch, valid=None):
+        """Cached response for key, calling fetch() on a miss. Results failing valid() aren't stored."""
+        if self._conn is None or not self.ttls.get(endpoint):
+            return fetch()
+
+        body, stale = self._lookup(endpoint, key)
+        if body is not None:
+            return body
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault((endpoint, key), threading.Lock())
+        try:
+            with key_lock:
+                # whoever held the lock before us may have just stored it
+                body, stale = self._lookup(endpoint, key)
+                if body is not None:
+                    return body
+
+                self._count(endpoint, "miss")
+                try:
+                    body = fetch()
+                except Exception as e:
+                    return self._fallback(endpoint, key, stale, e)
+                if valid is None or valid(body):
+                    self._write(endpoint, key, body)
+                elif stale is not None:
+                    return self._fallback(endpoint, key, stale, ValueError(f"invalid response {body}"))
+                return body
+        finally:
+            with self._lock:
+                self._key_locks.pop((endpoint, key), None)
+
+    async def get_async(self, endpoint, key, fetch, valid=None):
+        """get() for coroutines: fetch is an async callable, concurrent tasks share one fetch per key."""
+        if self._conn is None or not self.ttls.get(endpoint):
+            return await fetch()
+
+        body, stale = self._lookup(endpoint, key)
+        if body is not None:
+            return body
+
+        inflight = self._inflight.get((endpoint, key))
+        if inflight is not None:
+            self._count(endpoint, "hit")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[(endpoint, key)] = future
+        self._count(endpoint, "miss")
+        try:
+            try:
+                body = await fetch()
+            except Exception as e:
+                body = self._fallback(endpoint, key, stale, e)
+            else:
+                if valid is None or valid(body):
+                    self._write(endpoint, key, body)
+                elif stale is not None:
+                    body = self._fallback(endpoint, key, stale, ValueError(f"invalid response {body}"))
+            future.set_result(body)
+            return body
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # nobody else may be waiting, don't leave "exception never retrieved" behind
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop((endpoint, key), None)
+
+    def purge(self):
+        """Drop rows expired for over a day, then the soonest to expire past max_entries."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time() - 24 * 3600,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
@@ -0,0 +1,334 @@
+import numpy as np
+import threading
+import time
+
+# dimension of the nomic text / vision embeddings
+EMBEDDING_DIM = 768
+
+
+def normalize_rows(matrix):
+    """L2 normalize each row, leaving all zero rows (failed embeddings) as zeros."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class NFTCatalog:
+    """
+    Contiguous in memory copy of the nfts table used to score orders.
+
+    Image and text embeddings are stored as float32 matrices (one row per nft)
+    with a parallel price array, so scoring an order is a price mask plus one
+    matrix-vector product instead of a python loop over every row. text_matrix
+    can be None when no nft has a text embedding. The image matrix is used as
+    is when it is already contiguous float32, so a read only np.memmap works.
+    """
+
+    def __init__(self, ids, collection_ids, nft_ids, prices, image_matrix, text_matrix=None, has_image=None, has_text=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.collection_ids = list(collection_ids)
+        self.nft_ids = list(nft_ids)
+        self.prices = np.asarray(prices, dtype=np.float32)
+        self.image_matrix = np.ascontiguousarray(image_matrix, dtype=np.float32)
+        self.text_matrix = None if text_matrix is None else np.ascontiguousarray(text_matrix, dtype=np.float32)
+        self.has_image = np.ones(len(self.ids), dtype=bool) if has_image is None else np.asarray(has_image, dtype=bool)
+        self.has_text = np.zeros(len(self.ids), dtype=bool) if has_text is None else np.asarray(has_text, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, nfts, dim=EMBEDDING_DIM):
+        """
+        Build the catalog from NFTS rows (anything with the same attributes works).
+        Rows with an image_embedding_f16 copy are read from that, the python list
+        in image_embedding_vector is only used when it is missing.
+        """
+        n = len(nfts)
+        image_matrix = np.zeros((n, dim), dtype=np.float32)
+        text_matrix = None # only allocated once a row has a text embedding
+        has_image = np.zeros(n, dtype=bool)
+        has_text = np.zeros(n, dtype=bool)
+
+        f16 = [getattr(nft, "image_embedding_f16", None) for nft in nfts]
+        if n and all(blob is not None for blob in f16):
+            # one buffer for the whole table instead of a copy per row
+            image_matrix[:] = np.frombuffer(b"".join(f16), dtype=np.float16).reshape(n, dim)
+            has_image[:] = True
+
+        for i, nft in enumerate(nfts):
+            if has_image[i]:
+                pass
+            elif f16[i] is not None:
+                image_matrix[i] = np.frombuffer(f16[i], dtype=np.float16)
+                has_image[i] = True
+            elif nft.image_embedding_vector:
+                image_matrix[i] = nft.image_embedding_vector
+                has_image[i] = True
+            if nft.text_embedding_vector:
+                if text_matrix is None:
+                    text_matrix = np.zeros((n, dim), dtype=np.float32)
+                text_matrix[i] = nft.text_embedding_vector
+                has_text[i] = True
+
+        return cls(
+            ids=[nft.id for nft in nfts],
+            collection_ids=[nft.collection_id for nft in nfts],
+            nft_ids=[nft.nft_id for nft in nfts],
+            prices=[nft.price for nft in nfts],
+            image_matrix=normalize_rows(image_matrix),
+            text_matrix=None if text_matrix is None else normalize_rows(text_matrix),
+            has_image=has_image,
+            has_text=has_text,
+        )
+
+    def scores(self, preferences_vector, price_cap=None):
+        """
+        Similarity of every nft to the preferences vector.
+
+        Matches the old buy() loop: average of image and text similarity when
+        both exist, otherwise whichever one exists, otherwise 0. Rows above the
+        price cap get -inf so they are never picked.
+        """
+        price_caps = None if price_cap is None else [price_cap]
+        return self.score_matrix([preferences_vector], price_caps)[0]
+
+    def score_matrix(self, preferences_vectors, price_caps=None):
+        """Orders x nfts similarity matrix, same scoring as scores() with one price cap per order."""
+        prefs = np.asarray(preferences_vectors, dtype=np.float32).reshape(-1, self.image_matrix.shape[1])
+
+        similarity = prefs @ self.image_matrix.T
+        if self.text_matrix is not None:
+            # missing vectors are zero rows so they add nothing to the sum
+            count = self.has_image.astype(np.float32) + self.has_text.astype(np.float32)
+            similarity = (similarity + prefs @ self.text_matrix.T) / np.maximum(count, 1)
+
+        if price_caps is not None:
+            caps = np.asarray(price_caps, dtype=np.float32).reshape(-1, 1)
+            similarity = np.where(self.prices[None, :] <= caps, similarity, -np.inf)
+
+        return similarity
+
+    def top_k(self, preferences_vector, price_cap=None, k=1):
+        """
+        Return the catalog indices of the k best nfts, best first, with their scores.
+        Only positive similarities count (same as the old loop starting at 0).
+        """
+        similarity = self.scores(preferences_vector, price_cap)
+        valid = np.flatnonzero(similarity > 0)
+
+        if len(valid) == 0:
+            return [], []
+
+        k = min(k, len(valid))
+        candidate = similarity[valid]
+        # argpartition first so big catalogs don't get fully sorted
+        top = np.argpartition(-candidate, k - 1)[:k]
+        top = top[np.argsort(-candidate[top], kind="stable")]
+
+        return valid[top].tolist(), candidate[top].tolist()
+
+    def best_match(self, nfts, preferences_vector, price_cap=None, k=1):
+        """Drop in for the selection loop in buy(): returns (nft rows, scores) from the same list used to build the catalog."""
+        indices, scores = self.top_k(preferences_vector, price_cap, k)
+        return [nfts[i] for i in indices], scores
+
+    def drop(self, ids):
+        """Take nfts out of scoring in place by pricing them out of every budget, no rebuild needed."""
+        self.prices[np.isin(self.ids, list(ids))] = np.inf
+
+
+class CatalogCache:
+    """
+    Keeps the last catalog built from the table between requests.
+
+    load_fn() builds a fresh one on the next get() after invalidate() (rows
+    added or repriced in this process) or once the cached one is older than
+    ttl seconds, which is how writes from other processes show up. Removed
+    rows don't need a rebuild, remove() masks them out of the cached copy.
+    """
+
+    def __init__(self, load_fn, ttl=30):
+        self.load_fn = load_fn
+        self.ttl = ttl
+        self._catalog = None
+        self._loaded = 0
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._dirty or time.monotonic() - self._loaded > self.ttl:
+                # cleared before loading so a write that lands during the load triggers another one
+                self._dirty = False
+                try:
+                    self._catalog = self.load_fn()
+                except Exception:
+                    self._dirty = True
+                    raise
+                self._loaded = time.monotonic()
+            return self._catalog
+
+    def invalidate(self):
+        self._dirty = True
+
+    def remove(self, ids):
+        with self._lock:
+            if self._catalog is not None and len(ids):
+                self._catalog.drop(ids)
+
+
+def assign_orders(catalog, preferences_vectors, budgets, n_fallback=5):
+    """
+    Jointly match a batch of orders to catalog nfts so no nft goes to two orders.
+
+    Scores every order against the catalog in one matrix product, then assigns
+    greedily from the highest scoring (order, nft) pair down. Returns one ranked
+    list of catalog indices per order: its assigned nft first, then up to
+    n_fallback more that are not assigned to any other order.
+    """
+    n_orders = len(preferences_vectors)
+    if n_orders == 0 or len(catalog) == 0:
+        return [[] for _ in range(n_orders)]
+
+    similarity = catalog.score_matrix(preferences_vectors, budgets)
+
+    # only the best few per order can matter: at most n_orders - 1 of them get
+    # taken by other orders, so this always leaves room for the fallbacks
+    m = min(len(catalog), n_fallback + n_orders)
+    candidates = np.argpartition(-similarity, m - 1, axis=1)[:, :m]
+    candidate_scores = np.take_along_axis(similarity, candidates, axis=1)
+
+    order_idx, slot = np.nonzero(candidate_scores > 0)
+    pair_scores = candidate_scores[order_idx, slot]
+    pair_nfts = candidates[order_idx, slot]
+
+    assigned = [None] * n_orders
+    claimed = set()
+    for p in np.argsort(-pair_scores, kind="stable"):
+        o, i = int(order_idx[p]), int(pair_nfts[p])
+        if assigned[o] is None and i not in claimed:
+            assigned[o] = i
+            claimed.add(i)
+
+    ranked = []
+    for o in range(n_orders):
+        row = np.argsort(-candidate_scores[o], kind="stable")
+        ranking = [] if assigned[o] is None else [assigned[o]]
+        for j in row:
+            i = int(candidates[o, j])
+            if candidate_scores[o, j] <= 0 or len(ranking) > n_fallback:
+                break
+            if i not in claimed:
+                ranking.append(i)
+        ranked.append(ranking)
+
+    return ranked
+
+
+def claim_picks(ranked, pick_fn):
+    """
+    Pick one nft per order from the ranked lists assign_orders returns.
+
+    pick_fn(order number, candidate indices) checks the candidates and
+    returns (catalog index, pick) for the one it chose, or None. Only that
+    index is claimed, candidates an order looked at but didn't take stay
+    available to the orders after it. Returns one pick (or None) per order.
+    """
+    claimed = set()
+    picks = []
+    for o, candidates in enumerate(ranked):
+        chosen = pick_fn(o, [c for c in candidates if c not in claimed])
+        if chosen is None:
+            picks.append(None)
+            continue
+        index, pick = chosen
+        claimed.add(index)
+        picks.append(pick)
+    return picks
+
+
+# ---- benchmark against the old python loop ----
+
+class _BenchNFT:
+    def __init__(self, i, price, image_embedding_vector, image_embedding_f16=None):
+        self.id = i
+        self.collection_id = f"collection-{i % 500}"
+        self.nft_id = str(i)
+        self.price = price
+        self.image_embedding_vector = image_embedding_vector
+        self.image_embedding_f16 = image_embedding_f16
+        self.text_embedding_vector = None
+
+
+def _loop_best(nfts, preferences_vector, funds):
+    # the selection loop buy() used before NFTCatalog
+    max_similarity = 0
+    best_nft = None
+    for nft in nfts:
+        if nft.price <= funds:
+            similarity = np.dot(np.array(preferences_vector), np.array(nft.image_embedding_vector))
+            if similarity > max_similarity:
+                max_similarity = similarity
+                best_nft = nft
+    return best_nft
+
+
+def benchmark(sizes=(10_000, 100_000, 1_000_000), loop_limit=100_000, dim=EMBEDDING_DIM, seed=0):
+    """
+    Old loop vs NFTCatalog per request, end to end: an uncached request pays
+    from_rows over the rows as the database hands them back, either the
+    ARRAY column (python lists) or the float16 bytes, a cached one only the
+    scoring. Loading the rows themselves is left out, the query is the same.
+    """
+    rng = np.random.default_rng(seed)
+    pref = normalize_rows(rng.standard_normal((1, dim)))[0]
+
+    for n in sizes:
+        # build in float32 blocks so the 1M case fits in memory
+        image = normalize_rows(rng.standard_normal((n, dim), dtype=np.float32))
+        prices = rng.uniform(0, 20, n).astype(np.float32)
+
+        # python rows only go up to loop_limit (1M lists of 768 floats don't fit),
+        # from_rows and the old loop are linear so extrapolate after that
+        m = min(n, loop_limit)
+        scale = n / m
+        rows = [_BenchNFT(i, float(prices[i]), image[i].astype(float).tolist()) for i in range(m)]
+
+        start = time.perf_counter()
+        NFTCatalog.from_rows(rows, dim=dim)
+        build = (time.perf_counter() - start) * scale
+
+        rows16 = [_BenchNFT(i, float(prices[i]), None, image[i].astype(np.float16).tobytes()) for i in range(m)]
+        start = time.perf_counter()
+        NFTCatalog.from_rows(rows16, dim=dim)
+        build16 = (time.perf_counter() - start) * scale
+        del rows16
+
+        catalog = NFTCatalog(
+            ids=np.arange(n),
+            collection_ids=[""] * n,
+            nft_ids=[""] * n,
+            prices=prices,
+            image_matrix=image,
+        )
+        start = time.perf_counter()
+        indices, _ = catalog.top_k(pref, price_cap=10, k=10)
+        vector_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        best = _loop_best(rows, pref.astype(float).tolist(), 10)
+        loop_time = (time.perf_counter() - start) * scale
+
+        if m == n:
+            assert best is not None and best.id == indices[0]
+
+        note = "" if m == n else f" (extrapolated from {m})"
+        print(f"{n:>9} nfts{note} | loop {loop_time:8.3f}s | from_rows lists + score {build + vector_time:8.3f}s "
+              f"| from_rows float16 + score {build16 + vector_time:8.3f}s | cached {vector_time:8.4f}s ({loop_time / vector_time:7.1f}x)")
+
+        del rows, image, catalog
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,236 @@
+import os
+from eth_abi import encode
+from eth_utils import keccak, to_checksum_address
+
+# Seaport calldata built from OpenSea's fulfillment_data.
+#
+# OpenSea hands back the call it wants made (fulfillBasicOrder* or
+# fulfillAdvancedOrder) with decoded `input_data`. Basic orders always deliver
+# to msg.sender, so to send the nft straight to a gift recipient the order is
+# re-expressed as the equivalent AdvancedOrder (same parameters, so the same
+# order hash and signature) and filled with fulfillAdvancedOrder(..., recipient).
+#
+# Several listings bought at once go through matchAdvancedOrders: the
+# fulfillAvailable calls send every offer item to one recipient, a match lets
+# the bot add its own order (no signature needed, it is the caller) that pays
+# the eth and asks for each nft to go to its own recipient.
+
+OFFER_ITEM = "(uint8,address,uint256,uint256,uint256)"
+CONSIDERATION_ITEM = "(uint8,address,uint256,uint256,uint256,address)"
+ORDER_PARAMETERS = f"(address,address,{OFFER_ITEM}[],{CONSIDERATION_ITEM}[],uint8,uint256,uint256,bytes32,uint256,bytes32,uint256)"
+ADVANCED_ORDER = f"({ORDER_PARAMETERS},uint120,uint120,bytes,bytes)"
+CRITERIA_RESOLVER = "(uint256,uint8,uint256,uint256,bytes32[])"
+
+FULFILLMENT_COMPONENT = "(uint256,uint256)"
+FULFILLMENT = f"({FULFILLMENT_COMPONENT}[],{FULFILLMENT_COMPONENT}[])"
+
+FULFILL_ADVANCED_ORDER = f"fulfillAdvancedOrder({ADVANCED_ORDER},{CRITERIA_RESOLVER}[],bytes32,address)"
+MATCH_ADVANCED_ORDERS = f"matchAdvancedOrders({ADVANCED_ORDER}[],{CRITERIA_RESOLVER}[],{FULFILLMENT}[],address)"
+
+# item types
+NATIVE, ERC20, ERC721, ERC1155 = 0, 1, 2, 3
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+FULL_OPEN = 0
+MAX_UINT = 2 ** 256 - 1
+
+# basic order routes (basicOrderType // 4) that buy an nft: (payment item, nft item)
+BASIC_ROUTES = {0: (NATIVE, ERC721), 1: (NATIVE, ERC1155), 2: (ERC20, ERC721), 3: (ERC20, ERC1155)}
+
+
+def _int(value):
+    if isinstance(value, str):
+        return int(value, 16) if value.startswith("0x") else int(value)
+    return int(value or 0)
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return bytes.fromhex((value or "0x")[2:])
+
+
+def _bytes32(value):
+    return _bytes(value).rjust(32, b"\0")
+
+
+def _address(value):
+    return to_checksum_address(value or ZERO_ADDRESS)
+
+
+def calldata(signature, types, args):
+    return "0x" + (keccak(text=signature)[:4] + encode(types, args)).hex()
+
+
+def basic_to_advanced(parameters):
+    """AdvancedOrder dict for the BasicOrderParameters of an nft listing, None for routes that aren't a listing."""
+    basic_type = _int(parameters["basicOrderType"])
+    route = BASIC_ROUTES.get(basic_type // 4)
+    if route is None:
+        return None
+    payment_type, nft_type = route
+    payment_token = ZERO_ADDRESS if payment_type == NATIVE else parameters["considerationToken"]
+
+    consideration = [{
+        "itemType": payment_type, "token": payment_token, "identifierOrCriteria": 0,
+        "startAmount": parameters["considerationAmount"], "endAmount": parameters["considerationAmount"],
+        "recipient": parameters["offerer"],
+    }]
+    # fees, royalties (and any tips past the original count) are paid in the same token
+    for extra in parameters.get("additionalRecipients", []):
+        consideration.append({
+            "itemType": payment_type, "token": payment_token, "identifierOrCriteria": 0,
+            "startAmount": extra["amount"], "endAmount": extra["amount"], "recipient": extra["recipient"],
+        })
+
+    return {
+        "parameters": {
+            "offerer": parameters["offerer"],
+            "zone": parameters["zone"],
+            "offer": [{
+                "itemType": nft_type, "token": parameters["offerToken"], "identifierOrCriteria": parameters["offerIdentifier"],
+                "startAmount": parameters["offerAmount"], "endAmount": parameters["offerAmount"],
+            }],
+            "consideration": consideration,
+            "orderType": basic_type % 4,
+            "startTime": parameters["startTime"],
+            "endTime": parameters["endTime"],
+            "zoneHash": parameters["zoneHash"],
+            "salt": parameters["salt"],
+            "conduitKey": parameters["offererConduitKey"],
+            "totalOriginalConsiderationItems": 1 + _int(parameters["totalOriginalAdditionalRecipients"]),
+        },
+        "numerator": 1,
+        "denominator": 1,
+        "signature": parameters["signature"],
+        "extraData": "0x",
+    }
+
+
+def advanced_order_args(order):
+    """AdvancedOrder dict (OpenSea json) -> tuple for the abi encoder."""
+    p = order["parameters"]
+    return (
+        (
+            _address(p["offerer"]),
+            _address(p["zone"]),
+            [(_int(i["itemType"]), _address(i["token"]), _int(i["identifierOrCriteria"]), _int(i["startAmount"]), _int(i["endAmount"])) for i in p["offer"]],
+            [(_int(i["itemType"]), _address(i["token"]), _int(i["identifierOrCriteria"]), _int(i["startAmount"]), _int(i["endAmount"]), _address(i["recipient"])) for i in p["consideration"]],
+            _int(p["orderType"]),
+            _int(p["startTime"]),
+            _int(p["endTime"]),
+            _bytes32(p["zoneHash"]),
+            _int(p["salt"]),
+            _bytes32(p["conduitKey"]),
+            _int(p["totalOriginalConsiderationItems"]),
+        ),
+        _int(order.get("numerator", 1)),
+        _int(order.get("denominator", 1)),
+        _bytes(order.get("signature")),
+        _bytes(order.get("extraData")),
+    )
+
+
+def criteria_resolver_args(resolvers):
+    return [
+        (_int(r["orderIndex"]), _int(r["side"]), _int(r["index"]), _int(r["identifier"]), [_bytes32(proof) for proof in r.get("criteriaProof", [])])
+        for r in resolvers or []
+    ]
+
+
+def fulfillment_order(transaction):
+    """
+    (AdvancedOrder dict, criteria resolvers, fulfiller conduit key) for a
+    fulfillment_data transaction, or None if it isn't a call we can redirect.
+    """
+    function = transaction.get("function", "")
+    input_data = transaction.get("input_data") or {}
+
+    if function.startswith("fulfillAdvancedOrder"):
+        return input_data["advancedOrder"], input_data.get("criteriaResolvers", []), input_data.get("fulfillerConduitKey")
+    if function.startswith("fulfillBasicOrder"):
+        parameters = input_data["parameters"]
+        order = basic_to_advanced(parameters)
+        if order is None:
+            return None
+        return order, [], parameters.get("fulfillerConduitKey")
+    return None
+
+
+def direct_calldata(transaction, recipient):
+    """fulfillAdvancedOrder calldata delivering the listed nft to recipient, None if the call can't be redirected."""
+    found = fulfillment_order(transaction)
+    if found is None:
+        return None
+    order, resolvers, conduit_key = found
+    return calldata(
+        FULFILL_ADVANCED_ORDER,
+        [ADVANCED_ORDER, f"{CRITERIA_RESOLVER}[]", "bytes32", "address"],
+        [advanced_order_args(order), criteria_resolver_args(resolvers), _bytes32(conduit_key), _address(recipient)],
+    )
+
+
+def batchable(order, resolvers):
+    """Whether a listing can go in a match: specific nfts for plain eth, no criteria."""
+    p = order["parameters"]
+    return (
+        not resolvers
+        and all(_int(i["itemType"]) in (ERC721, ERC1155) and _int(i["startAmount"]) == _int(i["endAmount"]) for i in p["offer"])
+        and all(_int(i["itemType"]) == NATIVE for i in p["consideration"])
+    )
+
+
+def match_calldata(gifts, buyer):
+    """
+    matchAdvancedOrders calldata buying every listing of gifts [(AdvancedOrder
+    dict, recipient)] in one transaction, each nft going straight to its
+    recipient. Returns (calldata, value in wei); eth left over (a price that
+    dropped since) goes back to the buyer.
+    """
+    n = len(gifts)
+    value = 0
+    wanted = []  # consideration of the buyer's order, one entry per nft
+    fulfillments = []
+    payments = {}  # payee -> consideration components, paid in one transfer each
+
+    for i, (order, recipient) in enumerate(gifts):
+        p = order["parameters"]
+        numerator, denominator = _int(order.get("numerator", 1)), _int(order.get("denominator", 1))
+        for j, item in enumerate(p["offer"]):
+            amount = _int(item["startAmount"]) * numerator // denominator
+            fulfillments.append(([(i, j)], [(n, len(wanted))]))
+            wanted.append({
+                "itemType": item["itemType"], "token": item["token"], "identifierOrCriteria": item["identifierOrCriteria"],
+                "startAmount": amount, "endAmount": amount, "recipient": recipient,
+            })
+        for j, item in enumerate(p["consideration"]):
+            value += max(_int(item["startAmount"]), _int(item["endAmount"])) * numerator // denominator
+            payments.setdefault(_address(item["recipient"]), []).append((i, j))
+
+    # the buyer's single eth offer item is spent across every payment
+    fulfillments.extend(([(n, 0)], components) for components in payments.values())
+
+    buyer_order = {
+        "parameters": {
+            "offerer": buyer,
+            "zone": ZERO_ADDRESS,
+            "offer": [{"itemType": NATIVE, "token": ZERO_ADDRESS, "identifierOrCriteria": 0, "startAmount": value, "endAmount": value}],
+            "consideration": wanted,
+            "orderType": FULL_OPEN,
+            "startTime": 0,
+            "endTime": MAX_UINT,
+            "zoneHash": "0x",
+            "salt": int.from_bytes(os.urandom(32), "big"),  # fresh order hash every batch
+            "conduitKey": "0x",
+            "totalOriginalConsiderationItems": len(wanted),
+        },
+        "signature": "0x",
+    }
+
+    orders = [order for order, _ in gifts] + [buyer_order]
+    data = calldata(
+        MATCH_ADVANCED_ORDERS,
+        [f"{ADVANCED_ORDER}[]", f"{CRITERIA_RESOLVER}[]", f"{FULFILLMENT}[]", "address"],
+        [[advanced_order_args(order) for order in orders], [], fulfillments, _address(buyer)],
+    )
+    return data, value
+
@@ -0,0 +1,106 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+
+from scoring import NFTCatalog, normalize_rows
+
+# On disk catalog snapshot shared by every worker on a host (NFT_SEARCH=snapshot).
+#
+# Layout:
+#   <dir>/v<version>/embeddings.npy   float32 normalized image embeddings
+#   <dir>/v<version>/ids.npy          nfts.id
+#   <dir>/v<version>/prices.npy       nfts.price
+#   <dir>/v<version>/meta.json        collection_id / nft_id per row
+#   <dir>/current -> v<version>       symlink, swapped with an atomic rename
+#
+# Workers np.load the embeddings with mmap_mode="r", so the page cache holds
+# one copy per host however many workers score against it.
+
+CURRENT = "current"
+
+
+def write_snapshot(directory, ids, prices, collection_ids, nft_ids, image_matrix, keep=2):
+    """Write a new snapshot version and make it current. Returns the version directory."""
+    os.makedirs(directory, exist_ok=True)
+    # several workers can write at once, so every name this writes is unique to it
+    unique = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    version = f"v{time.time_ns()}-{unique}"
+    tmp = os.path.join(directory, f".{version}.tmp")
+    os.makedirs(tmp)
+
+    image_matrix = normalize_rows(np.asarray(image_matrix, dtype=np.float32).reshape(len(ids), -1))
+    np.save(os.path.join(tmp, "embeddings.npy"), image_matrix)
+    np.save(os.path.join(tmp, "ids.npy"), np.asarray(ids, dtype=np.int64))
+    np.save(os.path.join(tmp, "prices.npy"), np.asarray(prices, dtype=np.float32))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"collection_ids": list(collection_ids), "nft_ids": list(nft_ids)}, f)
+
+    # the version directory only appears once it is complete
+    os.rename(tmp, os.path.join(directory, version))
+
+    # point current at it and prune under a lock, so a writer never deletes the version another
+    # one just made current. readers see either the old or the new version, never a mix
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current = current_version(directory)
+        if current is None or version > current:
+            link = os.path.join(directory, f".{CURRENT}.{unique}.tmp")
+            os.symlink(version, link)
+            os.replace(link, os.path.join(directory, CURRENT))
+            current = version
+
+        # old versions can go, workers that still have them mapped keep their pages
+        versions = sorted(d for d in os.listdir(directory) if d.startswith("v"))
+        for old in versions[:-keep]:
+            if old != current:
+                shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    print(f"wrote catalog snapshot {version} with {len(ids)} nfts")
+    return os.path.join(directory, version)
+
+
+def current_version(directory):
+    try:
+        return os.readlink(os.path.join(directory, CURRENT))
+    except OSError:
+        return None
+
+
+def load_snapshot(directory, version):
+    """Map a snapshot version read only into an NFTCatalog without copying the embeddings."""
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    return NFTCatalog(
+        ids=np.load(os.path.join(path, "ids.npy")),
+        collection_ids=meta["collection_ids"],
+        nft_ids=meta["nft_ids"],
+        prices=np.load(os.path.join(path, "prices.npy")),
+        image_matrix=np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r"),
+    )
+
+
+class SnapshotReader:
+    """Per worker handle that re-maps the snapshot whenever a newer version is current."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.version = None
+        self._catalog = None
+
+    def catalog(self):
+        """The current catalog, or None if no snapshot has been written yet."""
+        version = current_version(self.directory)
+        if version is not None and version != self.version:
+            try:
+                self._catalog = load_snapshot(self.directory, version)
+                self.version = version
+            except FileNotFoundError:
+                # swapped and cleaned up under us, keep the old one until next call
+                pass
+        return self._catalog
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+# the app modules are imported by name from app/, like app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# keep the marketplace api response cache out of the working tree
+os.environ.setdefault("API_CACHE_PATH", ":memory:")
+
+
+@pytest.fixture
+def marketplace(monkeypatch):
+    """Starts the crawler's mock marketplace, returns a function pointing the apis at one with the given shape."""
+    from aiohttp import web
+
+    import async_crawler
+    import multipipline_api as api
+    from response_cache import ResponseCache
+
+    servers = []
+
+    def start(n_collections, listings_per_collection):
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(async_crawler._mock_app(n_collections, listings_per_collection, latency=0))
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        loop.run_until_complete(site.start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        servers.append((loop, runner, thread))
+
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        for name in ("CGECKO_URL", "ALCHEM_URL", "OPNSEA_URL"):
+            monkeypatch.setattr(api, name, base)
+        # compare the crawls themselves, not the cache
+        monkeypatch.setattr(api, "responseCache", ResponseCache(None, api.API_CACHE_TTLS))
+
+    yield start
+
+    for loop, runner, thread in servers:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
@@ -0,0 +1,84 @@
+import sys
+import threading
+
+import numpy as np
+
+from ann_index import IVFIndex
+
+
+def random_vectors(rng, n, dim):
+    return rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def test_search_finds_the_closest_affordable_entry():
+    rng = np.random.default_rng(0)
+    vectors = random_vectors(rng, 200, 16)
+    prices = np.ones(200)
+    prices[0] = 10
+    index = IVFIndex.build(np.arange(200), vectors, prices, dim=16, min_train=64, nprobe=64)
+
+    ids, _ = index.search(vectors[1], price_cap=5, k=1)
+    assert ids[0] == 1
+    # too expensive, so it is skipped even though it is the exact match
+    ids, _ = index.search(vectors[0], price_cap=5, k=5)
+    assert 0 not in ids
+
+
+def test_removed_and_repriced_entries():
+    rng = np.random.default_rng(1)
+    vectors = random_vectors(rng, 100, 16)
+    index = IVFIndex.build(np.arange(100), vectors, np.ones(100), dim=16, min_train=32, nprobe=64)
+
+    assert index.remove(5)
+    assert not index.remove(5)
+    assert 5 not in index.search(vectors[5], price_cap=5, k=10)[0]
+
+    index.update_price(6, 100)
+    assert 6 not in index.search(vectors[6], price_cap=5, k=10)[0]
+
+
+def test_concurrent_updates_and_searches():
+    rng = np.random.default_rng(2)
+    dim = 16
+    vectors = random_vectors(rng, 4000, dim)
+    # small min_train so the writer triggers several retrains while searching
+    index = IVFIndex.build(np.arange(50), vectors[:50], np.ones(50), dim=dim, min_train=100, nprobe=4)
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            for start in range(50, 4000, 50):
+                ids = np.arange(start, start + 50)
+                index.add_many(ids, vectors[start:start + 50], np.ones(50))
+                index.remove(start - 25)
+                index.update_price(start - 10, 2)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def search():
+        try:
+            while not done.is_set():
+                ids, scores = index.search(vectors[rng.integers(4000)], price_cap=5, k=10)
+                assert len(ids) == len(scores) <= 10
+                assert all(i >= 0 for i in ids)
+        except Exception as e:
+            errors.append(e)
+
+    # switch threads often so a search lands in the middle of a retrain / resize
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=search) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert len(index) == 4000 - len(range(50, 4000, 50))
+    assert index.search(vectors[3999], price_cap=5, k=1)[0][0] == 3999
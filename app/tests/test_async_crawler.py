@@ -0,0 +1,28 @@
+import async_crawler
+import multipipline_api as api
+
+
+def keys(nfts):
+    return sorted((nft["collection_id"], nft["nft_id"]) for nft in nfts)
+
+
+def test_async_crawl_finds_what_the_serial_crawl_finds(marketplace):
+    marketplace(n_collections=5, listings_per_collection=30)
+    serial = api.getNftWithPriceCeling(1)
+    assert len(serial) > 0
+    assert keys(async_crawler.getNftWithPriceCelingAsync(1)) == keys(serial)
+
+
+def test_closing_the_iterator_stops_the_crawl(marketplace):
+    marketplace(n_collections=10, listings_per_collection=50)
+    crawl = async_crawler.iterNftWithPriceCelingAsync(10, buffer_size=4)
+    first = [next(crawl) for _ in range(3)]
+    crawl.close()
+    assert len(first) == 3
+
+
+def test_stage_timer_report():
+    timer = async_crawler.StageTimer()
+    timer.add("nft", 0.5)
+    timer.add("nft", 0.25)
+    assert timer.report() == "nft 2 calls / 0.75s"
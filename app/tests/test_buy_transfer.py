@@ -0,0 +1,88 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import buy_transfer
+
+
+class FakePipeline:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, tx, label=None):
+        self.sent.append(tx)
+        raise AssertionError("nothing should be sent as a match here")
+
+
+class SendingPipeline:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, tx, label=None):
+        self.sent.append(tx)
+        return SimpleNamespace(hash=f"0xtx{len(self.sent)}", future=Future())
+
+
+def make_group(n):
+    return [({"key": i, "recipient": f"0x{i}"}, {"value": "1"}, f"order {i}") for i in range(n)]
+
+
+def patch(monkeypatch, fillable):
+    monkeypatch.setattr(buy_transfer.seaport, "match_calldata", lambda gifts, buyer: ("match", len(gifts)))
+    monkeypatch.setattr(buy_transfer.seaport, "direct_calldata", lambda tx_data, recipient: ("single", recipient))
+    monkeypatch.setattr(buy_transfer, "_fillable", lambda to, value, data, buyer: fillable(data))
+
+
+def test_listings_that_only_fail_together_go_back_to_single_sends(monkeypatch):
+    # every listing fills alone, no match does
+    patch(monkeypatch, lambda data: None if data == "match" else 100000)
+    bought, unfilled = {}, {}
+    left = buy_transfer._send_match(FakePipeline(), "0xseaport", make_group(3), "0xbot", bought, unfilled)
+    assert [purchase["key"] for purchase, _, _ in left] == [0, 1, 2]
+    assert bought == {} and unfilled == {}
+
+
+def test_dead_listings_are_reported_and_the_rest_handed_back(monkeypatch):
+    patch(monkeypatch, lambda data: None if data == "match" or data == ("single", "0x1") else 100000)
+    bought, unfilled = {}, {}
+    left = buy_transfer._send_match(FakePipeline(), "0xseaport", make_group(3), "0xbot", bought, unfilled)
+    assert [purchase["key"] for purchase, _, _ in left] == [0, 2]
+    assert unfilled == {1: "listing no longer fillable"}
+
+
+def test_each_matched_purchase_reports_its_own_price(monkeypatch):
+    patch(monkeypatch, lambda data: 100000)
+    group = [({"key": i, "recipient": f"0x{i}"}, {"value": str(wei)}, f"order {i}") for i, wei in enumerate([10**18, 5 * 10**17])]
+    bought, unfilled = {}, {}
+    pipeline = SendingPipeline()
+    assert buy_transfer._send_match(pipeline, "0xseaport", group, "0xbot", bought, unfilled) == []
+    assert len(pipeline.sent) == 1
+    assert bought[0]["price"] == 1.0 and bought[1]["price"] == 0.5
+    assert bought[0]["purchase"] is bought[1]["purchase"]
+
+
+def test_stored_order_skips_the_listing_lookup(monkeypatch):
+    monkeypatch.setattr(buy_transfer, "get_fulfillment", lambda order_hash, protocol, buyer: {"value": str(10 ** 17), "order": order_hash})
+    monkeypatch.setattr(buy_transfer, "get_listing", lambda slug, token_id: pytest.fail("looked up the listing"))
+    tx_data, contract, token_id = buy_transfer.find_fulfillment("slug", "7", "0xbot", "0xstored", "0xabc", "0xseaport", max_price=1)
+    assert (tx_data["order"], contract, token_id) == ("0xstored", "0xabc", 7)
+
+
+def test_gone_stored_order_falls_back_to_the_current_listing_within_max_price(monkeypatch):
+    prices = {"0xnew": 5 * 10 ** 17}
+
+    def fulfillment(order_hash, protocol, buyer):
+        if order_hash not in prices:
+            raise Exception("order filled")
+        return {"value": str(prices[order_hash]), "order": order_hash}
+
+    monkeypatch.setattr(buy_transfer, "get_fulfillment", fulfillment)
+    monkeypatch.setattr(buy_transfer, "get_listing", lambda slug, token_id: ("0xnew", "0xabc", 7, "0xseaport"))
+    tx_data, _, _ = buy_transfer.find_fulfillment("slug", "7", "0xbot", "0xstored", "0xabc", "0xseaport", max_price=1)
+    assert tx_data["order"] == "0xnew"
+
+    # the newer listing costs more than the order may spend
+    prices["0xnew"] = 2 * 10 ** 18
+    with pytest.raises(Exception, match="more than 1 ETH"):
+        buy_transfer.find_fulfillment("slug", "7", "0xbot", "0xstored", "0xabc", "0xseaport", max_price=1)
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import collection_index
+from collection_index import CollectionIndex
+from scoring import NFTCatalog
+
+
+def axis(i, dim=4):
+    return np.eye(dim)[i]
+
+
+def test_collections_rank_by_centroid_within_budget():
+    index = CollectionIndex.build(["a", "a", "b", "c"], [axis(0), axis(0) + axis(1), axis(1), axis(2)], [1, 2, 5, 1], dim=4)
+    assert index.top_collections(axis(0), n=2)[0] == ["a", "b"]
+    # b's cheapest item is over the cap, so it is skipped
+    assert index.top_collections(axis(1), price_cap=3, n=2)[0] == ["a", "c"]
+    assert index.top_collections(axis(0), price_cap=0.5) == ([], [])
+
+
+def test_removing_every_item_hides_the_collection():
+    index = CollectionIndex.build(["a", "b"], [axis(0), axis(1)], [1, 1], dim=4)
+    index.remove("a", axis(0), 1)
+    assert len(index) == 1
+    assert index.top_collections(axis(0), n=5)[0] == ["b"]
+    assert np.allclose(index.sum("a"), 0)
+
+
+def test_growing_past_the_initial_capacity():
+    ids = [f"c{i}" for i in range(100)]
+    index = CollectionIndex.build(ids, [axis(i % 4) for i in range(100)], range(100), dim=4)
+    assert len(index) == 100
+    assert index.top_collections(axis(3), price_cap=10, n=2)[0] == ["c3", "c7"]
+    assert index.top_collections(axis(3), n=1)[0] == ["c3"]
+    assert index.min_prices[index.slots["c99"]] == 99
+
+
+def test_stored_stats_round_trip():
+    index = CollectionIndex.build(["a", "a", "b"], [axis(0), axis(1), axis(2)], [1, 3, 2], dim=4)
+    rows = [
+        SimpleNamespace(collection_id=c, vector_sum=index.sum(c), item_count=int(index.counts[index.slots[c]]),
+                        min_price=float(index.min_prices[index.slots[c]]), max_price=float(index.max_prices[index.slots[c]]))
+        for c in ["a", "b"]
+    ]
+    loaded = CollectionIndex.from_stats(rows, dim=4)
+    assert np.allclose(loaded.centroids(), index.centroids())
+    assert loaded.top_collections(axis(2), price_cap=1.5, n=2)[0] == ["a"]
+
+
+def test_search_scores_only_the_items_of_the_top_collections():
+    vectors = [axis(0), axis(0) * 0.9 + axis(3) * 0.1, axis(1), axis(2)]
+    collections = ["a", "a", "b", "c"]
+    prices = np.ones(4)
+    index = CollectionIndex.build(collections, vectors, prices, dim=4)
+    fetched = []
+
+    def fetch_catalog(collection_ids):
+        fetched.append(collection_ids)
+        rows = [i for i, c in enumerate(collections) if c in collection_ids]
+        return NFTCatalog(ids=np.array(rows) + 100, collection_ids=[collections[i] for i in rows], nft_ids=[str(i) for i in rows],
+                          prices=prices[rows], image_matrix=np.array([vectors[i] for i in rows], dtype=np.float32))
+
+    ids, scores = collection_index.search(index, fetch_catalog, axis(0), k=2, n_collections=1)
+    assert fetched == [["a"]]
+    assert ids == [100, 101]
+    assert scores[0] >= scores[1]
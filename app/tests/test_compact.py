@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import compact
+from compact import QuantizedCatalog, compact_columns, from_float16_bytes, quantize_int8
+from scoring import normalize_rows
+
+
+def make_catalog(n=200, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(rng.standard_normal((n, dim)).astype(np.float32))
+    columns = [compact_columns(v) for v in vectors]
+    rows = [
+        SimpleNamespace(id=i, price=float(i % 10), image_embedding_int8=c["image_embedding_int8"], image_embedding_scale=c["image_embedding_scale"])
+        for i, c in enumerate(columns)
+    ]
+    fetch = lambda ids: [(i, columns[i]["image_embedding_f16"]) for i in ids]
+    return QuantizedCatalog.from_rows(rows, dim=dim), fetch, vectors
+
+
+def test_int8_codes_round_trip_within_one_step():
+    vector = np.array([0.5, -1.0, 0.25, 0.0], dtype=np.float32)
+    codes, scale = quantize_int8(vector)
+    decoded = np.frombuffer(codes, dtype=np.int8) * scale
+    assert np.abs(decoded - vector).max() <= scale / 2
+    assert quantize_int8(np.zeros(4)) == (bytes(4), 1.0)
+
+
+def test_compact_columns_are_normalized_float16():
+    columns = compact_columns([3.0, 4.0])
+    assert np.allclose(from_float16_bytes(columns["image_embedding_f16"]), [0.6, 0.8], atol=1e-3)
+
+
+def test_row_vector_falls_back_to_the_full_array():
+    f16 = compact_columns([1.0, 0.0])["image_embedding_f16"]
+    assert compact.row_vector(SimpleNamespace(image_embedding_f16=f16, image_embedding_vector=None)).tolist() == [1.0, 0.0]
+    assert compact.row_vector(SimpleNamespace(image_embedding_f16=None, image_embedding_vector=[0.0, 1.0])) == [0.0, 1.0]
+
+
+def test_two_stage_search_matches_exact_search():
+    catalog, fetch, vectors = make_catalog()
+    query = vectors[17]
+    ids, scores = compact.search(catalog, fetch, query, price_cap=9, k=5, rerank_size=50)
+
+    exact = np.where(catalog.prices <= 9, vectors @ query, -np.inf)
+    assert ids[0] == 17
+    assert ids == np.argsort(-exact)[:len(ids)].tolist()
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_price_cap_and_dropped_rows_are_excluded():
+    catalog, fetch, vectors = make_catalog()
+    # row 19 costs 9
+    assert 19 not in compact.search(catalog, fetch, vectors[19], price_cap=5, k=5)[0]
+
+    catalog.drop([17])
+    assert 17 not in catalog.coarse_top(vectors[17], price_cap=100, n=len(catalog))
+
+
+def test_nothing_affordable_finds_nothing():
+    catalog, fetch, vectors = make_catalog()
+    assert compact.search(catalog, fetch, vectors[0], price_cap=-1) == ([], [])
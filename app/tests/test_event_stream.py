@@ -0,0 +1,180 @@
+import asyncio
+import json
+from collections import namedtuple
+
+import aiohttp
+from aiohttp import web
+
+from event_stream import _message, collapse, consume, listings, parse_event, removals
+
+Row = namedtuple("Row", "id collection_id nft_id order_hash")
+
+
+def event(kind, nft_id, order_hash, price=1.0, collection_id="slug"):
+    return {"type": kind, "collection_id": collection_id, "nft_id": nft_id, "order_hash": order_hash, "price": price}
+
+
+def test_last_event_per_nft_wins():
+    latest = collapse([event("listed", "1", "a"), event("cancelled", "1", "a"), event("listed", "1", "b")])
+    assert latest[("slug", "1")]["order_hash"] == "b"
+
+
+def test_cancel_of_an_older_order_keeps_the_newer_listing():
+    latest = collapse([event("listed", "1", "new"), event("cancelled", "1", "old")])
+    assert latest[("slug", "1")]["type"] == "listed"
+    assert listings(latest, 10) == [event("listed", "1", "new")]
+
+
+def test_cancel_after_a_sale_still_removes_the_row():
+    latest = collapse([event("sold", "1", "a"), event("cancelled", "1", "other")])
+    assert removals(latest, [Row(7, "slug", "1", "a")]) == [7]
+
+
+def test_listings_above_the_ceiling_or_without_a_collection_are_skipped():
+    latest = collapse([event("listed", "1", "a", price=20), event("listed", "2", "b", collection_id=None), event("listed", "3", "c", price=None)])
+    assert listings(latest, 10) == []
+
+
+def test_cancel_only_removes_the_stored_listing():
+    latest = collapse([event("cancelled", "1", "a"), event("cancelled", "2", "a"), event("cancelled", "3", "a")])
+    rows = [Row(1, "slug", "1", "a"), Row(2, "slug", "2", "other"), Row(3, "slug", "3", None)]
+    # 2 was relisted under another order, 3 was crawled without knowing its order
+    assert removals(latest, rows) == [1, 3]
+
+
+def test_sale_removes_whatever_listing_is_stored():
+    latest = collapse([event("sold", "1", "a")])
+    assert removals(latest, [Row(1, "slug", "1", "other")]) == [1]
+
+
+def test_listed_rows_are_not_removed():
+    latest = collapse([event("cancelled", "1", "a"), event("listed", "1", "a")])
+    assert removals(latest, [Row(1, "slug", "1", "a")]) == []
+
+
+# ---- local replay server standing in for the stream ----
+
+def make_event(event, sent_at, slug, contract, identifier, price=None, order_hash=None, expiration=None):
+    """A stream message shaped like OpenSea's."""
+    payload = {
+        "item": {
+            "nft_id": f"ethereum/{contract}/{identifier}",
+            "metadata": {"image_url": f"https://example.com/{contract}/{identifier}.png"},
+            "chain": {"name": "ethereum"},
+        },
+        "collection": {"slug": slug},
+        "order_hash": order_hash,
+        "payment_token": {"symbol": "ETH", "decimals": 18},
+        "quantity": 1,
+    }
+    if price is not None:
+        payload["sale_price" if event == "item_sold" else "base_price"] = str(int(price * 10 ** 18))
+    if expiration is not None:
+        payload["expiration_date"] = expiration
+    return {"topic": "collection:*", "event": event, "payload": {"event_type": event, "sent_at": sent_at, "payload": payload}, "ref": None}
+
+
+def replay_app(events, drop_after=None):
+    """
+    aiohttp app replaying events (sorted by sent_at) to every joined socket,
+    starting at ?since=. drop_after closes each connection after that many
+    events to exercise reconnects.
+    """
+    async def socket(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        since = request.query.get("since")
+
+        joined = False
+        while not joined:
+            msg = await ws.receive()
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                return ws
+            message = json.loads(msg.data)
+            if message["event"] == "phx_join":
+                await ws.send_str(_message(message["topic"], "phx_reply", {"status": "ok"}, message["ref"]))
+                joined = True
+
+        sent = 0
+        for event in events:
+            if since and event["payload"]["sent_at"] < since:
+                continue
+            if drop_after is not None and sent >= drop_after:
+                await ws.close()
+                return ws
+            await ws.send_str(json.dumps(event))
+            sent += 1
+
+        # caught up, stay connected like the real stream
+        async for msg in ws:
+            message = json.loads(msg.data)
+            if message["event"] == "heartbeat":
+                await ws.send_str(_message("phoenix", "phx_reply", {"status": "ok"}, message["ref"]))
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/socket/websocket", socket)
+    return app
+
+
+def test_stream_messages_are_parsed():
+    listed = parse_event(make_event("item_listed", "2024-01-01T00:00:00+00:00", "slug", "0xabc", "7", price=0.5, order_hash="0x1"))
+    assert listed["type"] == "listed"
+    assert (listed["collection_id"], listed["nft_id"], listed["order_hash"]) == ("slug", "7", "0x1")
+    assert listed["price"] == 0.5
+    assert parse_event({"event": "phx_reply", "payload": {}}) is None
+
+
+def test_replay_across_disconnects_ends_with_the_right_catalog():
+    events = []
+    expected = {}
+    for i in range(500):
+        sent_at = f"2024-01-01T00:00:{i // 100:02d}.{i % 100:06d}+00:00"
+        key = (f"slug-{i % 7}", str(i % 50))
+        if i % 5 == 4 and key in expected:
+            kind = "item_sold" if i % 2 else "item_cancelled"
+            events.append(make_event(kind, sent_at, key[0], "0xabc", key[1], order_hash=expected[key]))
+            del expected[key]
+        else:
+            order_hash = f"0x{i:064x}"
+            events.append(make_event("item_listed", sent_at, key[0], "0xabc", key[1], price=0.01 * (i % 20), order_hash=order_hash))
+            expected[key] = order_hash
+
+    catalog = {}
+    saved = {"position": None}
+
+    def handle(batch):
+        # same steps as app.apply_listing_events, with a dict for the table
+        latest = collapse(batch)
+        for listed in listings(latest, float("inf")):
+            catalog[(listed["collection_id"], listed["nft_id"])] = listed["order_hash"]
+        rows = [Row(key, key[0], key[1], catalog[key]) for key in latest if key in catalog]
+        for key in removals(latest, rows):
+            del catalog[key]
+
+    async def run():
+        runner = web.AppRunner(replay_app(events, drop_after=120))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"ws://127.0.0.1:{runner.addresses[0][1]}/socket/websocket"
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(consume(
+            url, "", handle, lambda: saved["position"], lambda p: saved.update(position=p),
+            batch_size=50, flush_interval=0.2, stop=stop,
+        ))
+        try:
+            await asyncio.wait_for(_caught_up(saved, events[-1]["payload"]["sent_at"]), timeout=30)
+        finally:
+            stop.set()
+            await task
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert catalog == expected
+
+
+async def _caught_up(saved, position):
+    while saved["position"] != position:
+        await asyncio.sleep(0.05)
@@ -0,0 +1,72 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import http_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_sessions(monkeypatch):
+    monkeypatch.setattr(http_client, "_sessions", {})
+
+
+@pytest.fixture
+def flaky_server(monkeypatch):
+    """Answers 503 (Retry-After: 0) to the first `failures` requests of each path, then 200."""
+    monkeypatch.setattr(http_client, "BACKOFF", 0.01)
+    seen = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            seen[self.path] = seen.get(self.path, 0) + 1
+            failures = int(self.path.rsplit("/", 1)[-1])
+            if seen[self.path] <= failures:
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", seen
+    server.shutdown()
+
+
+def test_one_session_per_api(monkeypatch):
+    monkeypatch.setenv("HTTP_POOL_OPENSEA", "32")
+    assert http_client.pool_size("opensea") == 32
+    assert http_client.pool_size("alchemy") == http_client.POOL_SIZES["alchemy"]
+    assert http_client.pool_size("unknown") == http_client.POOL_SIZES["default"]
+
+    opensea = http_client.session("opensea")
+    assert http_client.session("opensea") is opensea
+    assert http_client.session("alchemy") is not opensea
+    assert opensea.get_adapter("https://api.opensea.io")._pool_maxsize == 32
+
+
+def test_server_errors_are_retried(flaky_server):
+    url, seen = flaky_server
+    response = http_client.get("default", f"{url}/a/2")
+    assert response.status_code == 200
+    assert seen["/a/2"] == 3
+
+
+def test_last_response_is_returned_once_retries_run_out(flaky_server):
+    url, seen = flaky_server
+    response = http_client.get("default", f"{url}/b/{http_client.RETRIES + 5}")
+    assert response.status_code == 503
+    assert seen[f"/b/{http_client.RETRIES + 5}"] == http_client.RETRIES + 1
+
+
+def test_retry_delay():
+    assert http_client.retry_delay(3, retry_after="7") == 7
+    for attempt in range(4):
+        delay = http_client.retry_delay(attempt, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")
+        assert http_client.BACKOFF * 2 ** attempt / 2 <= delay <= http_client.BACKOFF * 2 ** attempt
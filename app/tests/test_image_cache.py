@@ -0,0 +1,27 @@
+import numpy as np
+
+from image_cache import ImageEmbeddingCache
+
+
+def test_evicts_least_recently_used_only_past_the_limit(tmp_path):
+    cache = ImageEmbeddingCache(str(tmp_path / "cache.sqlite3"), "model", max_entries=20)
+    for i in range(20):
+        cache.put(f"url{i}", f"hash{i}", np.full(4, i))
+    assert cache._count == 20
+
+    cache.get_by_content("hash0")  # recently used, survives
+    cache.put("url20", "hash20", np.full(4, 20))
+
+    count = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert count == cache._count == 18
+    assert cache.get_by_content("hash0") is not None
+    assert cache.get_by_content("hash20") is not None
+    assert cache.get_by_url("url1") is None
+
+
+def test_count_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ImageEmbeddingCache(path, "model", max_entries=20)
+    for i in range(5):
+        cache.put(f"url{i}", f"hash{i}", np.zeros(4))
+    assert ImageEmbeddingCache(path, "model", max_entries=20)._count == 5
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+
+from image_cache import ImageEmbeddingCache, content_hash
+from image_pipeline import run_pipeline
+
+BLANK = np.zeros(2)
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        if self.content is None:
+            raise IOError("404")
+
+
+class FakeSession:
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        with self._lock:
+            self.fetched.append(url)
+        return FakeResponse(self.pages.get(url))
+
+
+def decode(data, path):
+    # "images" are just their text, anything not starting with img is corrupt
+    return data.decode() if data.startswith(b"img") else None
+
+
+def embed(images):
+    embed.batches.append(len(images))
+    return [np.array([len(img), 1.0]) for img in images]
+
+
+def run(paths, pages, **kwargs):
+    embed.batches = []
+    session = FakeSession(pages)
+    kwargs.setdefault("batch_size", 3)
+    results, digests = run_pipeline(paths, decode, embed, BLANK, fetch_workers=4, decode_workers=2, session=session, **kwargs)
+    return results, digests, session
+
+
+def test_results_stay_in_path_order():
+    paths = [f"http://x/{i}" for i in range(10)]
+    pages = {p: b"img" + b"x" * i for i, p in enumerate(paths)}
+    results, digests, _ = run(paths, pages)
+
+    assert [r[0] for r in results] == [3 + i for i in range(10)]
+    assert digests == [content_hash(pages[p]) for p in paths]
+    assert sorted(embed.batches) == [1, 3, 3, 3]
+
+
+def test_failed_downloads_and_decodes_get_the_blank_embedding():
+    paths = ["http://x/ok", "http://x/missing", "http://x/corrupt"]
+    results, digests, _ = run(paths, {"http://x/ok": b"img", "http://x/corrupt": b"garbage"})
+    assert results[0].tolist() == [3, 1]
+    assert results[1] is BLANK and results[2] is BLANK
+    assert digests[1:] == [None, None]
+
+
+def test_local_files_are_read_from_disk(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"imgfile")
+    results, digests, session = run([str(path)], {})
+    assert results[0].tolist() == [7, 1]
+    assert session.fetched == []
+
+
+def test_cache_skips_known_urls_and_known_bytes(tmp_path):
+    cache = ImageEmbeddingCache(str(tmp_path / "cache.sqlite3"), "model")
+    run(["http://x/a"], {"http://x/a": b"img-a"}, cache=cache)
+
+    # same url: no download, same bytes under a new url: downloaded but not embedded
+    results, digests, session = run(["http://x/a", "http://y/a"], {"http://y/a": b"img-a"}, cache=cache)
+    assert session.fetched == ["http://y/a"]
+    assert embed.batches == []
+    assert [r.tolist() for r in results] == [[5, 1], [5, 1]]
+    assert digests == [content_hash(b"img-a")] * 2
+    assert cache.get_by_url("http://y/a") is not None
+
+
+def test_no_paths():
+    assert run_pipeline([], decode, embed, BLANK) == ([], [])
@@ -0,0 +1,92 @@
+from collections import namedtuple
+from contextlib import contextmanager
+
+from ingest_worker import IngestWorker, stale_ids, upsert_chunks
+
+Row = namedtuple("Row", "id collection_id nft_id listed_at")
+
+
+@contextmanager
+def granted():
+    yield True
+
+
+def test_refill_asks_only_for_the_missing_rows():
+    asked = []
+    worker = IngestWorker(count_fn=lambda: 40, refill_fn=asked.append, lock_fn=granted, low=100, high=250)
+    assert worker.run_once()
+    assert asked == [210]
+
+
+def test_no_refill_above_low_watermark():
+    asked = []
+    worker = IngestWorker(count_fn=lambda: 100, refill_fn=asked.append, lock_fn=granted, low=100, high=250)
+    assert not worker.run_once()
+    assert asked == []
+
+
+def test_refill_skipped_without_the_lock():
+    @contextmanager
+    def taken():
+        yield False
+
+    asked = []
+    worker = IngestWorker(count_fn=lambda: 0, refill_fn=asked.append, lock_fn=taken, low=100, high=250)
+    assert not worker.run_once()
+    assert asked == []
+
+
+def test_truncated_crawl_deletes_nothing():
+    rows = [Row(1, "a", "1", 10), Row(2, "a", "2", 10), Row(3, "b", "1", 10)]
+    assert stale_ids(rows, {("a", "1")}, crawl_started=100, complete=False) == []
+
+
+def test_complete_crawl_deletes_unseen_rows():
+    rows = [Row(1, "a", "1", 10), Row(2, "a", "2", 10), Row(3, "b", "1", None)]
+    assert stale_ids(rows, {("a", "1")}, crawl_started=100, complete=True) == [2, 3]
+
+
+def test_rows_written_during_the_crawl_are_kept():
+    # e.g. a listing the event stream inserted after the crawl passed its collection
+    rows = [Row(1, "a", "1", 10), Row(2, "c", "9", 150)]
+    assert stale_ids(rows, {("a", "1")}, crawl_started=100, complete=True) == []
+
+
+def test_empty_crawl_deletes_nothing():
+    rows = [Row(1, "a", "1", 10)]
+    assert stale_ids(rows, set(), crawl_started=100, complete=True) == []
+
+
+def crawl(keys):
+    return [{"collection_id": c, "nft_id": n} for c, n in keys]
+
+
+def test_only_new_rows_count_toward_the_limit():
+    stored = {("a", "1"), ("a", "2"), ("a", "3")}
+    chunks = []
+
+    def upsert(chunk):
+        chunks.append(len(chunk))
+        new = [nft for nft in chunk if (nft["collection_id"], nft["nft_id"]) not in stored]
+        return len(new)
+
+    data = crawl([("a", "1"), ("a", "2"), ("a", "3"), ("b", "1"), ("b", "2"), ("b", "3"), ("b", "4")])
+    seen, inserted, complete = upsert_chunks(data, upsert, chunk_size=10, limit=2)
+    assert inserted == 2
+    assert not complete
+    # the three known listings were refreshed on the way, the crawl stopped at b 2
+    assert seen == stored | {("b", "1"), ("b", "2")}
+    assert chunks == [2, 2, 1]
+
+
+def test_crawl_that_runs_out_is_complete():
+    seen, inserted, complete = upsert_chunks(crawl([("a", "1"), ("a", "1"), ("b", "1")]) + [{"nft_id": "x"}], len, chunk_size=2, limit=10)
+    assert (inserted, complete) == (2, True)
+    assert seen == {("a", "1"), ("b", "1")}
+
+
+def test_no_limit_upserts_everything_in_chunks():
+    chunks = []
+    seen, inserted, complete = upsert_chunks(crawl([("a", str(i)) for i in range(5)]), lambda chunk: chunks.append(len(chunk)) or len(chunk), chunk_size=2)
+    assert chunks == [2, 2, 1]
+    assert (inserted, complete) == (5, True)
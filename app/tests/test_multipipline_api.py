@@ -0,0 +1,49 @@
+import time
+
+import multipipline_api as api
+
+
+def listing(i, price_eth=0.5, end_time=None, remaining=1, status="ACTIVE"):
+    return {
+        "status": status,
+        "order_hash": f"0x{i:064x}",
+        "protocol_address": "0x0000000000000068f116a894984e2db1123eb395",
+        "remaining_quantity": remaining,
+        "price": {"current": {"currency": "ETH", "decimals": 18, "value": str(int(price_eth * 10 ** 18))}},
+        "protocol_data": {"parameters": {
+            "offer": [{"token": "0xabc", "identifierOrCriteria": str(i)}],
+            "endTime": str(end_time if end_time is not None else int(time.time()) + 3600),
+        }},
+    }
+
+
+def test_listing_keeps_what_is_needed_to_fill_it_later():
+    end_time = int(time.time()) + 3600
+    [parsed] = api.parseListings({"listings": [listing(7, end_time=end_time)]}, 1)
+    assert api.listingFields(parsed) == {
+        "currency": "ETH", "price": 0.5, "contract_address": "0xabc", "order_hash": f"0x{7:064x}",
+        "listing_end_time": end_time, "remaining_quantity": 1,
+        "protocol_address": "0x0000000000000068f116a894984e2db1123eb395",
+    }
+
+
+def test_expired_filled_inactive_and_expensive_listings_are_dropped():
+    response = {"listings": [
+        listing(1, end_time=int(time.time()) - 1),
+        listing(2, remaining=0),
+        listing(3, status="INACTIVE"),
+        listing(4, price_eth=2),
+        listing(5),
+    ]}
+    assert [ls["identifierOrCriteria"] for ls in api.parseListings(response, 1)] == ["5"]
+
+
+def test_listings_are_followed_across_pages(marketplace):
+    # 250 listings is three pages of LISTINGS_PAGE_SIZE
+    marketplace(n_collections=1, listings_per_collection=250)
+    listings = api.getAllListings("slug-0", 10)
+    assert len(listings) == 250
+    assert len({ls["identifierOrCriteria"] for ls in listings}) == 250
+
+    # max_listings stops paging early
+    assert len(api.getAllListings("slug-0", 10, max_listings=120)) == 120
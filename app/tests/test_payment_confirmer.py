@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+import payment_confirmer
+from payment_confirmer import PaymentConfirmer, RPCError, check_payment, rpc_batch, to_wei
+
+BOT = "0x" + "b0" * 20
+HEAD = 1000
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeNode:
+    """Answers json-rpc batches from a dict of hash -> (tx, receipt), counting the requests."""
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.requests = []
+
+    def post(self, api, url, json=None, **kwargs):
+        self.requests.append(len(json))
+        replies = []
+        for call in json:
+            if call["method"] == "eth_blockNumber":
+                result = hex(HEAD)
+            else:
+                tx, receipt = self.chain[call["params"][0]]
+                result = tx if call["method"] == "eth_getTransactionByHash" else receipt
+            replies.append({"jsonrpc": "2.0", "id": call["id"], "result": result})
+        # replies to a batch may come back in any order
+        return FakeResponse(replies[::-1])
+
+
+def payment(to=BOT, value=0.5, status="0x1", block=HEAD - 5):
+    return {"from": "0x" + "aa" * 20, "to": to, "value": hex(to_wei(value))}, {"status": status, "blockNumber": hex(block)}
+
+
+def test_check_payment():
+    tx, receipt = payment()
+    assert check_payment(tx, receipt, HEAD, BOT, 0.5, 2)[0] == "confirmed"
+    assert check_payment(tx, receipt, HEAD, "0x" + "B0" * 20, 0.5, 2)[0] == "confirmed"
+    assert check_payment(tx, receipt, HEAD, BOT, 0.6, 2) == ("failed", "Transaction amount is too low")
+    assert check_payment(*payment(to="0x" + "cc" * 20), HEAD, BOT, 0.5, 2) == ("failed", "Transaction recipient mismatch")
+    assert check_payment(*payment(status="0x0"), HEAD, BOT, 0.5, 2) == ("failed", "Transaction failed on-chain")
+    assert check_payment(*payment(block=HEAD), HEAD, BOT, 0.5, 2) == ("pending", "1/2 confirmations")
+    assert check_payment(tx, None, HEAD, BOT, 0.5, 2)[0] == "pending"
+    assert check_payment(None, None, HEAD, BOT, 0.5, 2)[0] == "pending"
+
+
+def test_rpc_errors_are_raised(monkeypatch):
+    monkeypatch.setattr(payment_confirmer.http_client, "post", lambda *a, **k: FakeResponse({"error": "batch too large"}))
+    with pytest.raises(RPCError):
+        rpc_batch("http://node", [("eth_blockNumber", [])])
+
+    monkeypatch.setattr(payment_confirmer.http_client, "post", lambda *a, **k: FakeResponse([{"id": 0, "error": "boom"}]))
+    with pytest.raises(RPCError):
+        rpc_batch("http://node", [("eth_blockNumber", [])])
+
+    assert rpc_batch("http://node", []) == []
+
+
+def test_every_pending_payment_is_checked_in_few_requests(monkeypatch):
+    chain, expected = {}, {}
+    for i in range(300):
+        kind = i % 5
+        tx, receipt = payment(
+            to="0x" + "cc" * 20 if kind == 1 else BOT,
+            status="0x0" if kind == 2 else "0x1",
+            block=HEAD if kind == 3 else HEAD - 5,  # kind 3 has one confirmation
+        )
+        if kind == 4:
+            tx, receipt = None, None  # not seen by the node yet
+        tx_hash = f"0x{i:064x}"
+        chain[tx_hash] = (tx, receipt)
+        expected[tx_hash] = {0: "confirmed", 1: "failed", 2: "failed"}.get(kind)
+
+    node = FakeNode(chain)
+    monkeypatch.setattr(payment_confirmer.http_client, "post", node.post)
+
+    settled = {}
+    pending = [(tx_hash, 0.5, time.time()) for tx_hash in chain]
+    confirmer = PaymentConfirmer(
+        "http://node", BOT,
+        load_fn=lambda: [p for p in pending if p[0] not in settled],
+        settle_fn=lambda tx_hash, status, detail: settled.__setitem__(tx_hash, status),
+    )
+
+    assert confirmer.run_once() == 180
+    assert settled == {h: s for h, s in expected.items() if s is not None}
+    # RPC_BATCH_SIZE hashes per request, two calls each plus the block number
+    assert node.requests == [201, 201, 201]
+
+
+def test_unknown_hash_fails_after_the_timeout(monkeypatch):
+    node = FakeNode({"0xold": (None, None), "0xnew": (None, None)})
+    monkeypatch.setattr(payment_confirmer.http_client, "post", node.post)
+
+    settled = {}
+    confirmer = PaymentConfirmer(
+        "http://node", BOT,
+        load_fn=lambda: [("0xold", 0.5, time.time() - 3600), ("0xnew", 0.5, time.time())],
+        settle_fn=lambda tx_hash, status, detail: settled.__setitem__(tx_hash, (status, detail)),
+        timeout=1800,
+    )
+    assert confirmer.run_once() == 1
+    assert settled == {"0xold": ("failed", "Transaction hash not found")}
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+
+import payment_indexer
+from payment_confirmer import to_wei
+from payment_indexer import PaymentIndexer
+
+PAYER = "0x" + "aa" * 20
+BOT = "0x" + "b0" * 20
+OTHER = "0x" + "cc" * 20
+
+
+class FakeChain:
+    """Blocks of transactions behind rpc_batch, with receipts and a head that can move."""
+
+    def __init__(self, head):
+        self.head = head
+        self.blocks = {}
+        self.receipts = {}
+        self.calls = []
+
+    def send(self, block, to, value, status=1):
+        tx_hash = f"0x{len(self.receipts):064x}"
+        tx = {"hash": tx_hash, "from": PAYER, "to": to, "value": hex(value), "blockNumber": hex(block)}
+        self.blocks.setdefault(block, []).append(tx)
+        self.receipts[tx_hash] = {"status": hex(status)}
+        return tx_hash
+
+    def rpc_batch(self, url, calls):
+        self.calls.append([method for method, _ in calls])
+        results = []
+        for method, params in calls:
+            if method == "eth_blockNumber":
+                results.append(hex(self.head))
+            elif method == "eth_getBlockByNumber":
+                number = int(params[0], 16)
+                results.append({"transactions": self.blocks.get(number, [])} if number <= self.head else None)
+            elif method == "eth_getTransactionReceipt":
+                results.append(self.receipts.get(params[0]))
+        return results
+
+
+def make_indexer(monkeypatch, chain, position=None, **kwargs):
+    monkeypatch.setattr(payment_indexer, "rpc_batch", chain.rpc_batch)
+    stored = {"payments": {}, "block": position, "rounds": 0}
+
+    def store(payments, block):
+        stored["payments"].update((p["tx_hash"], p["amount_wei"]) for p in payments)
+        stored["block"] = block
+        stored["rounds"] += 1
+
+    indexer = PaymentIndexer("http://node", "0x" + "B0" * 20, lambda: stored["block"], store, **kwargs)
+    return indexer, stored
+
+
+def test_only_successful_payments_to_the_bot_are_stored(monkeypatch):
+    chain = FakeChain(head=120)
+    expected = {}
+    for i in range(20):
+        block = 101 + i
+        if i % 4 == 0:
+            chain.send(block, OTHER, to_wei(0.01))
+        elif i % 5 == 0:
+            chain.send(block, BOT, to_wei(0.01), status=0)
+        else:
+            expected[chain.send(block, BOT, to_wei(0.01 * (i + 1)))] = to_wei(0.01 * (i + 1))
+    chain.send(105, BOT, 0)  # a zero value call to the wallet isn't a payment
+
+    indexer, stored = make_indexer(monkeypatch, chain, position=100, confirmations=1)
+    assert indexer.run_once() == len(expected)
+    assert stored["payments"] == expected and stored["block"] == 120
+
+    # nothing new, nothing found again
+    assert indexer.run_once() == 0
+
+
+def test_blocks_are_only_read_past_the_confirmation_depth(monkeypatch):
+    chain = FakeChain(head=110)
+    chain.send(109, BOT, to_wei(1))
+    late = chain.send(110, BOT, to_wei(2))
+
+    indexer, stored = make_indexer(monkeypatch, chain, position=100, confirmations=2)
+    indexer.run_once()
+    assert late not in stored["payments"] and stored["block"] == 109
+
+    chain.head = 111
+    indexer.run_once()
+    assert late in stored["payments"] and stored["block"] == 110
+
+
+def test_catching_up_stores_in_steps(monkeypatch):
+    chain = FakeChain(head=1000)
+    indexer, stored = make_indexer(monkeypatch, chain, position=None, confirmations=1, start_block=751, max_blocks=100)
+    indexer.run_once()
+    assert stored["block"] == 1000 and stored["rounds"] == 3
+    # 20 full blocks per request
+    assert sum(1 for methods in chain.calls if methods and methods[0] == "eth_getBlockByNumber") == 13
+
+
+def test_fresh_index_starts_at_the_safe_block(monkeypatch):
+    chain = FakeChain(head=500)
+    chain.send(400, BOT, to_wei(1))
+    indexer, stored = make_indexer(monkeypatch, chain, position=None, confirmations=2)
+    assert indexer.run_once() == 0
+    assert stored["block"] == 499
+
+
+def test_other_process_holding_the_lock_only_runs_after_fn(monkeypatch):
+    @contextmanager
+    def taken():
+        yield False
+
+    after = []
+    chain = FakeChain(head=200)
+    chain.send(150, BOT, to_wei(1))
+    indexer, stored = make_indexer(monkeypatch, chain, position=100, lock_fn=taken, after_fn=lambda: after.append(1))
+    assert indexer.run_once() == 0
+    assert stored["rounds"] == 0 and after == [1]
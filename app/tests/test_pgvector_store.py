@@ -0,0 +1,66 @@
+import numpy as np
+
+import pgvector_store
+
+
+class Row:
+    def __init__(self, id, similarity):
+        self.id = id
+        self.similarity = similarity
+
+
+class FakeHNSW:
+    """Answers search queries like hnsw would: filters applied to the ef_search nearest rows only."""
+
+    def __init__(self, prices, scores):
+        self.prices = prices
+        self.scores = scores
+        self.ef_search = None
+        self.scans = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        if sql.startswith("SET LOCAL hnsw.ef_search"):
+            self.ef_search = int(sql.rsplit("=", 1)[1])
+            return self
+        exact = "+ 0" in sql
+        self.scans.append("exact" if exact else self.ef_search)
+        order = np.argsort(-self.scores)
+        if not exact:
+            order = order[:self.ef_search]
+        self._rows = [Row(int(i), float(self.scores[i])) for i in order if params["cap"] is None or self.prices[i] <= params["cap"]][:params["k"]]
+        return self
+
+    def all(self):
+        return self._rows
+
+
+def make_store(n=5000, cheap_every=500, seed=0):
+    rng = np.random.default_rng(seed)
+    scores = rng.uniform(0, 1, n)
+    prices = np.full(n, 50.0)
+    prices[::cheap_every] = 1.0
+    return FakeHNSW(prices, scores)
+
+
+def test_enough_rows_on_the_first_scan():
+    store = make_store()
+    ids, _ = pgvector_store.search(store, [0.0], price_cap=None, k=10, ef_search=40)
+    assert len(ids) == 10
+    assert store.scans == [40]
+
+
+def test_selective_price_cap_widens_the_scan_until_k_qualify():
+    store = make_store(cheap_every=50)  # 100 cheap rows, about 1 in 50 of any scan
+    ids, scores = pgvector_store.search(store, [0.0], price_cap=5, k=10, ef_search=40)
+    assert len(ids) == 10
+    assert all(store.prices[i] <= 5 for i in ids)
+    assert scores == sorted(scores, reverse=True)
+    assert store.scans[0] == 40 and store.scans[-1] != "exact"
+
+
+def test_falls_back_to_an_exact_scan():
+    store = make_store(cheap_every=1000)  # 5 cheap rows, hnsw never sees enough of them
+    ids, _ = pgvector_store.search(store, [0.0], price_cap=5, k=10, ef_search=40)
+    assert sorted(ids) == list(range(0, 5000, 1000))
+    assert store.scans[-2:] == [pgvector_store.MAX_EF_SEARCH, "exact"]
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+
+from preference_cache import STYLES, THEMES, EmbeddingCache, PreferenceEmbedder
+
+
+class CountingModel:
+    """Stands in for the text model: a fixed vector per text, counting calls."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        rng = np.random.default_rng(abs(hash(text)) % 2 ** 32)
+        return rng.standard_normal(self.dim)
+
+
+def test_cache_persists_and_evicts_the_least_recently_used(tmp_path):
+    path = str(tmp_path / "prefs.sqlite3")
+    cache = EmbeddingCache(path, max_entries=2)
+    cache.put("a", [1, 2])
+    time.sleep(0.01)
+    cache.put("b", [3, 4])
+    time.sleep(0.01)
+    assert cache.get("a").tolist() == [1, 2]  # a is now more recent than b
+    time.sleep(0.01)
+    cache.put("c", [5, 6])
+
+    reopened = EmbeddingCache(path, max_entries=2)
+    assert len(reopened) == 2
+    assert reopened.get("b") is None
+    assert reopened.get("c").tolist() == [5, 6]
+    assert (reopened.hits, reopened.misses) == (1, 1)
+
+
+def test_warm_vocabulary_means_no_model_calls_for_checkboxes(tmp_path):
+    model = CountingModel()
+    embedder = PreferenceEmbedder(model, EmbeddingCache(str(tmp_path / "prefs.sqlite3")))
+    embedder.warm()
+    assert len(model.calls) == len(STYLES) + len(THEMES)
+
+    model.calls.clear()
+    embedder.embed(["pixel", "anime"], ["space"])
+    assert model.calls == []
+
+    # free text is embedded once, normalized before it is looked up
+    embedder.embed(["pixel"], [], "  Cute  CATS ")
+    embedder.embed(["pixel"], [], "cute cats")
+    assert model.calls == ["cute cats"]
+
+
+def test_preference_vector_is_the_normalized_weighted_sum(tmp_path):
+    model = CountingModel()
+    embedder = PreferenceEmbedder(model, EmbeddingCache(str(tmp_path / "prefs.sqlite3")))
+    vector = embedder.embed(["pixel"], ["space"], "cats")
+
+    expected = 2 * model("pixel") + 2 * model("space") + model("cats")
+    assert np.allclose(vector, expected / np.linalg.norm(expected), atol=1e-6)
+    assert np.isclose(np.linalg.norm(vector), 1)
+
+
+def test_nothing_selected_embeds_the_blank_string(tmp_path):
+    model = CountingModel()
+    embedder = PreferenceEmbedder(model, EmbeddingCache(str(tmp_path / "prefs.sqlite3")))
+    embedder.embed([], [], "   ")
+    assert model.calls == [""]
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from response_cache import ResponseCache
+
+TTLS = {"nft": 3600, "listings": 1, "best_listing": 0}
+
+
+def counting(body):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return body
+    return fetch, calls
+
+
+def test_fresh_responses_are_served_from_disk(tmp_path):
+    path = str(tmp_path / "api.sqlite3")
+    fetch, calls = counting({"nft": 1})
+    assert ResponseCache(path, TTLS).get("nft", "a/1", fetch) == {"nft": 1}
+
+    # another process (or a restart) reads the same file
+    cache = ResponseCache(path, TTLS)
+    assert cache.get("nft", "a/1", fetch) == {"nft": 1}
+    assert len(calls) == 1
+    assert cache.stats() == "nft 1 hit / 0 miss"
+
+
+def test_endpoints_without_a_ttl_and_a_disabled_cache_always_fetch(tmp_path):
+    fetch, calls = counting([])
+    ResponseCache(str(tmp_path / "api.sqlite3"), TTLS).get("best_listing", "x", fetch)
+    ResponseCache(str(tmp_path / "api.sqlite3"), TTLS).get("best_listing", "x", fetch)
+    off = ResponseCache(None, TTLS)
+    off.get("nft", "x", fetch)
+    assert len(calls) == 3
+    assert off.stats() == "off"
+
+
+def test_invalid_responses_are_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path / "api.sqlite3"), TTLS)
+    fetch, calls = counting({"error": "rate limited"})
+    valid = lambda body: "error" not in body
+    cache.get("nft", "a/1", fetch, valid=valid)
+    cache.get("nft", "a/1", fetch, valid=valid)
+    assert len(calls) == 2
+
+
+def test_expired_response_is_served_when_the_refetch_fails(tmp_path):
+    cache = ResponseCache(str(tmp_path / "api.sqlite3"), {"listings": 0.05})
+    cache.get("listings", "slug", lambda: {"listings": [1]})
+    time.sleep(0.1)
+
+    def broken():
+        raise ConnectionError("down")
+
+    assert cache.get("listings", "slug", broken) == {"listings": [1]}
+    assert cache.counts["listings"]["stale"] == 1
+
+    with pytest.raises(ConnectionError):
+        cache.get("listings", "other", broken)
+
+
+def test_concurrent_misses_share_one_fetch(tmp_path):
+    cache = ResponseCache(str(tmp_path / "api.sqlite3"), TTLS)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"nft": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("nft", "a/1", slow))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [{"nft": 1}] * 8
+    assert len(calls) == 1
+
+
+def test_concurrent_async_misses_share_one_fetch(tmp_path):
+    cache = ResponseCache(str(tmp_path / "api.sqlite3"), TTLS)
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"nft": 1}
+
+    async def run():
+        return await asyncio.gather(*(cache.get_async("nft", "a/1", slow) for _ in range(8)))
+
+    assert asyncio.run(run()) == [{"nft": 1}] * 8
+    assert len(calls) == 1
+
+
+def test_purge_keeps_the_newest_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path / "api.sqlite3"), TTLS, max_entries=2)
+    for i in range(4):
+        cache.get("nft", str(i), lambda: i)
+    cache.purge()
+    assert cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 2
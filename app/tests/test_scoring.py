@@ -0,0 +1,78 @@
+import numpy as np
+
+from scoring import NFTCatalog, CatalogCache, claim_picks
+
+
+def make_catalog(n=4, dim=8):
+    image = np.eye(n, dim, dtype=np.float32)
+    return NFTCatalog(ids=np.arange(10, 10 + n), collection_ids=["c"] * n, nft_ids=[str(i) for i in range(n)], prices=np.ones(n), image_matrix=image)
+
+
+def test_cache_builds_once_until_invalidated():
+    built = []
+    cache = CatalogCache(lambda: built.append(1) or make_catalog(), ttl=3600)
+    first = cache.get()
+    assert cache.get() is first
+    assert len(built) == 1
+
+    cache.invalidate()
+    assert cache.get() is not first
+    assert len(built) == 2
+
+
+def test_cache_rebuilds_after_ttl():
+    built = []
+    cache = CatalogCache(lambda: built.append(1) or make_catalog(), ttl=0)
+    cache.get()
+    cache.get()
+    assert len(built) == 2
+
+
+def test_removed_rows_are_never_picked():
+    cache = CatalogCache(make_catalog, ttl=3600)
+    query = np.eye(1, 8, 0, dtype=np.float32)[0]
+    indices, _ = cache.get().top_k(query, price_cap=5)
+    assert cache.get().ids[indices[0]] == 10
+
+    cache.remove([10])
+    assert cache.get().top_k(query, price_cap=5) == ([], [])
+
+
+def test_failed_load_is_retried():
+    calls = []
+
+    def load():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("database away")
+        return make_catalog()
+
+    cache = CatalogCache(load, ttl=3600)
+    try:
+        cache.get()
+    except RuntimeError:
+        pass
+    assert len(cache.get()) == 4
+
+
+def test_only_the_bought_candidate_is_claimed():
+    # order 0 skips 1 (no valid listing) and buys 3, it never gets to 2
+    valid = {3, 2}
+    seen = []
+
+    def pick(o, candidates):
+        seen.append(candidates)
+        for c in candidates:
+            if c in valid:
+                return c, f"order {o} buys {c}"
+        return None
+
+    picks = claim_picks([[1, 3, 2], [3, 2, 1]], pick)
+    assert picks == ["order 0 buys 3", "order 1 buys 2"]
+    # 1 and 2 were only looked at by order 0, so order 1 still gets to see them
+    assert seen[1] == [2, 1]
+
+
+def test_orders_without_a_pick_claim_nothing():
+    picks = claim_picks([[1, 2], [1, 2]], lambda o, candidates: (candidates[0], candidates[0]) if o == 1 else None)
+    assert picks == [None, 1]
@@ -0,0 +1,75 @@
+from eth_abi import decode
+from eth_utils import keccak
+
+import seaport
+from seaport import ADVANCED_ORDER, CRITERIA_RESOLVER, FULFILLMENT, ZERO_ADDRESS, ERC721
+
+RECIPIENT = "0x3333333333333333333333333333333333333333"
+FEE_RECIPIENT = "0x0000a26b00c1f0df003000390027140000faa719"
+
+
+def basic_listing(**overrides):
+    """fulfillment_data transaction of a made up eth listing (basicOrderType 2, one fee)."""
+    parameters = {
+        "considerationToken": ZERO_ADDRESS, "considerationIdentifier": "0", "considerationAmount": "975000000000000000",
+        "offerer": "0x1111111111111111111111111111111111111111", "zone": ZERO_ADDRESS,
+        "offerToken": "0x2222222222222222222222222222222222222222", "offerIdentifier": "42", "offerAmount": "1",
+        "basicOrderType": 2, "startTime": "1700000000", "endTime": "1800000000", "zoneHash": "0x" + "00" * 32, "salt": "12345",
+        "offererConduitKey": "0x0000007b02230091a7ed01230072f7006a004d60a8d4e71d599b8104250f0000",
+        "fulfillerConduitKey": "0x0000007b02230091a7ed01230072f7006a004d60a8d4e71d599b8104250f0000",
+        "totalOriginalAdditionalRecipients": "1",
+        "additionalRecipients": [{"amount": "25000000000000000", "recipient": FEE_RECIPIENT}],
+        "signature": "0x" + "ab" * 65,
+        **overrides,
+    }
+    return {
+        "function": "fulfillBasicOrder_efficient_6GL6yc((address,uint256,uint256,address,address,address,uint256,uint256,uint8,uint256,uint256,bytes32,uint256,bytes32,bytes32,uint256,(uint256,address)[],bytes))",
+        "input_data": {"parameters": parameters},
+    }
+
+
+def test_basic_order_becomes_the_same_advanced_order():
+    transaction = basic_listing()
+    parameters = transaction["input_data"]["parameters"]
+    order, resolvers, conduit_key = seaport.fulfillment_order(transaction)
+    p = order["parameters"]
+
+    assert resolvers == [] and conduit_key == parameters["fulfillerConduitKey"]
+    assert p["orderType"] == 2  # FULL_RESTRICTED
+    assert p["totalOriginalConsiderationItems"] == 2  # offerer payment + 1 fee
+    assert [(item["startAmount"], item["recipient"]) for item in p["consideration"]] == [
+        ("975000000000000000", parameters["offerer"]),
+        ("25000000000000000", FEE_RECIPIENT),
+    ]
+    assert seaport.batchable(order, resolvers)
+
+
+def test_offers_are_not_redirected():
+    # basicOrderType 16 and up are offers (erc721 for erc20), not listings
+    assert seaport.fulfillment_order(basic_listing(basicOrderType=16)) is None
+    assert seaport.direct_calldata({"function": "fulfillAvailableOrders", "input_data": {}}, RECIPIENT) is None
+
+
+def test_direct_calldata_delivers_to_the_recipient():
+    data = seaport.direct_calldata(basic_listing(), RECIPIENT)
+    assert data[:10] == "0x" + keccak(text=seaport.FULFILL_ADVANCED_ORDER)[:4].hex()
+
+    order, _, _, to = decode([ADVANCED_ORDER, f"{CRITERIA_RESOLVER}[]", "bytes32", "address"], bytes.fromhex(data[10:]))
+    params = order[0]
+    assert to == RECIPIENT
+    assert params[2] == ((ERC721, "0x2222222222222222222222222222222222222222", 42, 1, 1),)
+    assert [item[3] for item in params[3]] == [975000000000000000, 25000000000000000]
+    assert order[3] == bytes.fromhex("ab" * 65)
+
+
+def test_match_pays_each_payee_once_and_sends_each_nft_to_its_recipient():
+    listing = seaport.fulfillment_order(basic_listing())[0]
+    recipients = [RECIPIENT, "0x4444444444444444444444444444444444444444", "0x5555555555555555555555555555555555555555"]
+    data, value = seaport.match_calldata([(listing, r) for r in recipients], "0x6666666666666666666666666666666666666666")
+    assert data[:10] == "0xf2d12b12"
+
+    orders, _, fulfillments, _ = decode([f"{ADVANCED_ORDER}[]", f"{CRITERIA_RESOLVER}[]", f"{FULFILLMENT}[]", "address"], bytes.fromhex(data[10:]))
+    buyer_order = orders[-1][0]
+    assert value == 3 * 10 ** 18 and buyer_order[2][0][3] == value
+    assert [item[5] for item in buyer_order[3]] == recipients
+    assert len(fulfillments) == 3 + 2  # one per nft, one per payee
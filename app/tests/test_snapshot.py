@@ -0,0 +1,21 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from snapshot import SnapshotReader, write_snapshot
+
+
+def write(directory, i, n=50, dim=8):
+    rng = np.random.default_rng(i)
+    write_snapshot(directory, np.arange(n) + i * n, np.ones(n), ["c"] * n, [str(j) for j in range(n)], rng.standard_normal((n, dim)))
+
+
+def test_concurrent_writers_leave_a_readable_snapshot(tmp_path):
+    directory = str(tmp_path)
+    with ProcessPoolExecutor(8) as pool:
+        list(pool.map(write, [directory] * 200, range(200)))
+
+    catalog = SnapshotReader(directory).catalog()
+    assert catalog is not None and len(catalog) == 50
+    assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
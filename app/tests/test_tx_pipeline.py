@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import pytest
+from web3.exceptions import TransactionNotFound
+
+from tx_pipeline import TxPipeline
+
+
+class FakeEth:
+    """Just enough of w3.eth for the pipeline: a mempool, a block counter and receipts."""
+
+    def __init__(self):
+        self.block_number = 100
+        self.mined_nonce = 0
+        self.pending_nonce = 0
+        self.receipts = {}
+        self.sent = []
+        self.max_priority_fee = 1
+        self.account = SimpleNamespace(sign_transaction=lambda tx, private_key: SimpleNamespace(raw_transaction=tx))
+
+    def get_transaction_count(self, address, block):
+        return self.mined_nonce if block == "latest" else self.pending_nonce
+
+    def get_block(self, block):
+        return {"baseFeePerGas": 10}
+
+    def send_raw_transaction(self, tx):
+        self.sent.append(tx)
+        self.pending_nonce = max(self.pending_nonce, tx["nonce"] + 1)
+        return bytes([len(self.sent)])
+
+    def get_transaction_receipt(self, tx_hash):
+        if tx_hash not in self.receipts:
+            raise TransactionNotFound(tx_hash)
+        return self.receipts[tx_hash]
+
+
+@pytest.fixture
+def eth():
+    return FakeEth()
+
+
+def pipeline(eth, **kwargs):
+    p = TxPipeline(SimpleNamespace(eth=eth), "0xbot", "key", drop_after=12, **kwargs)
+    p.start = lambda: None  # poll by hand
+    return p
+
+
+def test_nonces_are_consecutive(eth):
+    p = pipeline(eth)
+    assert [p.submit({"to": "0x1"}).nonce for _ in range(3)] == [0, 1, 2]
+
+
+def test_lagging_receipt_is_not_a_drop(eth):
+    p = pipeline(eth)
+    tx = p.submit({"to": "0x1"})
+
+    # the nonce node says it's mined, the receipt node hasn't caught up yet
+    eth.mined_nonce = 1
+    p.poll()
+    eth.block_number += 5
+    p.poll()
+    assert not tx.future.done()
+
+    eth.receipts[tx.hash] = {"status": 1, "blockNumber": 101, "transactionHash": bytes([1])}
+    p.poll()
+    assert tx.future.result()["blockNumber"] == 101
+
+
+def test_drop_after_enough_blocks_without_receipt(eth):
+    p = pipeline(eth)
+    tx = p.submit({"to": "0x1"})
+
+    eth.mined_nonce = 1
+    p.poll()
+    eth.block_number += 12
+    p.poll()
+    with pytest.raises(RuntimeError, match="dropped"):
+        tx.future.result(timeout=0)
+    assert p.in_flight() == 0
+
+
+def test_revert_fails_the_future(eth):
+    p = pipeline(eth)
+    tx = p.submit({"to": "0x1"})
+    eth.receipts[tx.hash] = {"status": 0, "blockNumber": 101, "transactionHash": bytes([1])}
+    eth.mined_nonce = 1
+    p.poll()
+    with pytest.raises(RuntimeError, match="reverted"):
+        tx.future.result(timeout=0)
+
+
+def test_shared_nonces_between_pipelines(eth):
+    # two processes sending from the same wallet, the shared store hands out distinct nonces
+    store = {"next": None}
+    locked = []
+
+    class Lock:
+        def __enter__(self):
+            assert not locked
+            locked.append(True)
+
+        def __exit__(self, *exc):
+            locked.pop()
+
+    shared = dict(lock_fn=Lock, load_nonce=lambda: store["next"], save_nonce=lambda n: store.update(next=n))
+    first, second = pipeline(eth, **shared), pipeline(eth, **shared)
+    # the node hasn't seen the first process' transactions yet
+    eth.send_raw_transaction = lambda tx, sent=eth.sent: sent.append(tx) or bytes([len(sent)])
+
+    nonces = [first.submit({"to": "0x1"}).nonce, second.submit({"to": "0x1"}).nonce, first.submit({"to": "0x1"}).nonce]
+    assert nonces == [0, 1, 2]
+
+
+def test_failed_send_leaves_no_gap(eth):
+    p = pipeline(eth)
+    send = eth.send_raw_transaction
+
+    def broken(tx):
+        raise ValueError("insufficient funds")
+
+    eth.send_raw_transaction = broken
+    with pytest.raises(ValueError):
+        p.submit({"to": "0x1"})
+    eth.send_raw_transaction = send
+    assert p.submit({"to": "0x1"}).nonce == 0
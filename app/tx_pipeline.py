@@ -0,0 +1,238 @@
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from web3.exceptions import TransactionNotFound
+
+# Non-blocking transaction sending for one wallet.
+#
+# Nonces come from a counter (synced to the pending nonce on first use and
+# after a drop), fees from a cache refreshed every block or so, so submit()
+# is one sign + one eth_sendRawTransaction. A confirmer thread polls receipts
+# for everything in flight, re-sends transactions that sit unmined for too
+# long with bumped fees (same nonce), and resolves each submission's future
+# with its receipt or an error.
+#
+# With several processes sending from the same wallet, pass lock_fn (a cross
+# process lock, e.g. a postgres advisory lock) and load / save functions that
+# keep the next nonce somewhere they all see. submit() then allocates and
+# sends under that lock and re-reads the node's pending count every time.
+#
+# Transactions from one wallet execute in nonce order, so a transfer can be
+# submitted right behind the buy that gets the nft into the wallet.
+
+
+class NonceManager:
+    """
+    Next nonce for an address. In memory by default (no node round trip per
+    transaction), or in load_fn() / save_fn(nonce) shared between processes,
+    in which case the caller holds a cross process lock around allocate + sent.
+    """
+
+    def __init__(self, w3, address, load_fn=None, save_fn=None):
+        self.w3 = w3
+        self.address = address
+        self.shared = load_fn is not None
+        self._next = None
+        self._load = load_fn or (lambda: self._next)
+        self._save = save_fn or (lambda nonce: setattr(self, "_next", nonce))
+
+    def allocate(self):
+        """The nonce the next transaction should use, call sent() once it went out."""
+        stored = self._load()
+        pending = None
+        if stored is None or self.shared:
+            # other processes may have sent since, ask the node too
+            pending = self.w3.eth.get_transaction_count(self.address, "pending")
+        return max(stored or 0, pending or 0)
+
+    def sent(self, nonce):
+        self._save(max(nonce + 1, self._load() or 0))
+
+    def reset(self):
+        """Re-read the pending nonce on the next allocate (after a dropped transaction)."""
+        self._save(None)
+
+
+class FeeCache:
+    """EIP-1559 fee fields, refreshed at most every ttl seconds."""
+
+    def __init__(self, w3, ttl=12):
+        self.w3 = w3
+        self.ttl = ttl
+        self._fees = None
+        self._fetched = 0
+        self._lock = threading.Lock()
+
+    def fees(self):
+        with self._lock:
+            if self._fees is None or time.time() - self._fetched > self.ttl:
+                base = self.w3.eth.get_block("latest")["baseFeePerGas"]
+                tip = self.w3.eth.max_priority_fee
+                # room for the base fee to double before the transaction is underpriced
+                self._fees = {"maxFeePerGas": 2 * base + tip, "maxPriorityFeePerGas": tip}
+                self._fetched = time.time()
+            return dict(self._fees)
+
+
+class PendingTx:
+    def __init__(self, tx, nonce, label):
+        self.tx = tx
+        self.nonce = nonce
+        self.label = label
+        self.hashes = []  # original first, then replacements
+        self.sent_at = time.time()
+        self.bumps = 0
+        self.nonce_used_at = None  # block where the nonce was first seen used without a receipt for us
+        self.future = Future()
+
+    @property
+    def hash(self):
+        return self.hashes[-1]
+
+
+class TxPipeline:
+
+    def __init__(self, w3, address, private_key, chain_id=1, poll_interval=3, replace_after=180, max_bumps=3,
+                 drop_after=12, lock_fn=None, load_nonce=None, save_nonce=None):
+        """
+        drop_after: blocks a used nonce may go without a receipt for any of our
+        hashes before the transaction counts as dropped (nodes behind a load
+        balancer can lag each other by a few blocks).
+        lock_fn / load_nonce / save_nonce: see the top of the file.
+        """
+        self.w3 = w3
+        self.address = address
+        self.private_key = private_key
+        self.chain_id = chain_id
+        self.poll_interval = poll_interval
+        self.replace_after = replace_after
+        self.max_bumps = max_bumps
+        self.drop_after = drop_after
+        self.lock_fn = lock_fn
+        self.nonces = NonceManager(w3, address, load_nonce, save_nonce)
+        self.fees = FeeCache(w3)
+        self._pending = {}  # nonce -> PendingTx
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._thread = None
+
+    def _send(self, tx):
+        signed = self.w3.eth.account.sign_transaction(tx, private_key=self.private_key)
+        return self.w3.eth.send_raw_transaction(signed.raw_transaction).hex()
+
+    def submit(self, tx, label="tx"):
+        """
+        Sign and send tx (to / value / data / gas) with the next nonce and cached fees.
+        Returns a PendingTx right away; .future resolves to the receipt once mined.
+        """
+        tx = {**tx, "from": self.address, "chainId": self.chain_id, **self.fees.fees()}
+        tx.pop("gasPrice", None)
+
+        with self._send_lock, self._cross_process_lock():
+            nonce = self.nonces.allocate()
+            pending = PendingTx({**tx, "nonce": nonce}, nonce, label)
+            try:
+                pending.hashes.append(self._send(pending.tx))
+            except Exception as e:
+                if "nonce" not in str(e).lower():
+                    raise
+                # something else sent from this wallet, retry once with the node's nonce
+                self.nonces.reset()
+                nonce = self.nonces.allocate()
+                pending = PendingTx({**tx, "nonce": nonce}, nonce, label)
+                pending.hashes.append(self._send(pending.tx))
+            self.nonces.sent(nonce)
+        print(f"{label} sent: {pending.hash} (nonce {nonce})")
+
+        with self._lock:
+            self._pending[nonce] = pending
+        self.start()
+        return pending
+
+    def _cross_process_lock(self):
+        return self.lock_fn() if self.lock_fn is not None else nullcontext()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._pending)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _receipt(self, pending):
+        for tx_hash in pending.hashes:
+            try:
+                return self.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+        return None
+
+    def _replace(self, pending):
+        """Re-send the same nonce with fees bumped past the 10% replacement minimum."""
+        current = self.fees.fees()
+        tx = dict(pending.tx)
+        for field in ("maxFeePerGas", "maxPriorityFeePerGas"):
+            tx[field] = max(int(tx[field] * 1.125) + 1, current[field])
+        try:
+            pending.hashes.append(self._send(tx))
+        except Exception as e:
+            # "nonce too low" means one of the earlier hashes got mined, the next poll finds it
+            print(f"{pending.label} replacement failed: {e}")
+            return
+        pending.tx = tx
+        pending.bumps += 1
+        pending.sent_at = time.time()
+        print(f"{pending.label} replaced: {pending.hash} (nonce {pending.nonce}, bump {pending.bumps})")
+
+    def poll(self):
+        """One confirmer pass over everything in flight."""
+        with self._lock:
+            in_flight = sorted(self._pending.values(), key=lambda p: p.nonce)
+        if not in_flight:
+            return
+
+        block = self.w3.eth.block_number
+        mined_nonce = self.w3.eth.get_transaction_count(self.address, "latest")
+
+        for pending in in_flight:
+            receipt = self._receipt(pending)
+            if receipt is not None:
+                self._finish(pending)
+                if receipt["status"] == 1:
+                    print(f"{pending.label} confirmed in block {receipt['blockNumber']}")
+                    pending.future.set_result(receipt)
+                else:
+                    print(f"{pending.label} reverted: {receipt['transactionHash'].hex()}")
+                    pending.future.set_exception(RuntimeError(f"{pending.label} reverted"))
+            elif pending.nonce < mined_nonce:
+                # the nonce was used but this node has no receipt for our hashes (yet). The nonce and
+                # receipt reads can hit different nodes, so only give up once it stays that way
+                if pending.nonce_used_at is None:
+                    pending.nonce_used_at = block
+                elif block - pending.nonce_used_at >= self.drop_after:
+                    self._finish(pending)
+                    with self._send_lock, self._cross_process_lock():
+                        self.nonces.reset()
+                    pending.future.set_exception(RuntimeError(f"{pending.label} dropped, nonce {pending.nonce} used by another transaction"))
+            elif time.time() - pending.sent_at > self.replace_after:
+                if pending.bumps < self.max_bumps:
+                    self._replace(pending)
+                elif pending.nonce == mined_nonce:
+                    # stuck at the head of the queue, everything behind it waits too
+                    print(f"{pending.label} still unmined after {pending.bumps} fee bumps")
+
+    def _finish(self, pending):
+        with self._lock:
+            self._pending.pop(pending.nonce, None)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"transaction confirmer failed: {e}")
+            time.sleep(self.poll_interval)